@@ -0,0 +1,390 @@
+"""
+Stateful, per-stream anomaly detection over the prediction feed.
+
+Every stream keeps a sliding window of ANOMALY_WINDOW_SECONDS split into
+fixed time buckets (a ring of per-class counts), a running window total, an
+EWMA baseline of per-bucket counts and an EWMA of confidence per class. A
+prediction updates its stream in O(1) (at most one window of buckets is cleared),
+and memory per stream is constant: (buckets x classes) counters plus a few
+per-class vectors.
+
+Two kinds of anomalies are raised:
+- single frames: high-risk classes above the confidence threshold, and any
+  non-normal class above 0.9 (rate-limited to one per class and bucket);
+- rate spikes: a non-normal class whose window count reaches ANOMALY_MIN_COUNT
+  and exceeds ANOMALY_SPIKE_FACTOR times its baseline.
+
+replay_anomalies() applies the same rules to a large historical batch with
+NumPy, without touching the live state.
+"""
+import math
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from backend.serving_config import (
+    ANOMALY_BUCKET_SECONDS,
+    ANOMALY_CONFIDENCE_THRESHOLD,
+    ANOMALY_EWMA_ALPHA,
+    ANOMALY_HIGH_RISK_CLASSES,
+    ANOMALY_MAX_CLASSES,
+    ANOMALY_MAX_STREAMS,
+    ANOMALY_MIN_COUNT,
+    ANOMALY_SPIKE_FACTOR,
+    ANOMALY_WINDOW_SECONDS,
+)
+
+NORMAL_CLASS = 'NormalVideos'
+# Confidence above which any non-normal detection is unusual
+UNUSUAL_CONFIDENCE = 0.9
+# Class slot used once ANOMALY_MAX_CLASSES distinct classes have been seen
+_OTHER_CLASS = '__other__'
+
+
+def risk_level(anomalies: Sequence[Dict]) -> str:
+    """Overall risk level of a set of anomalies."""
+    if any(a['severity'] == 'High' for a in anomalies):
+        return "Critical"
+    if len(anomalies) >= 3:
+        return "High"
+    if anomalies:
+        return "Medium"
+    return "Low"
+
+
+def _single_frame_anomaly(class_name: str, confidence: float, threshold: float,
+                          high_risk: Sequence[str]) -> Optional[Dict]:
+    if class_name in high_risk and confidence > threshold:
+        return {"type": "high_risk_detection", "class": class_name, "confidence": confidence, "severity": "High"}
+    if class_name != NORMAL_CLASS and confidence > UNUSUAL_CONFIDENCE:
+        return {"type": "unusual_activity", "class": class_name, "confidence": confidence, "severity": "Medium"}
+    return None
+
+
+def _record_time(record: Dict) -> float:
+    ts = record.get('ts')
+    if ts is not None:
+        return float(ts)
+    timestamp = record.get('timestamp')
+    if timestamp:
+        try:
+            return datetime.fromisoformat(str(timestamp).replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            pass
+    return math.nan
+
+
+class _StreamWindow:
+    __slots__ = ("counts", "window_counts", "baseline", "confidence_ewma", "seen",
+                 "spiking", "last_alert_bucket", "bucket", "total", "anomalies")
+
+    def __init__(self, buckets: int, classes: int, recent: int):
+        self.counts = np.zeros((buckets, classes), dtype=np.int32)
+        self.window_counts = np.zeros(classes, dtype=np.int64)
+        # EWMA of closed-bucket counts per class
+        self.baseline = np.zeros(classes, dtype=np.float64)
+        self.confidence_ewma = np.zeros(classes, dtype=np.float64)
+        self.seen = np.zeros(classes, dtype=bool)
+        self.spiking = np.zeros(classes, dtype=bool)
+        self.last_alert_bucket = np.full(classes, -1, dtype=np.int64)
+        self.bucket: Optional[int] = None
+        self.total = 0
+        self.anomalies: deque = deque(maxlen=recent)
+
+
+class AnomalyEngine:
+    """Incremental per-stream sliding-window anomaly detection."""
+
+    RECENT_PER_STREAM = 50
+    RECENT_TOTAL = 1000
+
+    def __init__(self, bucket_seconds: float = ANOMALY_BUCKET_SECONDS,
+                 window_seconds: float = ANOMALY_WINDOW_SECONDS,
+                 spike_factor: float = ANOMALY_SPIKE_FACTOR, min_count: int = ANOMALY_MIN_COUNT,
+                 alpha: float = ANOMALY_EWMA_ALPHA, threshold: float = ANOMALY_CONFIDENCE_THRESHOLD,
+                 high_risk_classes: Sequence[str] = ANOMALY_HIGH_RISK_CLASSES,
+                 max_streams: int = ANOMALY_MAX_STREAMS, max_classes: int = ANOMALY_MAX_CLASSES):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = max(1, int(round(window_seconds / bucket_seconds)))
+        self.window_seconds = self.buckets * bucket_seconds
+        self.spike_factor = spike_factor
+        self.min_count = min_count
+        self.alpha = alpha
+        self.threshold = threshold
+        self.high_risk_classes = list(high_risk_classes)
+        self.max_streams = max_streams
+        self.max_classes = max_classes
+
+        self._class_index: Dict[str, int] = {}
+        self._class_names: List[str] = []
+        self._streams: "OrderedDict[str, _StreamWindow]" = OrderedDict()
+        self._recent: deque = deque(maxlen=self.RECENT_TOTAL)
+        self._lock = threading.Lock()
+
+        self.observed = 0
+        self.raised = 0
+
+    def _class_slot(self, class_name: str) -> int:
+        index = self._class_index.get(class_name)
+        if index is None:
+            if len(self._class_names) < self.max_classes - 1:
+                name = class_name
+            else:
+                name = _OTHER_CLASS
+            index = self._class_index.get(name)
+            if index is None:
+                index = len(self._class_names)
+                self._class_names.append(name)
+                self._class_index[name] = index
+            self._class_index.setdefault(class_name, index)
+        return index
+
+    def _stream(self, stream_id: str) -> _StreamWindow:
+        window = self._streams.get(stream_id)
+        if window is None:
+            window = _StreamWindow(self.buckets, self.max_classes, self.RECENT_PER_STREAM)
+            self._streams[stream_id] = window
+            if len(self._streams) > self.max_streams:
+                self._streams.popitem(last=False)
+        else:
+            self._streams.move_to_end(stream_id)
+        return window
+
+    def _advance(self, window: _StreamWindow, bucket: int):
+        """Move the window forward to `bucket`, folding closed buckets into the baseline."""
+        if window.bucket is None:
+            window.bucket = bucket
+            return
+        steps = bucket - window.bucket
+        if steps <= 0:
+            return
+        # Only the current bucket holds counts; every later bucket closes empty
+        closed = window.counts[window.bucket % self.buckets]
+        window.baseline += self.alpha * (closed - window.baseline)
+        if steps > 1:
+            window.baseline *= (1.0 - self.alpha) ** (steps - 1)
+
+        if steps >= self.buckets:
+            window.counts[:] = 0
+            window.window_counts[:] = 0
+        else:
+            expired = (window.bucket + 1 + np.arange(steps)) % self.buckets
+            window.window_counts -= window.counts[expired].sum(axis=0)
+            window.counts[expired] = 0
+        window.bucket = bucket
+
+    def observe(self, stream_id: str, class_name: str, confidence: float,
+                ts: Optional[float] = None, timestamp: Optional[str] = None) -> List[Dict]:
+        """Consume one prediction; returns the anomalies it raised."""
+        ts = datetime.now().timestamp() if ts is None else ts
+        bucket = int(ts // self.bucket_seconds)
+        anomalies = []
+
+        with self._lock:
+            self.observed += 1
+            window = self._stream(stream_id)
+            c = self._class_slot(class_name)
+            self._advance(window, bucket)
+
+            # Late predictions still inside the window count towards their own bucket
+            age = window.bucket - bucket
+            if age < self.buckets:
+                window.counts[bucket % self.buckets, c] += 1
+                window.window_counts[c] += 1
+            window.total += 1
+            if window.seen[c]:
+                window.confidence_ewma[c] += self.alpha * (confidence - window.confidence_ewma[c])
+            else:
+                window.confidence_ewma[c] = confidence
+                window.seen[c] = True
+
+            anomaly = _single_frame_anomaly(class_name, confidence, self.threshold, self.high_risk_classes)
+            if anomaly is not None and window.last_alert_bucket[c] != window.bucket:
+                window.last_alert_bucket[c] = window.bucket
+                anomalies.append(anomaly)
+
+            if class_name != NORMAL_CLASS:
+                count = int(window.window_counts[c])
+                expected = float(window.baseline[c]) * self.buckets
+                spiking = count >= self.min_count and count > self.spike_factor * expected
+                if spiking and not window.spiking[c]:
+                    anomalies.append({
+                        "type": "rate_spike",
+                        "class": class_name,
+                        "confidence": float(window.confidence_ewma[c]),
+                        "severity": "High" if class_name in self.high_risk_classes else "Medium",
+                        "count": count,
+                        "expected": expected,
+                        "window_seconds": self.window_seconds
+                    })
+                window.spiking[c] = spiking
+
+            if anomalies and not timestamp:
+                timestamp = datetime.fromtimestamp(ts).isoformat()
+            for anomaly in anomalies:
+                anomaly["timestamp"] = timestamp
+                anomaly["stream_id"] = stream_id
+                window.anomalies.append(anomaly)
+                self._recent.append(anomaly)
+            self.raised += len(anomalies)
+        return anomalies
+
+    def stream_state(self, stream_id: str) -> Optional[Dict]:
+        """Current window counts, rates and confidence EWMAs of a stream."""
+        with self._lock:
+            window = self._streams.get(stream_id)
+            if window is None:
+                return None
+            classes = {}
+            for c, name in enumerate(self._class_names):
+                if not window.seen[c]:
+                    continue
+                classes[name] = {
+                    'window_count': int(window.window_counts[c]),
+                    'rate_per_minute': float(window.window_counts[c]) * 60.0 / self.window_seconds,
+                    'baseline_per_window': float(window.baseline[c]) * self.buckets,
+                    'confidence_ewma': float(window.confidence_ewma[c]),
+                    'spiking': bool(window.spiking[c])
+                }
+            return {'stream_id': stream_id, 'total': window.total, 'classes': classes}
+
+    def recent(self, stream_id: Optional[str] = None, limit: int = 100) -> List[Dict]:
+        """Most recent live anomalies, newest first."""
+        with self._lock:
+            if stream_id is None:
+                source = self._recent
+            else:
+                window = self._streams.get(stream_id)
+                source = window.anomalies if window is not None else ()
+            return list(reversed(source))[:limit]
+
+    def replay(self, records: Sequence[Dict], threshold: Optional[float] = None) -> List[Dict]:
+        """Bulk mode with this engine's settings; see replay_anomalies."""
+        return replay_anomalies(
+            records, self.threshold if threshold is None else threshold, self.high_risk_classes,
+            self.bucket_seconds, self.buckets, self.spike_factor, self.min_count
+        )
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'streams': len(self._streams),
+                'max_streams': self.max_streams,
+                'classes': len(self._class_names),
+                'window_seconds': self.window_seconds,
+                'observed': self.observed,
+                'anomalies': self.raised
+            }
+
+
+def replay_anomalies(records: Sequence[Dict], threshold: float = ANOMALY_CONFIDENCE_THRESHOLD,
+                     high_risk_classes: Sequence[str] = ANOMALY_HIGH_RISK_CLASSES,
+                     bucket_seconds: float = ANOMALY_BUCKET_SECONDS,
+                     buckets: int = max(1, int(round(ANOMALY_WINDOW_SECONDS / ANOMALY_BUCKET_SECONDS))),
+                     spike_factor: float = ANOMALY_SPIKE_FACTOR,
+                     min_count: int = ANOMALY_MIN_COUNT) -> List[Dict]:
+    """
+    Vectorized anomaly detection over a batch of prediction records.
+
+    Single-frame rules match AnomalyEngine.observe (without rate limiting).
+    Rate spikes are evaluated per stream at bucket granularity, against the mean
+    bucket count before each window instead of an EWMA. Results follow input order.
+    Module-level so it can run in a process pool.
+    """
+    n = len(records)
+    if n == 0:
+        return []
+
+    class_names, class_idx = np.unique(
+        np.array([str(r.get('predicted_class', '')) for r in records], dtype=object), return_inverse=True
+    )
+    confidence = np.fromiter((float(r.get('confidence', 0.0) or 0.0) for r in records), dtype=np.float64, count=n)
+    high_risk = np.isin(class_names.astype(str), list(high_risk_classes))[class_idx]
+    normal_classes = class_names.astype(str) == NORMAL_CLASS
+    normal = normal_classes[class_idx]
+
+    high = high_risk & (confidence > threshold)
+    unusual = ~high & ~normal & (confidence > UNUSUAL_CONFIDENCE)
+
+    found = []
+    for position in np.flatnonzero(high | unusual):
+        found.append((int(position), {
+            "type": "high_risk_detection" if high[position] else "unusual_activity",
+            "class": str(class_names[class_idx[position]]),
+            "confidence": float(confidence[position]),
+            "severity": "High" if high[position] else "Medium"
+        }))
+
+    # Rate spikes per stream
+    ts = np.fromiter((_record_time(r) for r in records), dtype=np.float64, count=n)
+    valid = ~np.isnan(ts)
+    if valid.any():
+        stream_names, stream_idx = np.unique(
+            np.array([str(r.get('stream_id') or '') for r in records], dtype=object), return_inverse=True
+        )
+        bucket = np.zeros(n, dtype=np.int64)
+        bucket[valid] = np.floor(ts[valid] / bucket_seconds).astype(np.int64)
+        n_classes = len(class_names)
+
+        for s in range(len(stream_names)):
+            positions = np.flatnonzero(valid & (stream_idx == s))
+            if len(positions) < min_count:
+                continue
+            unique_buckets, bucket_pos = np.unique(bucket[positions], return_inverse=True)
+            counts = np.zeros((len(unique_buckets), n_classes), dtype=np.int64)
+            np.add.at(counts, (bucket_pos, class_idx[positions]), 1)
+
+            cumulative = np.vstack([np.zeros((1, n_classes), dtype=np.int64), counts.cumsum(axis=0)])
+            window_start = unique_buckets - buckets + 1
+            left = np.searchsorted(unique_buckets, window_start)
+            window = cumulative[1:] - cumulative[left]
+            elapsed = np.clip(window_start - unique_buckets[0], 0, None).astype(np.float64)
+            before = cumulative[left].astype(np.float64)
+            baseline = np.divide(before, elapsed[:, None], out=np.zeros_like(before), where=elapsed[:, None] > 0)
+
+            spiking = (window >= min_count) & (window > spike_factor * baseline * buckets)
+            spiking[:, normal_classes] = False
+            previous = np.zeros_like(spiking)
+            if len(unique_buckets) > 1:
+                contiguous = (np.diff(unique_buckets) < buckets)[:, None]
+                previous[1:] = spiking[:-1] & contiguous
+            for k, c in zip(*np.nonzero(spiking & ~previous)):
+                in_bucket = positions[bucket_pos == k]
+                members = in_bucket[class_idx[in_bucket] == c]
+                # A spike can start in a bucket without records of its class
+                # (when the baseline drops); it is then reported at the bucket's last record
+                position = int(members[-1]) if len(members) else int(in_bucket[-1])
+                members = members if len(members) else positions[class_idx[positions] == c]
+                class_name = str(class_names[c])
+                found.append((position, {
+                    "type": "rate_spike",
+                    "class": class_name,
+                    "confidence": float(confidence[members].mean()),
+                    "severity": "High" if class_name in high_risk_classes else "Medium",
+                    "count": int(window[k, c]),
+                    "expected": float(baseline[k, c] * buckets),
+                    "window_seconds": buckets * bucket_seconds,
+                    "stream_id": str(stream_names[s]) or None
+                }))
+
+    found.sort(key=lambda item: item[0])
+    anomalies = []
+    for position, anomaly in found:
+        anomaly.setdefault("timestamp", records[position].get('timestamp', datetime.now().isoformat()))
+        anomalies.append(anomaly)
+    return anomalies
+
+
+# Global anomaly engine instance
+_engine_instance = None
+
+
+def get_anomaly_engine():
+    """Get or create the global anomaly engine."""
+    global _engine_instance
+    if _engine_instance is None:
+        _engine_instance = AnomalyEngine()
+    return _engine_instance
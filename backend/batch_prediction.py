@@ -0,0 +1,453 @@
+"""
+Streaming bulk prediction for /api/predict/batch.
+
+The multipart request body is parsed incrementally: each uploaded file is
+handed on as soon as its last byte arrives, instead of after the whole form
+has been spooled. A ByteBudget shared by all batch requests caps the upload
+bytes and decoded pixels held in memory; while it is exhausted the request
+body is simply not read any further, so TCP flow control pushes back on the
+client. A file that has started to be admitted is received to its end (at most
+BATCH_MAX_FILE_MB past the budget per request), so partial files cannot hold
+the whole budget while every reader waits.
+
+Files are decoded in parallel (in the execution layer's CPU pool) while
+earlier chunks run through the network, and results are produced in upload
+order, one chunk of up to BATCH_PREDICT_CHUNK_SIZE images per forward pass.
+"""
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    import multipart
+    from multipart.multipart import parse_options_header
+
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
+
+from backend.metrics import get_metrics
+from backend.serving_config import (
+    BATCH_MAX_FILE_MB,
+    BATCH_MAX_INFLIGHT_MB,
+    BATCH_PREDICT_CHUNK_SIZE,
+    BATCH_PREDICT_MAX_WAIT_MS,
+)
+
+
+class BatchFormatError(ValueError):
+    """Raised when a batch upload is not a valid multipart/form-data body."""
+
+
+class ByteBudget:
+    """
+    Async limit on bytes held in memory, granted in FIFO order.
+    A request larger than the whole budget is admitted once nothing else is held.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.peak = 0
+        self.waits = 0
+        self._waiters: deque = deque()
+
+    async def acquire(self, size: int):
+        if not self._waiters and self._fits(size):
+            self._take(size)
+            return
+        self.waits += 1
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((size, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Granted just before the cancellation arrived
+            if future.done() and not future.cancelled():
+                self.release(size)
+            raise
+
+    def reserve(self, size: int):
+        """Charge bytes without waiting (may temporarily exceed the budget)."""
+        self._take(size)
+
+    def release(self, size: int):
+        if size <= 0:
+            return
+        self.used -= size
+        while self._waiters:
+            size, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(size):
+                break
+            self._waiters.popleft()
+            self._take(size)
+            future.set_result(None)
+
+    def _fits(self, size: int) -> bool:
+        return self.used == 0 or self.used + size <= self.max_bytes
+
+    def _take(self, size: int):
+        self.used += size
+        self.peak = max(self.peak, self.used)
+
+    def get_stats(self) -> Dict:
+        return {
+            'max_mb': self.max_bytes / (1024 * 1024),
+            'used_mb': self.used / (1024 * 1024),
+            'peak_mb': self.peak / (1024 * 1024),
+            'waits': self.waits,
+            'waiting': len(self._waiters)
+        }
+
+
+class Upload:
+    """One uploaded file; charged is the number of budget bytes it currently holds."""
+
+    __slots__ = ("index", "filename", "data", "charged", "error", "image")
+
+    def __init__(self, index: int, filename: str, data: Optional[bytearray], charged: int,
+                 error: Optional[str] = None):
+        self.index = index
+        self.filename = filename
+        self.data = data
+        self.charged = charged
+        self.error = error
+        self.image = None
+
+
+class BatchItem(NamedTuple):
+    """Outcome for one upload: either a prediction result or an error message."""
+    index: int
+    filename: str
+    result: Optional[Dict]
+    error: Optional[str]
+
+
+class _MultipartReader:
+    """Feeds request chunks to python-multipart and collects completed file parts."""
+
+    def __init__(self, boundary: bytes, budget: ByteBudget, max_file_bytes: int):
+        self.budget = budget
+        self.max_file_bytes = max_file_bytes
+        self.completed: deque = deque()
+        self.parts = 0
+
+        self._header_field = b""
+        self._header_value = b""
+        self._filename: Optional[str] = None
+        self._buffer: Optional[bytearray] = None
+        self._too_large = False
+        # Bytes of the current chunk that went into file data (those stay charged),
+        # in total and for the file still being received
+        self._kept = 0
+        self._part_kept = 0
+        # Whether the current chunk, and the file being received, got budget by waiting
+        self._chunk_granted = False
+        self._part_granted = False
+
+        self._parser = multipart.MultipartParser(boundary, {
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end,
+        })
+
+    async def feed(self, chunk: bytes):
+        # The whole chunk is charged before parsing; boundaries, headers and
+        # skipped parts are given back right away
+        if self._buffer is not None and self._part_granted:
+            # The rest of a file admitted by the budget goes past it: readers that
+            # wait while holding partial files could fill the budget and never resume
+            self.budget.reserve(len(chunk))
+            self._chunk_granted = False
+        else:
+            await self.budget.acquire(len(chunk))
+            self._chunk_granted = self._part_granted = True
+        self._kept = 0
+        self._part_kept = 0
+        try:
+            self._parser.write(chunk)
+        except Exception as e:
+            raise BatchFormatError(f"Malformed multipart body: {e}")
+        finally:
+            # The parser may hand on bytes it held back from the previous chunk
+            surplus = len(chunk) - self._kept
+            if surplus >= 0:
+                self.budget.release(surplus)
+            else:
+                self.budget.reserve(-surplus)
+
+    def finish(self):
+        self._parser.finalize()
+        if self._buffer is not None:
+            raise BatchFormatError("Multipart body ended in the middle of a file")
+
+    def discard(self):
+        """Release the partially received file and files that were never handed on."""
+        if self._buffer is not None:
+            self.budget.release(len(self._buffer))
+            self._buffer = None
+        while self.completed:
+            self.budget.release(self.completed.popleft().charged)
+
+    def _on_part_begin(self):
+        self._filename = None
+        self._too_large = False
+        self._part_kept = 0
+        # A file starting in a chunk that went past the budget waits with its next chunk
+        self._part_granted = self._chunk_granted
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        if self._header_field.lower() == b"content-disposition":
+            _, options = parse_options_header(self._header_value)
+            if b"filename" in options:
+                self._filename = options[b"filename"].decode("utf-8", "replace")
+                self._buffer = bytearray()
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        # Form fields without a filename are ignored
+        if self._buffer is None:
+            return
+        if self._too_large:
+            return
+        size = end - start
+        if len(self._buffer) + size > self.max_file_bytes:
+            # Drop the file; bytes from earlier chunks are released here, this chunk's by feed()
+            self._too_large = True
+            self.budget.release(len(self._buffer) - self._part_kept)
+            self._kept -= self._part_kept
+            self._part_kept = 0
+            self._buffer = bytearray()
+            return
+        self._buffer += data[start:end]
+        self._kept += size
+        self._part_kept += size
+
+    def _on_part_end(self):
+        if self._buffer is None:
+            return
+        index = self.parts
+        self.parts += 1
+        if self._too_large:
+            limit_mb = self.max_file_bytes / (1024 * 1024)
+            self.completed.append(Upload(index, self._filename, None, 0, f"File exceeds {limit_mb:g} MB"))
+        else:
+            self.completed.append(Upload(index, self._filename, self._buffer, len(self._buffer)))
+        self._buffer = None
+
+
+def multipart_boundary(content_type: str) -> bytes:
+    """Boundary of a multipart/form-data Content-Type header."""
+    media_type, options = parse_options_header(content_type or "")
+    boundary = options.get(b"boundary")
+    if media_type != b"multipart/form-data" or not boundary:
+        raise BatchFormatError("Expected a multipart/form-data body with files")
+    return boundary
+
+
+async def iter_uploads(body: AsyncIterator[bytes], content_type: str, budget: ByteBudget,
+                       max_file_bytes: int) -> AsyncIterator[Upload]:
+    """Yield uploaded files as soon as each one has been received completely."""
+    reader = _MultipartReader(multipart_boundary(content_type), budget, max_file_bytes)
+    try:
+        async for chunk in body:
+            if not chunk:
+                continue
+            await reader.feed(chunk)
+            while reader.completed:
+                yield reader.completed.popleft()
+        reader.finish()
+        while reader.completed:
+            yield reader.completed.popleft()
+    finally:
+        reader.discard()
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse for handlers that keep reading the request body while
+    streaming. The stock response starts a disconnect listener that would
+    consume the remaining body messages; here a disconnect surfaces as
+    ClientDisconnect from request.stream() or as OSError from send.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
+
+
+class BatchPredictor:
+    """Decodes uploads in parallel and runs them through the model in fixed-size chunks."""
+
+    def __init__(self, decode: Callable[[bytes], Awaitable], infer: Callable[[List], Awaitable[List[Dict]]],
+                 budget: Optional[ByteBudget] = None, chunk_size: int = BATCH_PREDICT_CHUNK_SIZE,
+                 max_wait_ms: float = BATCH_PREDICT_MAX_WAIT_MS,
+                 max_file_mb: float = BATCH_MAX_FILE_MB):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self.decode = decode
+        self.infer = infer
+        self.budget = budget or ByteBudget(int(BATCH_MAX_INFLIGHT_MB * 1024 * 1024))
+        self.chunk_size = chunk_size
+        self.max_wait = max(max_wait_ms, 0.0) / 1000.0
+        self.max_file_bytes = int(max_file_mb * 1024 * 1024)
+
+        self.requests = 0
+        self.images_processed = 0
+        self.chunks_run = 0
+
+    async def predict(self, body: AsyncIterator[bytes], content_type: str) -> AsyncIterator[BatchItem]:
+        """Yield one BatchItem per uploaded file, in upload order, while the body is still arriving."""
+        uploads = iter_uploads(body, content_type, self.budget, self.max_file_bytes)
+        # Bounded by the byte budget; the count limit keeps task bookkeeping small
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.chunk_size * 4)
+        producer = asyncio.create_task(self._produce(uploads, queue))
+        self.requests += 1
+        pending: List = []
+        try:
+            while True:
+                chunk = await self._collect_chunk(queue, producer)
+                if not chunk:
+                    break
+                pending = chunk
+                for item in await self._run_chunk(chunk):
+                    yield item
+                pending = []
+            # Surface parse errors and client disconnects
+            await producer
+        finally:
+            producer.cancel()
+            for upload, task in pending:
+                task.cancel()
+                self._release(upload)
+            while not queue.empty():
+                upload, task = queue.get_nowait()
+                task.cancel()
+                self._release(upload)
+
+    async def _produce(self, uploads: AsyncIterator[Upload], queue: asyncio.Queue):
+        try:
+            async for upload in uploads:
+                task = asyncio.create_task(self._decode(upload))
+                try:
+                    await queue.put((upload, task))
+                except asyncio.CancelledError:
+                    task.cancel()
+                    self._release(upload)
+                    raise
+        finally:
+            await uploads.aclose()
+
+    async def _decode(self, upload: Upload):
+        if upload.data is None:
+            return
+        try:
+            with get_metrics().stage("batch_image_decode"):
+                upload.image = await self.decode(upload.data)
+            if upload.image is None:
+                upload.error = "Invalid image file"
+        except Exception as e:
+            upload.error = str(e)
+        finally:
+            upload.data = None
+        # From here on the decoded pixels are what is held in memory
+        self._release(upload)
+        if upload.image is not None:
+            upload.charged = upload.image.pixels.nbytes
+            self.budget.reserve(upload.charged)
+
+    async def _collect_chunk(self, queue: asyncio.Queue, producer: asyncio.Task) -> List:
+        """Wait for one upload, then gather more until the chunk is full or the wait expires."""
+        loop = asyncio.get_running_loop()
+        first = await self._next(queue, producer, None)
+        if first is None:
+            return []
+        chunk = [first]
+        deadline = loop.time() + self.max_wait
+        while len(chunk) < self.chunk_size:
+            # Take everything that is already queued before waiting at all
+            if not queue.empty():
+                chunk.append(queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            entry = await self._next(queue, producer, remaining)
+            if entry is None:
+                break
+            chunk.append(entry)
+        return chunk
+
+    @staticmethod
+    async def _next(queue: asyncio.Queue, producer: asyncio.Task, timeout: Optional[float]):
+        """Next queued upload, or None on timeout or once the body is exhausted."""
+        if not queue.empty():
+            return queue.get_nowait()
+        if producer.done():
+            return None
+        getter = asyncio.ensure_future(queue.get())
+        try:
+            done, _ = await asyncio.wait({getter, producer}, timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not getter.done():
+                getter.cancel()
+        if getter in done:
+            return getter.result()
+        return queue.get_nowait() if not queue.empty() else None
+
+    async def _run_chunk(self, chunk: List) -> List[BatchItem]:
+        await asyncio.gather(*(task for _, task in chunk))
+        uploads = [upload for upload, _ in chunk]
+        decoded = [upload for upload in uploads if upload.image is not None]
+        results: Dict[int, Dict] = {}
+        chunk_error = None
+        if decoded:
+            try:
+                predictions = await self.infer([upload.image.pixels for upload in decoded])
+                results = {upload.index: result for upload, result in zip(decoded, predictions)}
+                self.chunks_run += 1
+                self.images_processed += len(decoded)
+            except Exception as e:
+                chunk_error = str(e)
+
+        items = []
+        for upload in uploads:
+            self._release(upload)
+            upload.image = None
+            error = upload.error or (chunk_error if upload.index not in results else None)
+            items.append(BatchItem(upload.index, upload.filename, results.get(upload.index), error))
+        return items
+
+    def _release(self, upload: Upload):
+        self.budget.release(upload.charged)
+        upload.charged = 0
+
+    def get_stats(self) -> Dict:
+        return {
+            'requests': self.requests,
+            'images_processed': self.images_processed,
+            'chunks_run': self.chunks_run,
+            'average_chunk_size': (self.images_processed / self.chunks_run) if self.chunks_run else 0.0,
+            'chunk_size': self.chunk_size,
+            'memory': self.budget.get_stats()
+        }
@@ -7,149 +7,19 @@ Uses RAG (Retrieval Augmented Generation) to answer questions about:
 - Model information
 """
 import os
-from openai import OpenAI
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, List, Optional
 from datetime import datetime
 import json
 import re
 
-from backend.config import OPENAI_API_KEY
+from backend.conversation_store import DEFAULT_SESSION, get_conversation_store
+from backend.llm_gateway import get_llm_gateway
+from backend.metrics import get_metrics
+from backend.prompt_builder import BuiltPrompt, ContextItem, PromptBuilder
+from backend.retrieval import ContextRetriever
 
 
-class SystemAwareChatbot:
-    """Chatbot that understands the entire security system context."""
-    
-    def __init__(self):
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
-        self.conversation_history = []
-    
-    def retrieve_context(self, query: str, predictions: List[Dict], alerts: List[Dict], 
-                        historical_data: List[Dict], stats: Optional[Dict]) -> Dict:
-        """Retrieve relevant context from system data based on query."""
-        
-        query_lower = query.lower()
-        context = {
-            'relevant_predictions': [],
-            'relevant_alerts': [],
-            'system_stats': stats or {},
-            'summary': ''
-        }
-        
-        # Extract keywords from query
-        crime_types = ['abuse', 'arrest', 'arson', 'assault', 'burglary', 'explosion', 
-                      'fighting', 'robbery', 'shooting', 'shoplifting', 'stealing', 
-                      'steal', 'vandalism', 'roadaccidents', 'road accidents', 'accident', 'accidents']
-        
-        # Find relevant predictions
-        for pred in predictions[:50]:  # Check recent 50 predictions
-            pred_class = pred.get('predicted_class', '').lower()
-            confidence = pred.get('confidence', 0)
-            timestamp = pred.get('timestamp', '')
-            
-            # Match by crime type
-            if any(crime in query_lower for crime in crime_types):
-                if any(crime in pred_class for crime in crime_types):
-                    context['relevant_predictions'].append({
-                        'class': pred.get('predicted_class'),
-                        'confidence': confidence,
-                        'timestamp': timestamp,
-                        'explanation': pred.get('explanation')
-                    })
-            
-            # Match by keywords
-            elif any(keyword in query_lower for keyword in ['recent', 'latest', 'last', 'new']):
-                context['relevant_predictions'].append({
-                    'class': pred.get('predicted_class'),
-                    'confidence': confidence,
-                    'timestamp': timestamp
-                })
-        
-        # Find relevant alerts
-        for alert in alerts[:20]:  # Check recent 20 alerts
-            alert_type = alert.get('type', '').lower()
-            message = alert.get('message', '').lower()
-            
-            if any(crime in query_lower for crime in crime_types):
-                if any(crime in alert_type for crime in crime_types):
-                    context['relevant_alerts'].append({
-                        'type': alert.get('type'),
-                        'message': alert.get('message'),
-                        'severity': alert.get('severity'),
-                        'timestamp': alert.get('timestamp'),
-                        'confidence': alert.get('confidence')
-                    })
-        
-        # Generate summary statistics
-        if historical_data:
-            class_counts = {}
-            for entry in historical_data:
-                class_name = entry.get('predicted_class', 'Unknown')
-                class_counts[class_name] = class_counts.get(class_name, 0) + 1
-            
-            context['summary'] = f"Total incidents: {len(historical_data)}. "
-            if class_counts:
-                most_common = max(class_counts.items(), key=lambda x: x[1])
-                context['summary'] += f"Most common: {most_common[0]} ({most_common[1]} occurrences). "
-                context['summary'] += f"Crime types detected: {', '.join(list(class_counts.keys())[:5])}"
-            else:
-                context['summary'] += "No crime types detected yet."
-        
-        return context
-    
-    def generate_response(self, query: str, context: Dict, conversation_history: List[Dict] = None) -> Dict:
-        """Generate intelligent response using system context."""
-        
-        # Build context string
-        context_str = "SYSTEM CONTEXT:\n"
-        context_str += "=" * 50 + "\n"
-        
-        # Add system statistics
-        if context.get('system_stats'):
-            stats = context['system_stats']
-            context_str += f"System Status: Model loaded: {stats.get('model_loaded', False)}\n"
-            classes = stats.get('classes', [])
-            if classes:
-                context_str += f"Available Crime Classes: {', '.join(classes)}\n"
-        
-        # Add relevant predictions
-        if context.get('relevant_predictions'):
-            context_str += f"\nRelevant Recent Predictions ({len(context['relevant_predictions'])}):\n"
-            for i, pred in enumerate(context['relevant_predictions'][:5], 1):
-                context_str += f"{i}. {pred['class']} (Confidence: {pred['confidence']:.1%}, Time: {pred['timestamp'][:19] if pred.get('timestamp') else 'N/A'})\n"
-                if pred.get('explanation'):
-                    exp = pred['explanation']
-                    if isinstance(exp, dict):
-                        exp_data = exp.get('explanation', {})
-                        if isinstance(exp_data, dict):
-                            context_str += f"   Reason: {exp_data.get('summary', 'N/A')}\n"
-                            key_indicators = exp_data.get('keyIndicators', [])
-                            if key_indicators:
-                                context_str += f"   Key Indicators: {', '.join(key_indicators)}\n"
-                            # Add recommended action and immediate steps for more context
-                            recommended_action = exp_data.get('recommendedAction', '')
-                            if recommended_action:
-                                context_str += f"   Recommended Action: {recommended_action}\n"
-                            immediate_steps = exp_data.get('immediateSteps', [])
-                            if immediate_steps:
-                                context_str += f"   Immediate Steps: {', '.join(immediate_steps)}\n"
-        
-        # Add relevant alerts
-        if context.get('relevant_alerts'):
-            context_str += f"\nRelevant Alerts ({len(context['relevant_alerts'])}):\n"
-            for i, alert in enumerate(context['relevant_alerts'][:5], 1):
-                context_str += f"{i}. {alert['type']} - {alert['message']} (Severity: {alert['severity']}, Time: {alert['timestamp'][:19] if alert.get('timestamp') else 'N/A'})\n"
-        
-        # Add summary
-        if context.get('summary'):
-            context_str += f"\nSummary: {context['summary']}\n"
-        
-        context_str += "=" * 50 + "\n"
-        
-        # Build conversation history
-        messages = [
-            {
-                "role": "system",
-                "content": """You are an intelligent security system assistant for a Smart Predictive Field Intelligence System. 
+CHATBOT_SYSTEM_PROMPT = """You are an intelligent security system assistant for a Smart Predictive Field Intelligence System. 
 You have access to real-time predictions, alerts, and historical data from a crime detection AI system.
 
 Your capabilities:
@@ -168,74 +38,208 @@ CRITICAL INSTRUCTIONS:
 - Always include specific details from the key indicators when explaining causes or reasons for incidents.
 
 Be helpful, accurate, and concise. Use the provided context to answer questions with confidence and specific details."""
-            }
-        ]
-        
-        # Add conversation history (last 5 messages for context)
-        if conversation_history:
-            for msg in conversation_history[-5:]:
-                messages.append(msg)
-        
-        # Add current query with context
-        user_message = f"""{context_str}
 
-USER QUESTION: {query}
-
-INSTRUCTIONS FOR YOUR RESPONSE:
-- Answer with complete confidence based on the system's detections and key indicators provided above.
+# Sent once in the system message instead of being repeated around every question
+CHATBOT_RESPONSE_INSTRUCTIONS = """INSTRUCTIONS FOR YOUR RESPONSE:
+- Answer with complete confidence based on the system's detections and key indicators provided in the SYSTEM CONTEXT.
 - For questions about causes (e.g., "What caused the car accident?"), analyze ALL key indicators from the relevant predictions and provide a detailed explanation.
 - Reference specific key indicators by name (e.g., "reckless driving behavior", "high vehicle speed", "aggressive lane changes").
 - NEVER say "not available", "not clear", "unable to determine", "specific details are not available", or express uncertainty.
 - If multiple incidents are mentioned, provide details for each one separately.
 - Present information as definitive facts based on the system's analysis, not as possibilities.
 
-Provide a confident, detailed answer based on the system context above."""
-        messages.append({"role": "user", "content": user_message})
+Provide a confident, detailed answer based on the SYSTEM CONTEXT."""
+
+
+class SystemAwareChatbot:
+    """Chatbot that understands the entire security system context."""
+    
+    def __init__(self):
+        self.llm = get_llm_gateway()
+        # Static prompt sections are registered once and reused by every call
+        self.prompts = PromptBuilder()
+        self.prompts.register('chatbot_system', CHATBOT_SYSTEM_PROMPT)
+        self.prompts.register('chatbot_instructions', CHATBOT_RESPONSE_INSTRUCTIONS)
+        # Conversation history per session id
+        self.conversations = get_conversation_store()
+        # Server-side IncidentStore (see incident_store property); used when the client sends no data
+        self.retriever = ContextRetriever()
+    
+    @property
+    def incident_store(self):
+        return self.retriever.store
+    
+    @incident_store.setter
+    def incident_store(self, store):
+        self.retriever.store = store
+    
+    def retrieve_context(self, query: str, predictions: List[Dict], alerts: List[Dict], 
+                        historical_data: List[Dict], stats: Optional[Dict]) -> Dict:
+        """Retrieve relevant context from system data based on query."""
+        # Client-provided lists take precedence; otherwise the server-side IncidentStore indexes are used
+        with get_metrics().stage("chat_retrieval"):
+            return self.retriever.retrieve(query, predictions, alerts, historical_data, stats)
+    
+    def _context_items(self, context: Dict) -> List[ContextItem]:
+        """Split the retrieved context into items the prompt builder can rank and trim."""
+        items = []
         
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                temperature=0.7,
-                max_tokens=500
+        # Add system statistics
+        if context.get('system_stats'):
+            stats = context['system_stats']
+            text = f"System Status: Model loaded: {stats.get('model_loaded', False)}"
+            classes = stats.get('classes', [])
+            if classes:
+                text += f"\nAvailable Crime Classes: {', '.join(classes)}"
+            items.append(ContextItem(text, 100.0))
+        
+        # Add relevant predictions (those with explanations are the most useful)
+        predictions = context.get('relevant_predictions') or []
+        group = f"\nRelevant Recent Predictions ({len(predictions)}):"
+        for i, pred in enumerate(predictions, 1):
+            text = f"{i}. {pred['class']} (Confidence: {pred['confidence']:.1%}, Time: {pred['timestamp'][:19] if pred.get('timestamp') else 'N/A'})"
+            exp = pred.get('explanation')
+            if isinstance(exp, dict):
+                exp_data = exp.get('explanation', {})
+                if isinstance(exp_data, dict):
+                    text += f"\n   Reason: {exp_data.get('summary', 'N/A')}"
+                    key_indicators = exp_data.get('keyIndicators', [])
+                    if key_indicators:
+                        text += f"\n   Key Indicators: {', '.join(key_indicators)}"
+                    # Add recommended action and immediate steps for more context
+                    recommended_action = exp_data.get('recommendedAction', '')
+                    if recommended_action:
+                        text += f"\n   Recommended Action: {recommended_action}"
+                    immediate_steps = exp_data.get('immediateSteps', [])
+                    if immediate_steps:
+                        text += f"\n   Immediate Steps: {', '.join(immediate_steps)}"
+                    items.append(ContextItem(text, 60.0 - i, group))
+                    continue
+            items.append(ContextItem(text, 50.0 - i, group))
+        
+        # Add relevant alerts
+        alerts = context.get('relevant_alerts') or []
+        group = f"\nRelevant Alerts ({len(alerts)}):"
+        for i, alert in enumerate(alerts, 1):
+            text = f"{i}. {alert['type']} - {alert['message']} (Severity: {alert['severity']}, Time: {alert['timestamp'][:19] if alert.get('timestamp') else 'N/A'})"
+            items.append(ContextItem(text, 45.0 - i, group))
+        
+        # Add summary
+        if context.get('summary'):
+            items.append(ContextItem(f"\nSummary: {context['summary']}", 90.0))
+        return items
+    
+    def build_prompt(self, query: str, context: Dict, conversation_history: List[Dict] = None) -> BuiltPrompt:
+        """Build the chat messages (system prompt, history, context and question) within the token budget."""
+        with get_metrics().stage("chat_prompt"):
+            return self.prompts.build(
+                ('chatbot_system', 'chatbot_instructions'),
+                query,
+                context_items=self._context_items(context),
+                history=conversation_history or [],
+                context_header="SYSTEM CONTEXT:\n" + "=" * 50,
+                context_footer="=" * 50
             )
-            
-            answer = response.choices[0].message.content.strip()
-            
-            return {
-                'answer': answer,
-                'timestamp': datetime.now().isoformat(),
-                'context_used': {
-                    'predictions_count': len(context.get('relevant_predictions', [])),
-                    'alerts_count': len(context.get('relevant_alerts', []))
-                }
+    
+    def build_messages(self, query: str, context: Dict, conversation_history: List[Dict] = None) -> List[Dict]:
+        """Build the chat messages (system prompt, history, context and question)."""
+        return self.build_prompt(query, context, conversation_history).messages
+    
+    def _completion_kwargs(self, messages: List[Dict]) -> Dict:
+        return {
+            'model': "gpt-3.5-turbo",
+            'messages': messages,
+            'temperature': 0.7,
+            'max_tokens': 500
+        }
+    
+    def _format_response(self, answer: str, context: Dict, prompt: BuiltPrompt) -> Dict:
+        return {
+            'answer': answer,
+            'timestamp': datetime.now().isoformat(),
+            'context_used': {
+                'predictions_count': len(context.get('relevant_predictions', [])),
+                'alerts_count': len(context.get('relevant_alerts', [])),
+                'context_items': prompt.context_items,
+                'dropped_context_items': prompt.dropped_items,
+                'prompt_tokens': prompt.prompt_tokens
             }
+        }
+    
+    def _format_error(self, error: Exception) -> Dict:
+        return {
+            'answer': f"I apologize, but I encountered an error: {str(error)}",
+            'timestamp': datetime.now().isoformat(),
+            'error': True
+        }
+    
+    def generate_response(self, query: str, context: Dict, conversation_history: List[Dict] = None) -> Dict:
+        """Generate intelligent response using system context (blocking)."""
+        prompt = self.build_prompt(query, context, conversation_history)
+        try:
+            response = self.llm.sync_client().chat.completions.create(**self._completion_kwargs(prompt.messages))
+            return self._format_response(response.choices[0].message.content.strip(), context, prompt)
         except Exception as e:
-            return {
-                'answer': f"I apologize, but I encountered an error: {str(e)}",
-                'timestamp': datetime.now().isoformat(),
-                'error': True
-            }
+            return self._format_error(e)
+    
+    async def agenerate_response(self, query: str, context: Dict, conversation_history: List[Dict] = None) -> Dict:
+        """Generate intelligent response using system context."""
+        prompt = self.build_prompt(query, context, conversation_history)
+        try:
+            response = await self.llm.chat_completion(**self._completion_kwargs(prompt.messages))
+            return self._format_response(response.choices[0].message.content.strip(), context, prompt)
+        except Exception as e:
+            return self._format_error(e)
     
     def chat(self, query: str, predictions: List[Dict], alerts: List[Dict], 
-             historical_data: List[Dict], stats: Optional[Dict]) -> Dict:
+             historical_data: List[Dict], stats: Optional[Dict], session_id: str = DEFAULT_SESSION) -> Dict:
+        """Main chat interface (blocking)."""
+        context = self.retrieve_context(query, predictions, alerts, historical_data, stats)
+        response = self.generate_response(query, context, self.conversations.history(session_id))
+        self.conversations.remember(session_id, query, response['answer'])
+        return response
+    
+    async def achat(self, query: str, predictions: List[Dict], alerts: List[Dict], 
+                    historical_data: List[Dict], stats: Optional[Dict], session_id: str = DEFAULT_SESSION) -> Dict:
         """Main chat interface."""
         
         # Retrieve relevant context
         context = self.retrieve_context(query, predictions, alerts, historical_data, stats)
         
         # Generate response
-        response = self.generate_response(query, context, self.conversation_history)
+        response = await self.agenerate_response(query, context, self.conversations.history(session_id))
         
-        # Update conversation history
-        self.conversation_history.append({"role": "user", "content": query})
-        self.conversation_history.append({"role": "assistant", "content": response['answer']})
+        # Update this session's conversation history
+        self.conversations.remember(session_id, query, response['answer'])
+        return response
+    
+    async def astream_chat(self, query: str, predictions: List[Dict], alerts: List[Dict], 
+                           historical_data: List[Dict], stats: Optional[Dict],
+                           session_id: str = DEFAULT_SESSION) -> AsyncIterator[Dict]:
+        """
+        Streaming chat interface.
+        Yields {'event': 'token', 'data': {...}} for each content delta, then one
+        'metadata' event (or an 'error' event). The session's conversation history
+        is updated only once the full answer has been received.
+        """
+        context = self.retrieve_context(query, predictions, alerts, historical_data, stats)
+        prompt = self.build_prompt(query, context, self.conversations.history(session_id))
         
-        # Keep only last 10 messages to avoid token limit
-        if len(self.conversation_history) > 10:
-            self.conversation_history = self.conversation_history[-10:]
+        parts = []
+        try:
+            async for delta in self.llm.stream_chat_completion(**self._completion_kwargs(prompt.messages)):
+                parts.append(delta)
+                yield {'event': 'token', 'data': {'content': delta}}
+        except Exception as e:
+            yield {'event': 'error', 'data': self._format_error(e)}
+            return
         
-        return response
+        response = self._format_response(''.join(parts).strip(), context, prompt)
+        self.conversations.remember(session_id, query, response['answer'])
+        yield {
+            'event': 'metadata',
+            'data': {'timestamp': response['timestamp'], 'context_used': response['context_used']}
+        }
 
 
 # Global chatbot instance
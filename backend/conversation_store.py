@@ -0,0 +1,147 @@
+"""
+Per-session conversation history for the chatbot.
+
+Each session keeps its last CONVERSATION_MAX_MESSAGES messages in a deque, so
+appending is O(1). Sessions are evicted in LRU order once they have been idle
+for CONVERSATION_IDLE_TTL_SECONDS, or when the session count or the total
+memory budget is exceeded. All operations are guarded by one lock, so the
+store can be shared by concurrent requests.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List
+
+from backend.serving_config import (
+    CONVERSATION_IDLE_TTL_SECONDS,
+    CONVERSATION_MAX_MB,
+    CONVERSATION_MAX_MESSAGES,
+    CONVERSATION_MAX_SESSIONS,
+)
+
+# Used by clients that do not send a session id
+DEFAULT_SESSION = "default"
+
+# Approximate per-message overhead of the dict and its keys
+_MESSAGE_OVERHEAD = 240
+
+
+def _message_size(message: Dict) -> int:
+    return _MESSAGE_OVERHEAD + sum(sys.getsizeof(value) for value in message.values())
+
+
+class _Session:
+    __slots__ = ("messages", "size", "last_used")
+
+    def __init__(self, max_messages: int):
+        self.messages: deque = deque(maxlen=max_messages)
+        self.size = 0
+        self.last_used = time.monotonic()
+
+
+class ConversationStore:
+    """Session-keyed, memory-bounded conversation histories."""
+
+    def __init__(self, max_messages: int = CONVERSATION_MAX_MESSAGES,
+                 max_sessions: int = CONVERSATION_MAX_SESSIONS,
+                 idle_ttl: float = CONVERSATION_IDLE_TTL_SECONDS,
+                 max_mb: float = CONVERSATION_MAX_MB):
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def history(self, session_id: str = DEFAULT_SESSION) -> List[Dict]:
+        """Messages of a session, oldest first (a copy)."""
+        with self._lock:
+            self._expire(time.monotonic())
+            session = self._sessions.get(session_id)
+            if session is None:
+                return []
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return list(session.messages)
+
+    def append(self, session_id: str, *messages: Dict):
+        """Add messages to a session, dropping its oldest ones beyond max_messages."""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session(self.max_messages)
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_used = now
+
+            for message in messages:
+                if len(session.messages) == self.max_messages:
+                    dropped = _message_size(session.messages.popleft())
+                    session.size -= dropped
+                    self._bytes -= dropped
+                size = _message_size(message)
+                session.messages.append(message)
+                session.size += size
+                self._bytes += size
+
+            self._expire(now)
+            while self._sessions and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+                self._evict_oldest()
+
+    def remember(self, session_id: str, query: str, answer: str):
+        """Record one question/answer exchange."""
+        self.append(session_id,
+                    {"role": "user", "content": query},
+                    {"role": "assistant", "content": answer})
+
+    def clear(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return False
+            self._bytes -= session.size
+            return True
+
+    def _expire(self, now: float):
+        # Sessions are in LRU order, so idle ones are at the front
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used <= self.idle_ttl:
+                break
+            self._evict_oldest()
+
+    def _evict_oldest(self):
+        _, session = self._sessions.popitem(last=False)
+        self._bytes -= session.size
+        self.evictions += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'messages': sum(len(session.messages) for session in self._sessions.values()),
+                'size_mb': self._bytes / (1024 * 1024),
+                'max_mb': self.max_bytes / (1024 * 1024),
+                'evictions': self.evictions
+            }
+
+
+# Global conversation store instance
+_conversation_store_instance = None
+
+
+def get_conversation_store():
+    """Get or create the global conversation store."""
+    global _conversation_store_instance
+    if _conversation_store_instance is None:
+        _conversation_store_instance = ConversationStore()
+    return _conversation_store_instance
@@ -0,0 +1,238 @@
+"""
+Dataset inventory: a columnar manifest of every image under DATASET_DIR.
+
+One row per image: split, class, path (relative to the dataset root), file
+size, mtime, width, height, mode, format, and the error if the image could
+not be read. The directories are listed with os.scandir, and only image
+headers are read (PIL parses the header without decoding pixels), in a
+process pool.
+
+Re-runs reuse the rows of files whose size and mtime are unchanged, so only
+new or modified files are opened. The manifest is written as CSV, or as
+Parquet when the path ends in .parquet (requires pyarrow).
+
+Class balancing (DATASET_BALANCING_IMPROVEMENT.md) runs off the manifest
+without listing the directories again:
+
+    python -m backend.dataset_manifest scan
+    python -m backend.dataset_manifest summary
+    python -m backend.dataset_manifest balance --output balanced.csv
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from backend.config import CACHE_DIR, DATASET_DIR, NORMAL_VIDEOS_SAMPLES, TARGET_SAMPLES_PER_CLASS
+from backend.serving_config import DATASET_MANIFEST_PATH
+
+COLUMNS = ["split", "class", "path", "size", "mtime_ns", "width", "height", "mode", "format", "error"]
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+NORMAL_CLASS = "NormalVideos"
+# Files per header-reading task
+_CHUNK_SIZE = 512
+
+
+def default_manifest_path() -> Path:
+    return Path(DATASET_MANIFEST_PATH) if DATASET_MANIFEST_PATH else Path(CACHE_DIR) / "dataset_manifest.csv"
+
+
+def list_images(root: Path, splits: Sequence[str]) -> List[Tuple[str, str, str, int, int]]:
+    """(split, class, relative path, size, mtime_ns) of every image under root/<split>/<class>/."""
+    files = []
+    for split in splits:
+        split_dir = root / split
+        if not split_dir.is_dir():
+            continue
+        with os.scandir(split_dir) as classes:
+            class_dirs = sorted(entry.name for entry in classes if entry.is_dir())
+        for class_name in class_dirs:
+            pending = [f"{split}/{class_name}"]
+            while pending:
+                relative = pending.pop()
+                with os.scandir(root / relative) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            pending.append(f"{relative}/{entry.name}")
+                        elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                            stat = entry.stat()
+                            files.append((split, class_name, f"{relative}/{entry.name}", stat.st_size,
+                                          stat.st_mtime_ns))
+    return files
+
+
+def _read_headers(root: str, paths: Sequence[str]) -> List[Tuple]:
+    """(width, height, mode, format, error) per image, from the header only."""
+    from PIL import Image
+
+    headers = []
+    for path in paths:
+        try:
+            with Image.open(os.path.join(root, path)) as img:
+                headers.append((img.width, img.height, img.mode, img.format, ""))
+        except Exception as e:
+            headers.append((0, 0, "", "", str(e) or type(e).__name__))
+    return headers
+
+
+def load_manifest(path=None) -> pd.DataFrame:
+    path = Path(path) if path else default_manifest_path()
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path)
+    return pd.read_csv(path, dtype={"mode": str, "format": str, "error": str}, keep_default_na=False)
+
+
+def save_manifest(manifest: pd.DataFrame, path=None) -> Path:
+    path = Path(path) if path else default_manifest_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(path.name + ".tmp")
+    if path.suffix == ".parquet":
+        manifest.to_parquet(temporary, index=False)
+    else:
+        manifest.to_csv(temporary, index=False)
+    os.replace(temporary, path)
+    return path
+
+
+def build_manifest(root=DATASET_DIR, splits: Sequence[str] = ("Train", "Test"), path=None,
+                   workers: Optional[int] = None) -> Tuple[pd.DataFrame, Dict]:
+    """Scan the dataset, reusing unchanged rows of the existing manifest; returns (manifest, stats)."""
+    root = Path(root)
+    path = Path(path) if path else default_manifest_path()
+    start = time.perf_counter()
+    files = list_images(root, splits)
+    listed = time.perf_counter()
+
+    previous: Dict[str, Tuple] = {}
+    if path.exists():
+        old = load_manifest(path)
+        for row in zip(*(old[column] for column in COLUMNS)):
+            previous[row[2]] = row
+
+    rows: List[Optional[Tuple]] = []
+    stale: List[int] = []
+    for i, (split, class_name, relative, size, mtime_ns) in enumerate(files):
+        row = previous.get(relative)
+        if row is not None and row[3] == size and row[4] == mtime_ns:
+            rows.append((split, class_name) + tuple(row[2:]))
+        else:
+            rows.append(None)
+            stale.append(i)
+
+    if stale:
+        chunks = [stale[begin:begin + _CHUNK_SIZE] for begin in range(0, len(stale), _CHUNK_SIZE)]
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=get_context("spawn")) as pool:
+            results = pool.map(_read_headers, [str(root)] * len(chunks),
+                               [[files[i][2] for i in chunk] for chunk in chunks])
+            for chunk, headers in zip(chunks, results):
+                for i, header in zip(chunk, headers):
+                    rows[i] = files[i] + header
+
+    manifest = pd.DataFrame(rows, columns=COLUMNS)
+    save_manifest(manifest, path)
+    stats = {
+        'images': len(manifest),
+        'reused': len(files) - len(stale),
+        'read': len(stale),
+        'unreadable': int((manifest['error'] != "").sum()),
+        'removed': len(set(previous) - {relative for _, _, relative, _, _ in files}),
+        'list_seconds': round(listed - start, 2),
+        'seconds': round(time.perf_counter() - start, 2),
+        'path': str(path)
+    }
+    return manifest, stats
+
+
+def summarize(manifest: pd.DataFrame) -> pd.DataFrame:
+    """Per split and class: image count, unreadable files, the most common size and mode, and bytes."""
+    readable = manifest[manifest['error'] == ""]
+    grouped = readable.groupby(["split", "class"], sort=False)
+    summary = pd.DataFrame({
+        'images': grouped.size(),
+        'common_size': grouped.apply(lambda g: "x".join(map(str, g[['width', 'height']].value_counts().idxmax())),
+                                     include_groups=False),
+        'sizes': grouped.apply(lambda g: len(g[['width', 'height']].drop_duplicates()), include_groups=False),
+        'modes': grouped['mode'].agg(lambda modes: ",".join(sorted(set(modes)))),
+        'megabytes': (grouped['size'].sum() / 2 ** 20).round(1)
+    })
+    unreadable = manifest[manifest['error'] != ""].groupby(["split", "class"]).size()
+    summary['unreadable'] = unreadable.reindex(summary.index, fill_value=0)
+    return summary
+
+
+def balance_from_manifest(manifest: pd.DataFrame, split: str = "Train",
+                          target_per_class: int = TARGET_SAMPLES_PER_CLASS,
+                          normal_samples: Optional[int] = NORMAL_VIDEOS_SAMPLES, root=DATASET_DIR,
+                          random_state: int = 42) -> pd.DataFrame:
+    """
+    Balanced training set as in DATASET_BALANCING_IMPROVEMENT.md: every crime
+    class is downsampled to target_per_class (all images if it has fewer),
+    NormalVideos to normal_samples (default 1.5x the target); no upsampling.
+    Returns a shuffled DataFrame with 'image' (full path) and 'labels' columns.
+    """
+    if normal_samples is None:
+        normal_samples = int(target_per_class * 1.5)
+    images = manifest[(manifest['split'] == split) & (manifest['error'] == "")]
+
+    parts = []
+    for class_name, group in images.groupby("class", sort=True):
+        limit = normal_samples if class_name == NORMAL_CLASS else target_per_class
+        parts.append(group.sample(n=limit, random_state=random_state) if len(group) > limit else group)
+    if not parts:
+        return pd.DataFrame({'image': [], 'labels': []})
+
+    balanced = pd.concat(parts).sample(frac=1, random_state=random_state).reset_index(drop=True)
+    prefix = str(Path(root)) + os.sep
+    return pd.DataFrame({
+        'image': prefix + balanced['path'].str.replace("/", os.sep, regex=False),
+        'labels': balanced['class']
+    })
+
+
+def print_summary(summary: pd.DataFrame):
+    for split, table in summary.groupby(level="split", sort=False):
+        print(f"--- {split.upper()} DATA ---")
+        print(f"{'class':<16} {'images':>9} {'unreadable':>11} {'common size':>12} {'sizes':>6} {'modes':>10} "
+              f"{'MB':>9}")
+        for (_, class_name), row in table.iterrows():
+            print(f"{class_name:<16} {row['images']:>9} {row['unreadable']:>11} {row['common_size']:>12} "
+                  f"{row['sizes']:>6} {row['modes']:>10} {row['megabytes']:>9.1f}")
+        print(f"{'total':<16} {table['images'].sum():>9} {table['unreadable'].sum():>11}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scan the dataset into a manifest and balance classes from it")
+    parser.add_argument("command", choices=["scan", "summary", "balance"])
+    parser.add_argument("--root", default=str(DATASET_DIR), help="Dataset directory with Train/ and Test/")
+    parser.add_argument("--splits", nargs="+", default=["Train", "Test"])
+    parser.add_argument("--manifest", help="Manifest path (.csv or .parquet)")
+    parser.add_argument("--workers", type=int, help="Header-reading processes (default: one per CPU)")
+    parser.add_argument("--split", default="Train", help="Split to balance")
+    parser.add_argument("--target", type=int, default=TARGET_SAMPLES_PER_CLASS)
+    parser.add_argument("--normal-samples", type=int, default=NORMAL_VIDEOS_SAMPLES)
+    parser.add_argument("--output", help="Write the balanced set (image, labels) to this CSV")
+    args = parser.parse_args()
+
+    if args.command == "scan":
+        manifest, stats = build_manifest(args.root, args.splits, args.manifest, args.workers)
+        print(f"✓ {stats['images']} images in {stats['seconds']}s (listing {stats['list_seconds']}s): "
+              f"{stats['read']} read, {stats['reused']} reused, {stats['removed']} removed, "
+              f"{stats['unreadable']} unreadable")
+        print(f"✓ Manifest written to {stats['path']}")
+        print_summary(summarize(manifest))
+    elif args.command == "summary":
+        print_summary(summarize(load_manifest(args.manifest)))
+    else:
+        start = time.perf_counter()
+        balanced = balance_from_manifest(load_manifest(args.manifest), args.split, args.target,
+                                         args.normal_samples, args.root)
+        print(f"Balanced {args.split} set: {len(balanced)} images in {time.perf_counter() - start:.2f}s")
+        print(balanced['labels'].value_counts().to_string())
+        if args.output:
+            balanced.to_csv(args.output, index=False)
+            print(f"✓ Written to {args.output}")
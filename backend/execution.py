@@ -0,0 +1,105 @@
+"""
+Execution layer that keeps blocking work off the asyncio event loop.
+
+- CPU-bound steps (image decoding) run in a configurable thread or process pool.
+- Blocking network calls (OpenAI) run in a separate I/O thread pool.
+- Model inference runs on a dedicated thread used by the inference scheduler.
+- A bounded admission counter rejects new requests once too many are in flight,
+  so overload turns into a fast 503/429 with Retry-After instead of a growing backlog.
+"""
+import asyncio
+import functools
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+from backend.serving_config import (
+    EXECUTOR_IO_WORKERS,
+    EXECUTOR_KIND,
+    EXECUTOR_WORKERS,
+    MAX_PENDING_REQUESTS,
+    OVERLOAD_RETRY_AFTER_SECONDS,
+)
+
+
+class ServerOverloaded(Exception):
+    """Raised when the admission queue is full."""
+
+    def __init__(self, retry_after: int = OVERLOAD_RETRY_AFTER_SECONDS):
+        super().__init__("Server is overloaded, please retry later")
+        self.retry_after = retry_after
+
+
+class ExecutionLayer:
+    """Thread/process pools plus bounded admission for request handlers."""
+
+    def __init__(self, kind: str = EXECUTOR_KIND, workers: int = EXECUTOR_WORKERS,
+                 io_workers: int = EXECUTOR_IO_WORKERS, max_pending: int = MAX_PENDING_REQUESTS):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+
+        if kind == "process":
+            self.cpu_executor: Executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.cpu_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cpu")
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="io")
+        # A single thread drives the model; the framework parallelizes inside the forward pass
+        self.inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+    @contextmanager
+    def admit(self):
+        """Reserve a slot for one request or raise ServerOverloaded."""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ServerOverloaded()
+        self.pending += 1
+        try:
+            yield
+        finally:
+            self.pending -= 1
+
+    async def run_cpu(self, fn: Callable, *args, **kwargs):
+        """Run a CPU-bound function in the CPU pool."""
+        if self.kind == "process":
+            # Zero-copy views cannot be pickled to worker processes
+            args = tuple(bytes(arg) if isinstance(arg, memoryview) else arg for arg in args)
+        return await self._run(self.cpu_executor, fn, *args, **kwargs)
+
+    async def run_io(self, fn: Callable, *args, **kwargs):
+        """Run a blocking I/O function in the I/O thread pool."""
+        return await self._run(self.io_executor, fn, *args, **kwargs)
+
+    async def _run(self, executor: Executor, fn: Callable, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        if kwargs:
+            fn = functools.partial(fn, **kwargs)
+        return await loop.run_in_executor(executor, fn, *args)
+
+    def get_stats(self) -> Dict:
+        return {
+            'kind': self.kind,
+            'pending_requests': self.pending,
+            'max_pending_requests': self.max_pending,
+            'rejected_requests': self.rejected
+        }
+
+    def shutdown(self):
+        for executor in (self.cpu_executor, self.io_executor, self.inference_executor):
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Global execution layer instance
+_execution_instance = None
+
+
+def get_execution_layer():
+    """Get or create the global execution layer."""
+    global _execution_instance
+    if _execution_instance is None:
+        _execution_instance = ExecutionLayer()
+    return _execution_instance
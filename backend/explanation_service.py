@@ -0,0 +1,159 @@
+"""
+Explanation generation decoupled from the prediction response.
+
+Explanations depend only on the predicted class, the confidence level and the
+prediction status, so they are cached in an LRU keyed by
+(class, confidence bucket, prediction_status). Concurrent requests for the same
+key share one OpenAI call, which runs as its own task: a caller that is
+cancelled (e.g. a client disconnecting) stops waiting without cancelling the
+call for everyone else, and the result is still cached.
+
+In "async" mode a prediction returns immediately with an explanation job id;
+the explanation is produced in the background and can be fetched from
+/api/explain/jobs/{job_id} (or is pushed on the WebSocket stream).
+"""
+import asyncio
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from backend.metrics import get_metrics
+from backend.serving_config import (
+    EXPLANATION_CACHE_SIZE,
+    EXPLANATION_CONFIDENCE_BUCKET,
+    EXPLANATION_MAX_JOBS,
+)
+
+
+class ExplanationService:
+    """LRU-cached, optionally background explanation generation."""
+
+    def __init__(self, agent, execution, cache_size: int = EXPLANATION_CACHE_SIZE,
+                 confidence_bucket: float = EXPLANATION_CONFIDENCE_BUCKET,
+                 max_jobs: int = EXPLANATION_MAX_JOBS):
+        self.agent = agent
+        self.execution = execution
+        self.cache_size = cache_size
+        self.confidence_bucket = confidence_bucket
+        self.max_jobs = max_jobs
+
+        self._cache: "OrderedDict[Tuple, Dict]" = OrderedDict()
+        self._in_flight: Dict[Tuple, asyncio.Task] = {}
+        self._jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def cache_key(self, prediction_result: Dict, context: Optional[Dict] = None) -> Tuple:
+        top = prediction_result.get('top_prediction', {})
+        confidence = float(top.get('confidence', 0.0))
+        status = (context or {}).get('prediction_status', top.get('status', ''))
+        return (top.get('class', 'Unknown'), int(confidence / self.confidence_bucket), status)
+
+    async def explain(self, prediction_result: Dict, context: Optional[Dict] = None) -> Dict:
+        """Return an explanation, from the cache when an equivalent one exists."""
+        key = self.cache_key(prediction_result, context)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return cached
+
+        # Share one OpenAI call between concurrent identical requests
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            task = asyncio.get_running_loop().create_task(self._generate(key, prediction_result, context))
+            # Retrieve a failure nobody is waiting for anymore so it is not logged
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self._in_flight[key] = task
+        return await asyncio.shield(task)
+
+    async def _generate(self, key: Tuple, prediction_result: Dict, context: Optional[Dict]) -> Dict:
+        try:
+            with get_metrics().stage("explanation_llm"):
+                if context is None:
+                    explanation = await self.execution.run_io(self.agent.generate_explanation, prediction_result)
+                else:
+                    explanation = await self.execution.run_io(self.agent.generate_explanation,
+                                                              prediction_result, context)
+        finally:
+            self._in_flight.pop(key, None)
+
+        if not (isinstance(explanation, dict) and explanation.get('error')):
+            self._cache[key] = explanation
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return explanation
+
+    def submit(self, prediction_result: Dict, context: Optional[Dict] = None) -> str:
+        """Start generating an explanation in the background and return its job id."""
+        job_id = uuid.uuid4().hex
+        self._jobs[job_id] = {
+            'job_id': job_id,
+            'status': 'pending',
+            'explanation': None,
+            'created_at': datetime.now().isoformat()
+        }
+        task = asyncio.get_running_loop().create_task(self._run_job(job_id, prediction_result, context))
+        task.add_done_callback(lambda done: self._job_done(job_id, done))
+        self._tasks[job_id] = task
+        self._trim_jobs()
+        return job_id
+
+    async def _run_job(self, job_id: str, prediction_result: Dict, context: Optional[Dict]):
+        try:
+            explanation = await self.explain(prediction_result, context)
+            job_update = {'status': 'completed', 'explanation': explanation}
+        except Exception as e:
+            job_update = {'status': 'failed', 'error': str(e)}
+        self._finish_job(job_id, job_update)
+        return self._jobs.get(job_id)
+
+    def _finish_job(self, job_id: str, job_update: Dict):
+        self._tasks.pop(job_id, None)
+        job = self._jobs.get(job_id)
+        if job is not None and job['status'] == 'pending':
+            job.update(job_update)
+            job['completed_at'] = datetime.now().isoformat()
+
+    def _job_done(self, job_id: str, task: asyncio.Task):
+        # A job cancelled (e.g. at shutdown) before or while running is marked failed, not left pending
+        if task.cancelled():
+            self._finish_job(job_id, {'status': 'failed', 'error': "Cancelled"})
+
+    async def wait(self, job_id: str) -> Optional[Dict]:
+        """Wait for a job to finish and return it."""
+        task = self._tasks.get(job_id)
+        if task is not None:
+            # Does not raise if the job was cancelled, nor cancel it if this waiter is
+            await asyncio.wait({task})
+        return self._jobs.get(job_id)
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        return self._jobs.get(job_id)
+
+    def _trim_jobs(self):
+        # Forget the oldest finished jobs once the table is full
+        if len(self._jobs) <= self.max_jobs:
+            return
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if job_id not in self._tasks:
+                del self._jobs[job_id]
+
+    def get_stats(self) -> Dict:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            'cache_entries': len(self._cache),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_hit_rate': self.cache_hits / lookups if lookups else 0.0,
+            'pending_jobs': len(self._tasks),
+            'tracked_jobs': len(self._jobs)
+        }
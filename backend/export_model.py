@@ -0,0 +1,236 @@
+"""
+Export the trained Keras model for the ONNX Runtime and TFLite inference backends.
+
+    python -m backend.export_model --formats onnx tflite --int8 --report
+
+INT8 variants use post-training static quantization, calibrated on images
+sampled evenly across classes from TRAIN_DIR. Model inputs and outputs stay
+float32, so serving-side preprocessing (BatchPreprocessor) is unchanged.
+
+--report compares every exported backend with Keras on images sampled from
+TEST_DIR: top-1 agreement, accuracy, probability drift and latency per batch
+size. Select the backend to serve with INFERENCE_BACKEND.
+
+Requires tensorflow, plus tf2onnx and onnxruntime for the ONNX formats.
+"""
+import argparse
+import json
+import os
+import random
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+from backend.config import TEST_DIR, TRAIN_DIR
+from backend.inference_backends import (
+    BACKEND_KINDS, InferenceBackend, KerasBackend, default_model_path, load_backend
+)
+from backend.preprocessing import BatchPreprocessor, decode_image
+
+_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def sample_images(directory, per_class: int, seed: int = 42) -> List[Tuple[str, str]]:
+    """(path, class name) pairs, up to per_class random images from each class folder."""
+    rng = random.Random(seed)
+    samples = []
+    for class_dir in sorted(Path(directory).iterdir()):
+        if not class_dir.is_dir():
+            continue
+        with os.scandir(class_dir) as entries:
+            paths = sorted(entry.path for entry in entries if entry.name.lower().endswith(_IMAGE_EXTENSIONS))
+        for path in rng.sample(paths, min(per_class, len(paths))):
+            samples.append((path, class_dir.name))
+    return samples
+
+
+def iter_batches(paths: Sequence[str], batch_size: int = 32) -> Iterator[np.ndarray]:
+    """Preprocessed float32 batches, exactly as the server builds them."""
+    preprocessor = BatchPreprocessor(max_batch_size=batch_size)
+    for start in range(0, len(paths), batch_size):
+        images = []
+        for path in paths[start:start + batch_size]:
+            with open(path, 'rb') as f:
+                decoded = decode_image(f.read())
+            if decoded is not None:
+                images.append(decoded.pixels)
+        if images:
+            # The preprocessor reuses its buffer, so hand out a copy
+            yield preprocessor.preprocess(images).copy()
+
+
+def export_onnx(keras_model, path: Path, opset: int = 13) -> Path:
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = (tf.TensorSpec((None, *keras_model.input_shape[1:]), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(keras_model, input_signature=spec, opset=opset, output_path=str(path))
+    return path
+
+
+def quantize_onnx(float_path: Path, path: Path, calibration_paths: Sequence[str]) -> Path:
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType,
+                                          quantize_static)
+    import onnxruntime as ort
+
+    input_name = ort.InferenceSession(str(float_path), providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self._batches = iter_batches(calibration_paths, batch_size=1)
+
+        def get_next(self):
+            batch = next(self._batches, None)
+            return None if batch is None else {input_name: batch}
+
+    quantize_static(str(float_path), str(path), Reader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QInt8, weight_type=QuantType.QInt8)
+    return path
+
+
+def export_tflite(keras_model, path: Path, calibration_paths: Sequence[str] = ()) -> Path:
+    """Float TFLite model, or full-integer INT8 (float inputs/outputs) when calibration images are given."""
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    if calibration_paths:
+        def representative_dataset():
+            for batch in iter_batches(calibration_paths, batch_size=1):
+                yield [batch]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    path.write_bytes(converter.convert())
+    return path
+
+
+def _latency(backend: InferenceBackend, batch: np.ndarray, repeats: int) -> Dict:
+    for _ in range(3):
+        backend.predict(batch)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        backend.predict(batch)
+        timings.append(time.perf_counter() - start)
+    timings = np.asarray(timings) * 1000.0
+    return {
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'images_per_second': float(len(batch) * 1000.0 / timings.mean())
+    }
+
+
+def compare_backends(backends: Dict[str, InferenceBackend], samples: Sequence[Tuple[str, str]], class_names,
+                     batch_sizes: Sequence[int] = (1, 16), repeats: int = 50) -> Dict:
+    """
+    Accuracy parity against the first backend (Keras) and latency of every backend.
+    Undecodable images are skipped before the comparison.
+    """
+    class_index = {str(name): i for i, name in enumerate(class_names)}
+    images, labels = [], []
+    for path, label in samples:
+        with open(path, 'rb') as f:
+            decoded = decode_image(f.read())
+        if decoded is not None:
+            images.append(decoded.pixels)
+            labels.append(class_index.get(label, -1))
+    labels = np.array(labels)
+    preprocessor = BatchPreprocessor(max_batch_size=32)
+    batches = [preprocessor.preprocess(images[start:start + 32]).copy() for start in range(0, len(images), 32)]
+
+    reference_name = next(iter(backends))
+    probabilities = {name: np.concatenate([backend.predict(batch) for batch in batches]) if batches
+                     else np.empty((0, len(class_names)))
+                     for name, backend in backends.items()}
+    reference = probabilities[reference_name]
+    timing_batch = np.concatenate(batches)[:max(batch_sizes)] if batches else None
+
+    report = {'images': len(images), 'reference': reference_name, 'backends': {}}
+    for name, backend in backends.items():
+        probs = probabilities[name]
+        top = probs.argmax(axis=1)
+        entry = {
+            'top1_agreement': float(np.mean(top == reference.argmax(axis=1))) if len(top) else 0.0,
+            'accuracy': float(np.mean(top[labels >= 0] == labels[labels >= 0])) if np.any(labels >= 0) else None,
+            'max_abs_prob_diff': float(np.abs(probs - reference).max()) if len(top) else 0.0,
+            'latency': {}
+        }
+        if timing_batch is not None:
+            for size in batch_sizes:
+                batch = np.ascontiguousarray(timing_batch[:size])
+                if len(batch) == size:
+                    entry['latency'][str(size)] = _latency(backend, batch, repeats)
+        report['backends'][name] = entry
+    return report
+
+
+def print_report(report: Dict):
+    print(f"Images compared: {report['images']} (reference: {report['reference']})")
+    header = f"{'backend':<12} {'agree':>7} {'accuracy':>9} {'max diff':>9}"
+    sizes = sorted({size for entry in report['backends'].values() for size in entry['latency']}, key=int)
+    for size in sizes:
+        header += f" {'b' + size + ' p50 ms':>11} {'b' + size + ' img/s':>10}"
+    print(header)
+    for name, entry in report['backends'].items():
+        accuracy = f"{entry['accuracy']:.2%}" if entry['accuracy'] is not None else "n/a"
+        line = f"{name:<12} {entry['top1_agreement']:>7.2%} {accuracy:>9} {entry['max_abs_prob_diff']:>9.4f}"
+        for size in sizes:
+            latency = entry['latency'].get(size)
+            line += (f" {latency['p50_ms']:>11.2f} {latency['images_per_second']:>10.1f}" if latency
+                     else f" {'-':>11} {'-':>10}")
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the crime detection model for ONNX Runtime / TFLite")
+    parser.add_argument("--formats", nargs="*", choices=["onnx", "tflite"], default=["onnx"],
+                        help="Formats to export (none: only --report on existing exports)")
+    parser.add_argument("--int8", action="store_true", help="Also write post-training INT8 variants")
+    parser.add_argument("--calibration-per-class", type=int, default=20)
+    parser.add_argument("--opset", type=int, default=13)
+    parser.add_argument("--report", action="store_true", help="Compare all exported backends with Keras")
+    parser.add_argument("--report-per-class", type=int, default=30)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    from backend.model_utils import get_model
+
+    model = get_model()
+    if not model.loaded:
+        raise SystemExit("⚠ Model not loaded. Please run train_model.py first.")
+    calibration = []
+    if args.int8:
+        calibration = [path for path, _ in sample_images(TRAIN_DIR, args.calibration_per_class)]
+        print(f"Calibration images: {len(calibration)}")
+
+    if "onnx" in args.formats:
+        float_path = export_onnx(model.model, default_model_path("onnx"), args.opset)
+        print(f"✓ ONNX model written to {float_path}")
+        if args.int8:
+            print(f"✓ INT8 ONNX model written to "
+                  f"{quantize_onnx(float_path, default_model_path('onnx-int8'), calibration)}")
+    if "tflite" in args.formats:
+        print(f"✓ TFLite model written to {export_tflite(model.model, default_model_path('tflite'))}")
+        if args.int8:
+            print(f"✓ INT8 TFLite model written to "
+                  f"{export_tflite(model.model, default_model_path('tflite-int8'), calibration)}")
+
+    if args.report:
+        backends = {"keras": KerasBackend(model.model)}
+        for kind in BACKEND_KINDS[1:]:
+            if not default_model_path(kind).exists():
+                continue
+            try:
+                backends[kind] = load_backend(kind)
+            except ImportError as e:
+                print(f"⚠ Skipping {kind}: {e}")
+        report = compare_backends(backends, sample_images(TEST_DIR, args.report_per_class),
+                                  model.label_encoder.classes_, args.batch_sizes)
+        print_report(report)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
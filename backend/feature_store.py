@@ -0,0 +1,367 @@
+"""
+Memory-mapped feature store for training and evaluation data.
+
+Extraction decodes and resizes every image once, in a process pool, using the
+serving preprocessing (decode_image + BatchPreprocessor.pixels, parity-checked
+against CrimeDetectionModel's PIL path). The results go into one uint8 .npy
+shard per class:
+
+    <store>/manifest.json        settings and per-class row counts
+    <store>/<Class>.npy          (rows, H, W, C) uint8, opened with mmap_mode="r"
+    <store>/<Class>.files.json   [name, size, mtime_ns, row] per image, plus failures
+
+Workers write straight into the shard's memory map, so pixels never pass
+through the parent process. Rebuilding is incremental: a class whose files
+are unchanged (same names, sizes and mtimes) is skipped. Otherwise only new
+or modified files are decoded, and the rows of unchanged files are copied
+from the previous shard in chunks. Changing IMAGE_SIZE or the color mode
+rebuilds everything.
+
+Readers never load a whole shard: FeatureStore.samples() lists the (class
+id, row) of every image (the class id is the label), and gather() reads just
+the requested rows, which normalize() turns into model input:
+
+    python -m backend.feature_store build          # TRAIN_DIR and TEST_DIR
+    store = FeatureStore.open(default_store_path("Train"))
+    x = store.normalize(store.gather(class_ids[:32], rows[:32]))
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend.config import CACHE_DIR, IMAGE_SIZE, TEST_DIR, TRAIN_DIR, USE_TRANSFER_LEARNING
+from backend.preprocessing import BatchPreprocessor, decode_image
+from backend.serving_config import FEATURE_STORE_CHUNK_SIZE, FEATURE_STORE_DIR, FEATURE_STORE_WORKERS
+
+STORE_VERSION = 1
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+# Rows copied per step when carrying unchanged images over to a rebuilt shard
+_COPY_ROWS = 4096
+
+
+def default_store_path(split: str) -> Path:
+    """Store directory of a dataset split ("Train" or "Test")."""
+    base = Path(FEATURE_STORE_DIR) if FEATURE_STORE_DIR else Path(CACHE_DIR) / "feature_store"
+    return base / split
+
+
+def scan_class(directory: Path) -> Dict[str, Tuple[int, int]]:
+    """{file name: (size, mtime_ns)} of the images in one class folder, in a single scandir pass."""
+    files = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                stat = entry.stat()
+                files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+# Worker side (module-level so it can be pickled to the process pool)
+
+_worker_preprocessors: Dict[Tuple, BatchPreprocessor] = {}
+
+
+def _extract_rows(shard_path: str, offset: int, paths: Sequence[str], target_size: Tuple[int, int],
+                  grayscale: bool) -> List[Tuple[int, str]]:
+    """Decode and resize images into rows offset.. of the shard; returns (index, error) of failed images."""
+    key = (tuple(target_size), grayscale)
+    preprocessor = _worker_preprocessors.get(key)
+    if preprocessor is None:
+        preprocessor = _worker_preprocessors[key] = BatchPreprocessor(target_size, max_batch_size=1,
+                                                                      grayscale=grayscale)
+    shard = np.load(shard_path, mmap_mode="r+")
+    failures = []
+    try:
+        for i, path in enumerate(paths):
+            try:
+                with open(path, 'rb') as f:
+                    decoded = decode_image(f.read(), target_size)
+                if decoded is None:
+                    failures.append((i, "Invalid image file"))
+                    continue
+                preprocessor.pixels(decoded.pixels, out=shard[offset + i])
+            except Exception as e:
+                failures.append((i, str(e)))
+        shard.flush()
+    finally:
+        del shard
+    return failures
+
+
+class FeatureStore:
+    """Read access to a built store; shards are memory-mapped, never loaded whole."""
+
+    def __init__(self, path: Path, manifest: Dict):
+        self.path = Path(path)
+        self.manifest = manifest
+        # Sorted like sklearn's LabelEncoder, so label ids match the trained model
+        self.classes: List[str] = sorted(manifest['classes'])
+        self.image_size = tuple(manifest['image_size'])
+        self.grayscale = manifest['grayscale']
+        self._shards: Dict[str, np.ndarray] = {}
+        self._preprocessor: Optional[BatchPreprocessor] = None
+
+    @classmethod
+    def open(cls, path) -> "FeatureStore":
+        path = Path(path)
+        manifest_path = path / "manifest.json"
+        if not manifest_path.exists():
+            raise FileNotFoundError(f"No feature store at {path}; run python -m backend.feature_store build")
+        with open(manifest_path) as f:
+            return cls(path, json.load(f))
+
+    def shard(self, class_name: str) -> np.ndarray:
+        """The (rows, H, W, C) uint8 memory map of a class."""
+        shard = self._shards.get(class_name)
+        if shard is None:
+            shard = self._shards[class_name] = np.load(self.path / self.manifest['classes'][class_name]['shard'],
+                                                       mmap_mode="r")
+        return shard
+
+    def valid_rows(self, class_name: str) -> np.ndarray:
+        """Rows holding a decoded image (failed images leave unused rows until the next rebuild)."""
+        with open(self.path / self.manifest['classes'][class_name]['files']) as f:
+            entries = json.load(f)['files']
+        return np.fromiter((entry[3] for entry in entries), dtype=np.int64, count=len(entries))
+
+    def samples(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(class ids, rows) of every stored image; the class id is also the label."""
+        class_ids, rows = [], []
+        for class_id, name in enumerate(self.classes):
+            valid = self.valid_rows(name)
+            class_ids.append(np.full(len(valid), class_id, dtype=np.int64))
+            rows.append(valid)
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(class_ids), np.concatenate(rows)
+
+    def counts(self) -> Dict[str, int]:
+        return {name: self.manifest['classes'][name]['images'] for name in self.classes}
+
+    def gather(self, class_ids: Sequence[int], rows: Sequence[int]) -> np.ndarray:
+        """uint8 pixels of the given samples, in the given order; reads only those rows."""
+        class_ids = np.asarray(class_ids)
+        rows = np.asarray(rows)
+        channels = 1 if self.grayscale else 3
+        out = np.empty((len(rows), *self.image_size, channels), dtype=np.uint8)
+        for class_id in np.unique(class_ids):
+            positions = np.flatnonzero(class_ids == class_id)
+            # Ascending row order turns the reads into forward scans of the memory map
+            order = np.argsort(rows[positions], kind='stable')
+            out[positions[order]] = self.shard(self.classes[class_id])[rows[positions[order]]]
+        return out
+
+    def normalize(self, pixels: np.ndarray) -> np.ndarray:
+        """float32 model input, normalized exactly like serving."""
+        if self._preprocessor is None:
+            self._preprocessor = BatchPreprocessor(self.image_size, max_batch_size=1, grayscale=self.grayscale)
+        return self._preprocessor.normalize(pixels)
+
+    def iter_batches(self, batch_size: int = 256) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """(model input, labels) over the whole store in storage order, e.g. for evaluation."""
+        class_ids, rows = self.samples()
+        for start in range(0, len(rows), batch_size):
+            ids = class_ids[start:start + batch_size]
+            yield self.normalize(self.gather(ids, rows[start:start + batch_size])), ids
+
+
+class FeatureStoreBuilder:
+    """Creates or incrementally updates the store of one dataset directory."""
+
+    def __init__(self, source, path, target_size: Tuple[int, int] = IMAGE_SIZE,
+                 grayscale: bool = not USE_TRANSFER_LEARNING, workers: int = FEATURE_STORE_WORKERS,
+                 chunk_size: int = FEATURE_STORE_CHUNK_SIZE):
+        self.source = Path(source)
+        self.path = Path(path)
+        self.target_size = tuple(target_size)
+        self.grayscale = grayscale
+        self.channels = 1 if grayscale else 3
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = max(1, chunk_size)
+
+    def _settings(self) -> Dict:
+        return {'version': STORE_VERSION, 'image_size': list(self.target_size), 'grayscale': self.grayscale}
+
+    def _load_manifest(self) -> Dict:
+        manifest_path = self.path / "manifest.json"
+        if manifest_path.exists():
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if all(manifest.get(key) == value for key, value in self._settings().items()):
+                return manifest
+            print("⚠ Feature store settings changed (image size or color mode); rebuilding every class")
+        return {**self._settings(), 'classes': {}}
+
+    def _previous_entries(self, manifest: Dict, class_name: str) -> Dict:
+        info = manifest['classes'].get(class_name)
+        if info is None or not (self.path / info['files']).exists() or not (self.path / info['shard']).exists():
+            return {'files': [], 'failed': []}
+        with open(self.path / info['files']) as f:
+            return json.load(f)
+
+    def build(self, classes: Optional[Sequence[str]] = None) -> Dict:
+        """Extract new and changed images of every class (or the given ones); returns a summary."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        manifest = self._load_manifest()
+        class_dirs = sorted(entry.name for entry in os.scandir(self.source) if entry.is_dir())
+        if classes:
+            class_dirs = [name for name in class_dirs if name in set(classes)]
+
+        summary = {'classes': {}, 'extracted': 0, 'reused': 0, 'failed': 0}
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn")) as pool:
+            for class_name in class_dirs:
+                stats = self._build_class(pool, manifest, class_name)
+                summary['classes'][class_name] = stats
+                for key in ('extracted', 'reused', 'failed'):
+                    summary[key] += stats[key]
+                # Saved after every class so an interrupted build keeps its progress
+                self._save_manifest(manifest)
+
+        if not classes:
+            for removed in set(manifest['classes']) - set(class_dirs):
+                self._remove_class(manifest, removed)
+            self._save_manifest(manifest)
+        summary['seconds'] = round(time.perf_counter() - start, 2)
+        return summary
+
+    def _build_class(self, pool: ProcessPoolExecutor, manifest: Dict, class_name: str) -> Dict:
+        current = scan_class(self.source / class_name)
+        previous = self._previous_entries(manifest, class_name)
+        known = {entry[0]: entry for entry in previous['files']}
+        known_failed = {entry[0]: entry for entry in previous['failed']}
+
+        kept, pending, failed = [], [], []
+        for name in sorted(current):
+            size, mtime_ns = current[name]
+            entry = known.get(name)
+            if entry is not None and entry[1] == size and entry[2] == mtime_ns:
+                kept.append(entry)
+                continue
+            entry = known_failed.get(name)
+            if entry is not None and entry[1] == size and entry[2] == mtime_ns:
+                # Still the same unreadable file; don't retry it
+                failed.append(entry)
+                continue
+            pending.append(name)
+
+        unchanged = not pending and len(kept) == len(previous['files']) and len(failed) == len(previous['failed'])
+        if unchanged and class_name in manifest['classes']:
+            print(f"✓ {class_name}: {len(kept)} images unchanged")
+            return {'images': len(kept), 'extracted': 0, 'reused': len(kept), 'failed': 0}
+
+        rows = len(kept) + len(pending)
+        shard_name = f"{class_name}.npy"
+        temporary = self.path / f"{class_name}.npy.tmp"
+        shard = np.lib.format.open_memmap(temporary, mode="w+", dtype=np.uint8,
+                                          shape=(rows, *self.target_size, self.channels))
+
+        # Unchanged images: copy their rows over from the previous shard
+        files = []
+        if kept:
+            old = np.load(self.path / manifest['classes'][class_name]['shard'], mmap_mode="r")
+            old_rows = np.fromiter((entry[3] for entry in kept), dtype=np.int64, count=len(kept))
+            for begin in range(0, len(kept), _COPY_ROWS):
+                chunk = old_rows[begin:begin + _COPY_ROWS]
+                shard[begin:begin + len(chunk)] = old[chunk]
+            del old
+            files = [[name, size, mtime_ns, row] for row, (name, size, mtime_ns, _) in enumerate(kept)]
+        shard.flush()
+        del shard
+
+        # New and modified images: decoded by the pool straight into their rows
+        offset = len(kept)
+        futures = {}
+        for begin in range(0, len(pending), self.chunk_size):
+            names = pending[begin:begin + self.chunk_size]
+            paths = [str(self.source / class_name / name) for name in names]
+            future = pool.submit(_extract_rows, str(temporary), offset + begin, paths, self.target_size,
+                                 self.grayscale)
+            futures[future] = (begin, names)
+
+        failed_now = set()
+        done = 0
+        reported = 0
+        for future in as_completed(futures):
+            begin, names = futures[future]
+            for index, error in future.result():
+                name = names[index]
+                size, mtime_ns = current[name]
+                failed.append([name, size, mtime_ns, error])
+                failed_now.add(name)
+            done += len(names)
+            # Progress roughly every 10%
+            if len(futures) > 1 and done < len(pending) and done * 10 // len(pending) > reported:
+                reported = done * 10 // len(pending)
+                print(f"  {class_name}: {done}/{len(pending)} images extracted")
+
+        for i, name in enumerate(pending):
+            if name not in failed_now:
+                size, mtime_ns = current[name]
+                files.append([name, size, mtime_ns, offset + i])
+
+        files_name = f"{class_name}.files.json"
+        with open(self.path / f"{files_name}.tmp", 'w') as f:
+            json.dump({'files': files, 'failed': failed}, f)
+        os.replace(temporary, self.path / shard_name)
+        os.replace(self.path / f"{files_name}.tmp", self.path / files_name)
+        manifest['classes'][class_name] = {'shard': shard_name, 'files': files_name, 'images': len(files),
+                                           'rows': rows}
+
+        print(f"✓ {class_name}: {len(pending) - len(failed_now)} extracted, {len(kept)} reused, "
+              f"{len(failed_now)} failed")
+        return {'images': len(files), 'extracted': len(pending) - len(failed_now), 'reused': len(kept),
+                'failed': len(failed_now)}
+
+    def _remove_class(self, manifest: Dict, class_name: str):
+        info = manifest['classes'].pop(class_name)
+        for name in (info['shard'], info['files']):
+            try:
+                (self.path / name).unlink()
+            except FileNotFoundError:
+                pass
+        print(f"✓ {class_name}: removed (no longer in {self.source})")
+
+    def _save_manifest(self, manifest: Dict):
+        manifest['source'] = str(self.source)
+        manifest['updated'] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        with open(self.path / "manifest.json.tmp", 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(self.path / "manifest.json.tmp", self.path / "manifest.json")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or inspect the memory-mapped training feature store")
+    parser.add_argument("command", choices=["build", "info"])
+    parser.add_argument("--source", action="append",
+                        help="Dataset directory with one folder per class (default: TRAIN_DIR and TEST_DIR)")
+    parser.add_argument("--store", help="Store directory (default: the feature store of the source's split)")
+    parser.add_argument("--classes", nargs="+", help="Only these classes")
+    parser.add_argument("--workers", type=int, default=FEATURE_STORE_WORKERS)
+    args = parser.parse_args()
+
+    sources = [Path(source) for source in args.source] if args.source else [Path(TRAIN_DIR), Path(TEST_DIR)]
+    if args.store and len(sources) > 1:
+        parser.error("--store needs a single --source")
+
+    for source in sources:
+        path = Path(args.store) if args.store else default_store_path(source.name)
+        if args.command == "build":
+            print(f"Building feature store {path} from {source}")
+            summary = FeatureStoreBuilder(source, path, workers=args.workers).build(args.classes)
+            print(f"✓ {summary['extracted']} images extracted, {summary['reused']} reused, "
+                  f"{summary['failed']} failed in {summary['seconds']}s")
+        else:
+            store = FeatureStore.open(path)
+            counts = store.counts()
+            print(f"{path}: {sum(counts.values())} images, {len(counts)} classes, "
+                  f"{store.image_size[0]}x{store.image_size[1]} {'grayscale' if store.grayscale else 'RGB'}")
+            for name, count in counts.items():
+                print(f"  {name:<16} {count}")
@@ -0,0 +1,128 @@
+"""
+Binary WebSocket frame streaming.
+
+Each camera keeps one WebSocket open and sends raw JPEG bytes prefixed by a
+small little-endian header instead of base64 JSON:
+
+    offset  size  field
+    0       1     header version (1)
+    1       8     capture timestamp in seconds (float64)
+    9       4     stream id (uint32)
+    13      ...   encoded image bytes (JPEG/PNG)
+
+Predictions are pushed back on the same connection as JSON text messages.
+When inference falls behind, only the most recent frame is kept so latency
+stays bounded; older frames are counted as dropped.
+"""
+import asyncio
+import struct
+from typing import Awaitable, Callable, Dict, Optional
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+FRAME_HEADER = struct.Struct("<BdI")
+FRAME_HEADER_VERSION = 1
+
+
+class FrameFormatError(ValueError):
+    """Raised when a binary frame message is malformed."""
+
+
+class StreamFrame:
+    """One frame received from a camera; payload is a zero-copy view of the message."""
+
+    __slots__ = ("timestamp", "stream_id", "payload")
+
+    def __init__(self, timestamp: float, stream_id: int, payload: memoryview):
+        self.timestamp = timestamp
+        self.stream_id = stream_id
+        self.payload = payload
+
+
+def parse_frame(message: bytes) -> StreamFrame:
+    """Split a binary message into header fields and an image payload without copying."""
+    if len(message) <= FRAME_HEADER.size:
+        raise FrameFormatError("Frame message is shorter than its header")
+    version, timestamp, stream_id = FRAME_HEADER.unpack_from(message)
+    if version != FRAME_HEADER_VERSION:
+        raise FrameFormatError(f"Unsupported frame header version: {version}")
+    return StreamFrame(timestamp, stream_id, memoryview(message)[FRAME_HEADER.size:])
+
+
+def pack_frame(image_bytes: bytes, timestamp: float, stream_id: int = 0) -> bytes:
+    """Build a binary frame message (used by clients and tools)."""
+    return FRAME_HEADER.pack(FRAME_HEADER_VERSION, timestamp, stream_id) + image_bytes
+
+
+class LatestFrameSlot:
+    """Single-slot buffer that keeps only the newest frame."""
+
+    def __init__(self):
+        self._frame: Optional[StreamFrame] = None
+        self._ready = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, frame: StreamFrame):
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = frame
+        self._ready.set()
+
+    async def get(self) -> StreamFrame:
+        await self._ready.wait()
+        self._ready.clear()
+        frame, self._frame = self._frame, None
+        return frame
+
+
+class FrameStreamSession:
+    """Runs the receive and inference loops for one camera connection."""
+
+    def __init__(self, websocket: WebSocket, process_frame: Callable[[StreamFrame], Awaitable[Dict]]):
+        self.websocket = websocket
+        self.process_frame = process_frame
+        self.slot = LatestFrameSlot()
+        self.received = 0
+        self.processed = 0
+
+    async def run(self):
+        processor = asyncio.create_task(self._process_loop())
+        try:
+            await self._receive_loop()
+        finally:
+            processor.cancel()
+            try:
+                await processor
+            except (asyncio.CancelledError, WebSocketDisconnect):
+                pass
+
+    async def _receive_loop(self):
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            data = message.get("bytes")
+            if data is None:
+                # Text messages are not part of the protocol; ignore keep-alives
+                continue
+            try:
+                frame = parse_frame(data)
+            except FrameFormatError as e:
+                await self.websocket.send_json({"type": "error", "detail": str(e)})
+                continue
+            self.received += 1
+            self.slot.put(frame)
+
+    async def _process_loop(self):
+        while True:
+            frame = await self.slot.get()
+            try:
+                response = await self.process_frame(frame)
+                response.setdefault("type", "prediction")
+            except Exception as e:
+                response = {"type": "error", "detail": str(e)}
+            response["stream_id"] = frame.stream_id
+            response["frame_timestamp"] = frame.timestamp
+            response["dropped_frames"] = self.slot.dropped
+            self.processed += 1
+            await self.websocket.send_json(response)
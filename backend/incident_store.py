@@ -0,0 +1,481 @@
+"""
+In-process incident store fed by the prediction endpoints.
+
+Predictions are kept in a bounded ring buffer (oldest records are evicted first)
+with secondary indexes by predicted class and by stream, binary search over
+arrival time, and per-minute class counts for time-window statistics. Class,
+confidence, arrival time and stream are also kept in NumPy column buffers so
+analytics can read a time range without touching the record dicts. The chatbot and pattern analysis query the store directly, so
+clients no longer need to upload their prediction history with every request.
+
+Persistence is optional: set INCIDENT_STORE_PATH to a `.db`/`.sqlite` file for
+SQLite or to any other path for an append-only JSON-lines file. The newest
+records are reloaded on startup.
+"""
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from backend.serving_config import INCIDENT_STORE_CAPACITY, INCIDENT_STORE_PATH
+
+_TIME_RANGE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([smhdw])\s*$', re.IGNORECASE)
+_TIME_RANGE_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_time_range(time_range: Optional[str]) -> Optional[float]:
+    """Convert strings like '30m', '24h' or '7d' to seconds; None if not recognized."""
+    if not time_range:
+        return None
+    match = _TIME_RANGE_PATTERN.match(time_range)
+    if not match:
+        return None
+    return float(match.group(1)) * _TIME_RANGE_SECONDS[match.group(2).lower()]
+
+
+class _SQLitePersistence:
+    """Batched inserts into a SQLite table."""
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS incidents ("
+            "id INTEGER PRIMARY KEY, ts REAL, stream_id TEXT, predicted_class TEXT, record TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS incidents_ts ON incidents (ts)")
+        self._conn.commit()
+
+    def load(self, limit: int) -> List[Dict]:
+        rows = self._conn.execute(
+            "SELECT record FROM incidents ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def write(self, records: List[Dict]):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO incidents (id, ts, stream_id, predicted_class, record) VALUES (?, ?, ?, ?, ?)",
+            [(r['id'], r['ts'], r.get('stream_id'), r.get('predicted_class'), json.dumps(r, default=str))
+             for r in records]
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+class _JSONLinesPersistence:
+    """Append-only JSON-lines file; later lines for the same id supersede earlier ones."""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def load(self, limit: int) -> List[Dict]:
+        records: Dict[int, Dict] = {}
+        with open(self._path, 'r', encoding='utf-8') as f:
+            for line in deque(f, maxlen=limit * 2):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record['id']] = record
+        return [records[key] for key in sorted(records)][-limit:]
+
+    def write(self, records: List[Dict]):
+        self._file.write(''.join(json.dumps(r, default=str) + '\n' for r in records))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class IncidentStore:
+    """Bounded, indexed store of prediction records."""
+
+    FLUSH_EVERY = 64
+    FLUSH_INTERVAL_SECONDS = 1.0
+    # Granularity of the time-bucket class counts
+    BUCKET_SECONDS = 60
+
+    def __init__(self, capacity: int = INCIDENT_STORE_CAPACITY, persist_path: Optional[str] = INCIDENT_STORE_PATH):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self._slots: List[Optional[Dict]] = [None] * capacity
+        self._first_id = 0
+        self._next_id = 0
+        self._by_class: Dict[str, deque] = {}
+        self._by_stream: Dict[str, deque] = {}
+        # Ids of non-normal detections, the candidates for alerts()
+        self._alert_ids: deque = deque()
+        self._class_counts: Counter = Counter()
+        self._bucket_counts: Dict[int, Counter] = {}
+        # Columnar copies of the ring (class/stream as codes, -1 for empty slots)
+        self._col_class = np.full(capacity, -1, dtype=np.int32)
+        self._col_confidence = np.zeros(capacity, dtype=np.float32)
+        self._col_ts = np.zeros(capacity, dtype=np.float64)
+        self._col_stream = np.full(capacity, -1, dtype=np.int32)
+        self._codes: Dict[str, Dict] = {'class': {}, 'stream': {}}
+        self._names: Dict[str, List] = {'class': [], 'stream': []}
+        self._lock = threading.RLock()
+
+        self._persistence = None
+        self._pending: List[Dict] = []
+        self._last_flush = time.monotonic()
+        if persist_path:
+            if persist_path.endswith(('.db', '.sqlite', '.sqlite3')):
+                self._persistence = _SQLitePersistence(persist_path)
+            else:
+                self._persistence = _JSONLinesPersistence(persist_path)
+            if os.path.getsize(persist_path) > 0:
+                for record in self._persistence.load(capacity):
+                    self._insert(record)
+
+    def __len__(self) -> int:
+        return self._next_id - self._first_id
+
+    # Internal ring-buffer operations (caller holds the lock)
+
+    def _insert(self, record: Dict):
+        if record['id'] < self._next_id:
+            return
+        if self._next_id == self._first_id or record['id'] - self._next_id >= self.capacity:
+            while len(self):
+                self._evict_oldest()
+            self._first_id = self._next_id = record['id']
+        # Ids are contiguous; skipped ids (e.g. from a trimmed file) become empty slots
+        while self._next_id < record['id']:
+            self._append(None)
+        self._append(record)
+
+    def _append(self, record: Optional[Dict]):
+        if len(self) == self.capacity:
+            self._evict_oldest()
+        slot = self._next_id % self.capacity
+        self._slots[slot] = record
+        if record is None:
+            self._col_class[slot] = -1
+        else:
+            self._col_class[slot] = self._code('class', record.get('predicted_class'))
+            self._col_confidence[slot] = record.get('confidence') or 0.0
+            self._col_ts[slot] = record['ts']
+            self._col_stream[slot] = self._code('stream', record.get('stream_id'))
+            self._by_class.setdefault(record.get('predicted_class'), deque()).append(record['id'])
+            self._by_stream.setdefault(record.get('stream_id'), deque()).append(record['id'])
+            if record.get('predicted_class') != 'NormalVideos':
+                self._alert_ids.append(record['id'])
+            self._class_counts[record.get('predicted_class')] += 1
+            bucket = self._bucket_counts.setdefault(self._bucket(record['ts']), Counter())
+            bucket[record.get('predicted_class')] += 1
+        self._next_id += 1
+
+    def _evict_oldest(self):
+        slot = self._first_id % self.capacity
+        record = self._slots[slot]
+        self._slots[slot] = None
+        self._col_class[slot] = -1
+        self._first_id += 1
+        if record is None:
+            return
+        class_name = record.get('predicted_class')
+        self._class_counts[class_name] -= 1
+        if self._class_counts[class_name] <= 0:
+            del self._class_counts[class_name]
+        bucket_key = self._bucket(record['ts'])
+        bucket = self._bucket_counts.get(bucket_key)
+        if bucket is not None:
+            bucket[class_name] -= 1
+            if bucket[class_name] <= 0:
+                del bucket[class_name]
+            if not bucket:
+                del self._bucket_counts[bucket_key]
+        for index, key in ((self._by_class, class_name), (self._by_stream, record.get('stream_id'))):
+            ids = index.get(key)
+            if ids and ids[0] == record['id']:
+                ids.popleft()
+                if not ids:
+                    del index[key]
+        if self._alert_ids and self._alert_ids[0] == record['id']:
+            self._alert_ids.popleft()
+
+    def _code(self, column: str, value) -> int:
+        codes = self._codes[column]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self._names[column])
+            self._names[column].append(value)
+        return code
+
+    def _get(self, record_id: int) -> Optional[Dict]:
+        if self._first_id <= record_id < self._next_id:
+            return self._slots[record_id % self.capacity]
+        return None
+
+    def _first_id_since(self, ts: float) -> int:
+        """Binary search for the first live id with ts >= the given time."""
+        low, high = self._first_id, self._next_id
+        while low < high:
+            mid = (low + high) // 2
+            record = self._get(mid)
+            # Empty slots sort with their predecessors
+            probe = mid
+            while record is None and probe < high - 1:
+                probe += 1
+                record = self._get(probe)
+            if record is None or record['ts'] >= ts:
+                high = mid
+            else:
+                low = probe + 1
+        return low
+
+    def _first_id_after(self, ts: float) -> int:
+        return self._first_id_since(math.nextafter(ts, math.inf))
+
+    def _bucket(self, ts: float) -> int:
+        return int(ts // self.BUCKET_SECONDS)
+
+    def _count_ids(self, start_id: int, end_id: int, counts: Counter, sign: int = 1):
+        for record_id in range(start_id, end_id):
+            record = self._get(record_id)
+            if record is not None:
+                counts[record.get('predicted_class')] += sign
+
+    def _count_partial_bucket(self, key: int, since: float, until: float, counts: Counter):
+        """Counts for since <= ts < until inside one bucket, walking whichever side is shorter."""
+        bucket_start = self._first_id_since(key * self.BUCKET_SECONDS)
+        bucket_end = self._first_id_since((key + 1) * self.BUCKET_SECONDS)
+        start, end = self._first_id_since(since), self._first_id_since(until)
+        if end - start <= (bucket_end - bucket_start) - (end - start):
+            self._count_ids(start, end, counts)
+        else:
+            counts.update(self._bucket_counts.get(key, {}))
+            self._count_ids(bucket_start, start, counts, -1)
+            self._count_ids(end, bucket_end, counts, -1)
+
+    @staticmethod
+    def _as_alert(record: Dict) -> Dict:
+        return {
+            'type': record.get('predicted_class'),
+            'message': f"{record.get('predicted_class')} detected"
+                       + (f" on stream {record['stream_id']}" if record.get('stream_id') else ""),
+            'severity': 'High' if record.get('status') == 'confirmed' else 'Medium',
+            'timestamp': record.get('timestamp'),
+            'confidence': record.get('confidence')
+        }
+
+    # Public API
+
+    def add(self, record: Dict) -> Dict:
+        """Store one prediction record; returns it with 'id' and 'ts' filled in."""
+        record = dict(record)
+        # Arrival time keeps the buffer sorted by 'ts' for time-range searches
+        record['ts'] = time.time()
+        record.setdefault('timestamp', datetime.fromtimestamp(record['ts']).isoformat())
+        with self._lock:
+            record['id'] = self._next_id
+            self._append(record)
+            if self._persistence:
+                self._pending.append(record)
+                self._maybe_flush()
+        return record
+
+    def update(self, record_id: int, **fields) -> Optional[Dict]:
+        """Update fields of a live record (e.g. attach an explanation generated later)."""
+        with self._lock:
+            record = self._get(record_id)
+            if record is None:
+                return None
+            record.update(fields)
+            if self._persistence:
+                self._pending.append(record)
+                self._maybe_flush()
+            return record
+
+    def get(self, record_id: int) -> Optional[Dict]:
+        with self._lock:
+            return self._get(record_id)
+
+    def query(self, predicted_class: Optional[str] = None, stream_id: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None,
+              limit: Optional[int] = 100, statuses: Optional[Iterable[str]] = None) -> List[Dict]:
+        """
+        Return matching records, newest first.
+        since/until are epoch seconds; limit=None returns every match.
+        """
+        statuses = set(statuses) if statuses else None
+        with self._lock:
+            end = self._first_id_after(until) if until is not None else self._next_id
+            if predicted_class is not None:
+                ids = self._by_class.get(predicted_class, ())
+            elif stream_id is not None:
+                ids = self._by_stream.get(stream_id, ())
+            else:
+                start = self._first_id_since(since) if since is not None else self._first_id
+                ids = range(start, end)
+
+            results = []
+            for record_id in reversed(ids):
+                if record_id >= end:
+                    continue
+                record = self._get(record_id)
+                if record is None:
+                    continue
+                if since is not None and record['ts'] < since:
+                    break
+                if stream_id is not None and record.get('stream_id') != stream_id:
+                    continue
+                if statuses is not None and record.get('status') not in statuses:
+                    continue
+                results.append(record)
+                if limit is not None and len(results) >= limit:
+                    break
+            return results
+
+    def recent(self, limit: int = 50) -> List[Dict]:
+        return self.query(limit=limit)
+
+    def alerts(self, limit: int = 20, predicted_class: Optional[str] = None,
+               since: Optional[float] = None, until: Optional[float] = None) -> List[Dict]:
+        """Confirmed and potential non-normal detections in the alert format used by the frontend."""
+        alerts = []
+        with self._lock:
+            if predicted_class is not None:
+                records = self.query(predicted_class, since=since, until=until, limit=limit,
+                                     statuses=('confirmed', 'potential'))
+            else:
+                records = (self._get(record_id) for record_id in reversed(self._alert_ids))
+            for record in records:
+                if record is None or (until is not None and record['ts'] > until):
+                    continue
+                if since is not None and record['ts'] < since:
+                    break
+                if record.get('predicted_class') == 'NormalVideos':
+                    continue
+                if record.get('status') not in ('confirmed', 'potential'):
+                    continue
+                alerts.append(self._as_alert(record))
+                if len(alerts) >= limit:
+                    break
+        return alerts
+
+    def columns(self, predicted_class: Optional[str] = None, stream_id: Optional[str] = None,
+                since: Optional[float] = None, until: Optional[float] = None) -> Dict:
+        """
+        Matching records as NumPy columns in arrival order: 'class_idx' and
+        'stream_idx' (codes into 'class_names' / 'stream_names'), 'confidence', 'ts'.
+        """
+        with self._lock:
+            start = self._first_id_since(since) if since is not None else self._first_id
+            end = self._first_id_after(until) if until is not None else self._next_id
+            slots = np.arange(start, end, dtype=np.int64) % self.capacity
+            class_idx = self._col_class[slots]
+            stream_idx = self._col_stream[slots]
+            mask = class_idx >= 0
+            if predicted_class is not None:
+                mask &= class_idx == self._codes['class'].get(predicted_class, -2)
+            if stream_id is not None:
+                mask &= stream_idx == self._codes['stream'].get(stream_id, -2)
+            slots = slots[mask]
+            return {
+                'class_names': np.array(self._names['class'], dtype=object),
+                'class_idx': class_idx[mask],
+                'stream_names': np.array(self._names['stream'], dtype=object),
+                'stream_idx': stream_idx[mask],
+                'confidence': self._col_confidence[slots],
+                'ts': self._col_ts[slots]
+            }
+
+    def fingerprint(self) -> tuple:
+        """Changes whenever a record is added or evicted."""
+        with self._lock:
+            return (self._first_id, self._next_id)
+
+    def class_counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._class_counts)
+
+    def counts_between(self, since: Optional[float] = None, until: Optional[float] = None) -> Dict[str, int]:
+        """
+        Class counts of records with since <= ts <= until, from the per-minute buckets.
+        Only the partial buckets at the edges of the window are walked, from their shorter side.
+        """
+        with self._lock:
+            if not len(self):
+                return {}
+            if since is None and until is None:
+                return dict(self._class_counts)
+            oldest, newest = self._bucket_range()
+            start = max(oldest, self._bucket(since)) if since is not None else oldest
+            stop = min(newest, self._bucket(until)) if until is not None else newest
+            if start > stop:
+                return {}
+            window_start = since if since is not None else -math.inf
+            window_end = math.nextafter(until, math.inf) if until is not None else math.inf
+
+            counts: Counter = Counter()
+            for key in range(start, stop + 1):
+                low = max(window_start, key * self.BUCKET_SECONDS)
+                high = min(window_end, (key + 1) * self.BUCKET_SECONDS)
+                if low == key * self.BUCKET_SECONDS and high == (key + 1) * self.BUCKET_SECONDS:
+                    counts.update(self._bucket_counts.get(key, {}))
+                else:
+                    self._count_partial_bucket(key, low, high, counts)
+            return {name: count for name, count in counts.items() if count > 0}
+
+    def _bucket_range(self):
+        oldest = next(self._get(i) for i in range(self._first_id, self._next_id) if self._get(i) is not None)
+        newest = next(self._get(i) for i in range(self._next_id - 1, self._first_id - 1, -1)
+                      if self._get(i) is not None)
+        return self._bucket(oldest['ts']), self._bucket(newest['ts'])
+
+    def _maybe_flush(self):
+        if (len(self._pending) >= self.FLUSH_EVERY
+                or time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL_SECONDS):
+            self.flush()
+
+    def flush(self):
+        """Write pending records to the persistence backend."""
+        with self._lock:
+            if self._persistence and self._pending:
+                self._persistence.write(self._pending)
+                self._pending = []
+            self._last_flush = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            if self._persistence:
+                self._persistence.close()
+                self._persistence = None
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'records': len(self),
+                'capacity': self.capacity,
+                'classes': len(self._class_counts),
+                'streams': len(self._by_stream),
+                'persistent': self._persistence is not None
+            }
+
+
+# Global incident store instance
+_store_instance = None
+
+
+def get_incident_store():
+    """Get or create the global incident store."""
+    global _store_instance
+    if _store_instance is None:
+        _store_instance = IncidentStore()
+    return _store_instance
@@ -0,0 +1,326 @@
+"""
+Per-stream incident tracking over the frame predictions.
+
+A camera or video stream sends many frames per event: a 10-second clip at
+5 fps is 50 predictions of the same shooting. The tracker smooths every
+stream's class probabilities with an EWMA (alpha INCIDENT_EWMA_ALPHA) and
+turns the smoothed signal into incidents:
+
+- open: the smoothed top class is a non-normal class with a score of at least
+  INCIDENT_OPEN_CONFIDENCE for INCIDENT_MIN_FRAMES frames in a row;
+- extend: every frame whose smoothed score for the incident's class is still
+  at least INCIDENT_CLOSE_CONFIDENCE (the lower threshold gives hysteresis, so
+  a noisy frame does not split an event in two);
+- close: no supporting frame for INCIDENT_GAP_SECONDS of stream time, another
+  class opens on the same stream, the stream time jumps backwards (a seek or a
+  restarted video), or nothing arrives for INCIDENT_IDLE_SECONDS.
+
+Time is the stream's own (the video timestamp) when the client sends it, so a
+file processed faster than real time is tracked on its own clock; otherwise
+arrival time. The prediction endpoints request the explanation and
+recommendations once per incident, when it opens, instead of once per frame.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from backend.serving_config import (
+    ANOMALY_HIGH_RISK_CLASSES,
+    INCIDENT_CLOSE_CONFIDENCE,
+    INCIDENT_EWMA_ALPHA,
+    INCIDENT_GAP_SECONDS,
+    INCIDENT_IDLE_SECONDS,
+    INCIDENT_MAX_STREAMS,
+    INCIDENT_MIN_FRAMES,
+    INCIDENT_OPEN_CONFIDENCE,
+    INCIDENT_TRACKER_KEEP,
+)
+
+NORMAL_CLASS = 'NormalVideos'
+
+
+class IncidentUpdate(NamedTuple):
+    """Outcome of one frame: the open incident it belongs to (if any), whether it opened it, incidents it closed."""
+    incident: Optional[Dict]
+    opened: bool
+    closed: List[Dict]
+
+
+class _StreamTrack:
+    __slots__ = ("scores", "candidate", "candidate_frames", "incident", "last_time", "last_seen")
+
+    def __init__(self):
+        # Smoothed probability per class
+        self.scores: Dict[str, float] = {}
+        self.candidate: Optional[str] = None
+        self.candidate_frames = 0
+        self.incident: Optional[Dict] = None
+        self.last_time: Optional[float] = None
+        self.last_seen = 0.0
+
+
+def _probabilities(result: Dict) -> Dict[str, float]:
+    probabilities = result.get('all_classes')
+    if probabilities:
+        return probabilities
+    top = result['top_prediction']
+    return {top['class']: float(top['confidence'])}
+
+
+def _isoformat(ts: float) -> str:
+    return datetime.fromtimestamp(ts).isoformat()
+
+
+class IncidentTracker:
+    """Opens, extends and closes incidents per stream from smoothed frame predictions."""
+
+    # Idle streams are checked at most this often
+    SWEEP_INTERVAL_SECONDS = 1.0
+
+    def __init__(self, alpha: float = INCIDENT_EWMA_ALPHA, open_confidence: float = INCIDENT_OPEN_CONFIDENCE,
+                 close_confidence: float = INCIDENT_CLOSE_CONFIDENCE, min_frames: int = INCIDENT_MIN_FRAMES,
+                 gap_seconds: float = INCIDENT_GAP_SECONDS, idle_seconds: float = INCIDENT_IDLE_SECONDS,
+                 high_risk_classes: Sequence[str] = ANOMALY_HIGH_RISK_CLASSES,
+                 max_streams: int = INCIDENT_MAX_STREAMS, keep: int = INCIDENT_TRACKER_KEEP):
+        if close_confidence > open_confidence:
+            raise ValueError("close_confidence must not exceed open_confidence")
+        self.alpha = alpha
+        self.open_confidence = open_confidence
+        self.close_confidence = close_confidence
+        self.min_frames = max(min_frames, 1)
+        self.gap_seconds = gap_seconds
+        self.idle_seconds = idle_seconds
+        self.high_risk_classes = set(high_risk_classes)
+        self.max_streams = max_streams
+
+        self._streams: "OrderedDict[str, _StreamTrack]" = OrderedDict()
+        # Open and recently closed incidents, oldest first
+        self._incidents: "OrderedDict[int, Dict]" = OrderedDict()
+        self._keep = keep
+        self._ids = itertools.count(1)
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+
+        self.frames = 0
+        self.opened = 0
+        self.closed = 0
+
+    def _stream(self, stream_id: str, now: float) -> Tuple[_StreamTrack, Optional[Dict]]:
+        """The stream's track, and the incident closed by evicting the least recently used stream."""
+        track = self._streams.get(stream_id)
+        closed = None
+        if track is None:
+            track = _StreamTrack()
+            self._streams[stream_id] = track
+            if len(self._streams) > self.max_streams:
+                _, evicted = self._streams.popitem(last=False)
+                if evicted.incident is not None:
+                    closed = self._close(evicted, "evicted", now)
+        else:
+            self._streams.move_to_end(stream_id)
+        return track, closed
+
+    def _open(self, stream_id: str, track: _StreamTrack, class_name: str, score: float,
+              confidence: float, stream_time: float, now: float) -> Dict:
+        incident = {
+            'id': next(self._ids),
+            'stream_id': stream_id,
+            'predicted_class': class_name,
+            'status': 'open',
+            'severity': 'High' if class_name in self.high_risk_classes else 'Medium',
+            'started_at': _isoformat(now),
+            'updated_at': _isoformat(now),
+            'ended_at': None,
+            'start_time': stream_time,
+            'end_time': stream_time,
+            'duration': 0.0,
+            'frames': 0,
+            'peak_confidence': confidence,
+            'smoothed_confidence': score,
+            'close_reason': None,
+            'explanation': None,
+            'explanation_job_id': None,
+            'recommendations': None
+        }
+        track.incident = incident
+        self._incidents[incident['id']] = incident
+        self._trim()
+        self.opened += 1
+        return incident
+
+    def _extend(self, incident: Dict, score: float, confidence: float, stream_time: float, now: float):
+        incident['frames'] += 1
+        incident['end_time'] = max(incident['end_time'], stream_time)
+        incident['duration'] = round(incident['end_time'] - incident['start_time'], 3)
+        incident['peak_confidence'] = max(incident['peak_confidence'], confidence)
+        incident['smoothed_confidence'] = score
+        incident['updated_at'] = _isoformat(now)
+
+    def _close(self, track: _StreamTrack, reason: str, now: float) -> Dict:
+        incident = track.incident
+        track.incident = None
+        incident['status'] = 'closed'
+        incident['close_reason'] = reason
+        incident['ended_at'] = _isoformat(now)
+        self.closed += 1
+        return incident
+
+    def _trim(self):
+        # Forget the oldest closed incidents once more than `keep` are held
+        if len(self._incidents) <= self._keep:
+            return
+        for incident_id in list(self._incidents):
+            if len(self._incidents) <= self._keep:
+                break
+            if self._incidents[incident_id]['status'] == 'closed':
+                del self._incidents[incident_id]
+
+    def _sweep(self, now: float) -> List[Dict]:
+        """Close incidents of streams that have stopped sending frames."""
+        if now - self._last_sweep < self.SWEEP_INTERVAL_SECONDS:
+            return []
+        self._last_sweep = now
+        return [self._close(track, "idle", now) for track in self._streams.values()
+                if track.incident is not None and now - track.last_seen > self.idle_seconds]
+
+    def observe(self, stream_id: str, result: Dict, stream_time: Optional[float] = None,
+                now: Optional[float] = None, label: Optional[str] = None) -> IncidentUpdate:
+        """
+        Consume one frame prediction (CrimeDetectionModel.predict format) of a stream.
+        label is the stream id reported on new incidents (default: stream_id).
+        """
+        now = time.time() if now is None else now
+        stream_time = now if stream_time is None else float(stream_time)
+        confidence = float(result['top_prediction']['confidence'])
+
+        with self._lock:
+            self.frames += 1
+            closed = self._sweep(now)
+            track, evicted = self._stream(stream_id, now)
+            if evicted is not None:
+                closed.append(evicted)
+            if track.last_time is not None and stream_time < track.last_time - self.gap_seconds:
+                # Seek or restart: the smoothed history belongs to other footage
+                if track.incident is not None:
+                    closed.append(self._close(track, "restarted", now))
+                track.scores = {}
+                track.candidate, track.candidate_frames = None, 0
+            track.last_time = stream_time
+            track.last_seen = now
+
+            scores = track.scores
+            probabilities = _probabilities(result)
+            if scores:
+                for class_name in scores.keys() | probabilities.keys():
+                    previous = scores.get(class_name, 0.0)
+                    scores[class_name] = previous + self.alpha * (probabilities.get(class_name, 0.0) - previous)
+            else:
+                scores.update(probabilities)
+            top_class = max(scores, key=scores.get)
+            top_score = scores[top_class]
+
+            if top_class != NORMAL_CLASS and top_score >= self.open_confidence:
+                if track.candidate == top_class:
+                    track.candidate_frames += 1
+                else:
+                    track.candidate, track.candidate_frames = top_class, 1
+            else:
+                track.candidate, track.candidate_frames = None, 0
+
+            incident = track.incident
+            if incident is not None:
+                class_name = incident['predicted_class']
+                score = scores.get(class_name, 0.0)
+                if score >= self.close_confidence:
+                    self._extend(incident, score, confidence, stream_time, now)
+                elif stream_time - incident['end_time'] > self.gap_seconds:
+                    closed.append(self._close(track, "ended", now))
+
+            opened = False
+            if track.candidate is not None and track.candidate_frames >= self.min_frames:
+                incident = track.incident
+                if incident is None or incident['predicted_class'] != track.candidate:
+                    if incident is not None:
+                        closed.append(self._close(track, "superseded", now))
+                    incident = self._open(label or stream_id, track, track.candidate, top_score, confidence, stream_time, now)
+                    self._extend(incident, top_score, confidence, stream_time, now)
+                    opened = True
+            return IncidentUpdate(track.incident, opened, closed)
+
+    def close_stream(self, stream_id: str, reason: str = "stream_ended") -> Optional[Dict]:
+        """Close the open incident of a stream (e.g. at the end of a video file) and forget its state."""
+        with self._lock:
+            track = self._streams.pop(stream_id, None)
+            if track is None or track.incident is None:
+                return None
+            return dict(self._close(track, reason, time.time()))
+
+    def update(self, incident_id: int, **fields) -> Optional[Dict]:
+        """Attach fields generated later (explanation, recommendations) to an incident."""
+        with self._lock:
+            incident = self._incidents.get(incident_id)
+            if incident is not None:
+                incident.update(fields)
+            return incident
+
+    def get(self, incident_id: int) -> Optional[Dict]:
+        with self._lock:
+            incident = self._incidents.get(incident_id)
+            return dict(incident) if incident is not None else None
+
+    def feed(self, stream_id: Optional[str] = None, status: Optional[str] = None,
+             predicted_class: Optional[str] = None, limit: int = 100) -> List[Dict]:
+        """Open and recently closed incidents, newest first."""
+        with self._lock:
+            self._sweep(time.time())
+            results = []
+            for incident in reversed(self._incidents.values()):
+                if stream_id is not None and incident['stream_id'] != stream_id:
+                    continue
+                if status is not None and incident['status'] != status:
+                    continue
+                if predicted_class is not None and incident['predicted_class'] != predicted_class:
+                    continue
+                results.append(dict(incident))
+                if len(results) >= limit:
+                    break
+            return results
+
+    @staticmethod
+    def as_alert(incident: Dict) -> Dict:
+        """An incident in the alert format used by the frontend."""
+        return {
+            'type': incident['predicted_class'],
+            'message': f"{incident['predicted_class']} detected on stream {incident['stream_id']}",
+            'severity': incident['severity'],
+            'timestamp': incident['started_at'],
+            'confidence': incident['peak_confidence'],
+            'incident_id': incident['id'],
+            'status': incident['status']
+        }
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'streams': len(self._streams),
+                'open_incidents': sum(1 for track in self._streams.values() if track.incident is not None),
+                'frames': self.frames,
+                'opened': self.opened,
+                'closed': self.closed,
+                'frames_per_incident': self.frames / self.opened if self.opened else 0.0
+            }
+
+
+# Global incident tracker instance
+_tracker_instance = None
+
+
+def get_incident_tracker():
+    """Get or create the global incident tracker."""
+    global _tracker_instance
+    if _tracker_instance is None:
+        _tracker_instance = IncidentTracker()
+    return _tracker_instance
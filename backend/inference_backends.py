@@ -0,0 +1,191 @@
+"""
+Inference backends behind the micro-batching scheduler.
+
+Every backend takes the preprocessed float32 batch (N, H, W, C) produced by
+BatchPreprocessor and returns class probabilities (N, classes):
+
+- keras:  the trained Keras model, called directly instead of through
+          model.predict(), which sets up a data pipeline on every call
+- onnx:   ONNX Runtime on CPU (crime_detection_model.onnx)
+- tflite: TensorFlow Lite interpreter (crime_detection_model.tflite)
+
+"onnx-int8" and "tflite-int8" load the post-training quantized variants.
+Exported files are produced with `python -m backend.export_model`; the backend
+is chosen with INFERENCE_BACKEND. When the runtime or the exported file is
+missing, the server falls back to Keras.
+"""
+import importlib
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from backend.config import MODEL_PATH
+from backend.serving_config import INFERENCE_BACKEND, INFERENCE_MODEL_PATH, INFERENCE_THREADS, MODEL_FACTORY
+
+BACKEND_KINDS = ("keras", "onnx", "onnx-int8", "tflite", "tflite-int8")
+
+_SUFFIXES = {
+    "onnx": ".onnx",
+    "onnx-int8": "_int8.onnx",
+    "tflite": ".tflite",
+    "tflite-int8": "_int8.tflite",
+}
+
+
+def default_model_path(kind: str) -> Path:
+    """Where export_model writes (and the backend looks for) the file of a backend kind."""
+    if kind == "keras":
+        return Path(MODEL_PATH)
+    model_path = Path(MODEL_PATH)
+    return model_path.with_name(model_path.stem + _SUFFIXES[kind])
+
+
+class InferenceBackend:
+    """Runs a preprocessed batch through the network."""
+
+    name = "base"
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def get_stats(self) -> Dict:
+        return {'backend': self.name}
+
+
+class KerasBackend(InferenceBackend):
+    name = "keras"
+
+    def __init__(self, keras_model):
+        self.model = keras_model
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return np.asarray(self.model(batch, training=False))
+
+
+class OnnxBackend(InferenceBackend):
+    name = "onnx"
+
+    def __init__(self, path, threads: int = INFERENCE_THREADS):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.path = str(path)
+        self.session = ort.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: np.ascontiguousarray(batch, dtype=np.float32)})[0]
+
+    def get_stats(self) -> Dict:
+        return {'backend': self.name, 'path': self.path}
+
+
+class TFLiteBackend(InferenceBackend):
+    """TFLite interpreter; not thread-safe, like everything on the inference thread."""
+
+    name = "tflite"
+
+    def __init__(self, path, threads: int = INFERENCE_THREADS):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.path = str(path)
+        self.interpreter = Interpreter(model_path=self.path, num_threads=threads if threads > 0 else None)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input['shape'][0])
+
+    def _resize(self, batch_size: int):
+        # Tensors are reallocated only when the batch size changes
+        shape = list(self._input['shape'])
+        shape[0] = batch_size
+        self.interpreter.resize_tensor_input(self._input['index'], shape)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        if len(batch) != self._batch_size:
+            self._resize(len(batch))
+
+        dtype = self._input['dtype']
+        if dtype in (np.int8, np.uint8):
+            scale, zero_point = self._input['quantization']
+            info = np.iinfo(dtype)
+            batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+        self.interpreter.set_tensor(self._input['index'], np.ascontiguousarray(batch, dtype=dtype))
+        self.interpreter.invoke()
+
+        output = self.interpreter.get_tensor(self._output['index'])
+        if self._output['dtype'] in (np.int8, np.uint8):
+            scale, zero_point = self._output['quantization']
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+    def get_stats(self) -> Dict:
+        return {'backend': self.name, 'path': self.path, 'input_dtype': np.dtype(self._input['dtype']).name}
+
+
+def load_backend(kind: str, keras_model=None, path: Optional[str] = None,
+                 threads: int = INFERENCE_THREADS) -> InferenceBackend:
+    """Create a backend of the given kind; raises if its runtime or file is unavailable."""
+    if kind not in BACKEND_KINDS:
+        raise ValueError(f"Unknown inference backend: {kind}")
+    if kind == "keras":
+        if keras_model is None:
+            raise ValueError("The keras backend needs the loaded model")
+        return KerasBackend(keras_model)
+
+    path = Path(path) if path else default_model_path(kind)
+    if not path.exists():
+        raise FileNotFoundError(f"{path} not found; run python -m backend.export_model first")
+    backend = OnnxBackend(path, threads) if kind.startswith("onnx") else TFLiteBackend(path, threads)
+    backend.name = kind
+    return backend
+
+
+def model_factory(spec: str = MODEL_FACTORY) -> Callable:
+    """The function that loads the model: MODEL_FACTORY if set, else backend.model_utils.get_model."""
+    if not spec:
+        # Imported lazily: model_utils pulls in TensorFlow
+        from backend.model_utils import get_model
+        return get_model
+    module_name, _, attribute = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attribute or "get_model")
+
+
+def create_backend(model, kind: str = INFERENCE_BACKEND, path: str = INFERENCE_MODEL_PATH,
+                   threads: int = INFERENCE_THREADS) -> InferenceBackend:
+    """Backend for the server: the configured one, or Keras if it cannot be loaded."""
+    if kind != "keras":
+        try:
+            backend = load_backend(kind, path=path or None, threads=threads)
+            print(f"✓ Inference backend: {kind} ({backend.path})")
+            return backend
+        except Exception as e:
+            print(f"⚠ Could not load the {kind} inference backend: {e}")
+            print("⚠ Falling back to the Keras model")
+    if threads > 0:
+        _limit_tensorflow_threads(threads)
+    return KerasBackend(model.model)
+
+
+def _limit_tensorflow_threads(threads: int):
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except RuntimeError:
+        # TensorFlow was already initialized; thread pools can no longer change
+        pass
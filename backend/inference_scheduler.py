@@ -0,0 +1,202 @@
+"""
+Dynamic micro-batching scheduler in front of CrimeDetectionModel.
+
+Concurrent requests submit single images; the scheduler gathers whatever is
+queued (up to a maximum batch size, waiting at most a few milliseconds for
+stragglers) and runs them through the network in one forward pass. Each caller
+receives exactly its own result, in the same format as CrimeDetectionModel.predict.
+
+Images are submitted as BGR arrays (as returned by backend.preprocessing.decode_image)
+and preprocessed together into one float32 tensor.
+"""
+import asyncio
+import time
+from concurrent.futures import Executor
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from backend.inference_backends import InferenceBackend
+from backend.metrics import get_metrics
+from backend.preprocessing import BatchPreprocessor
+from backend.serving_config import (
+    INFERENCE_MAX_BATCH_SIZE,
+    INFERENCE_MAX_WAIT_MS,
+    PREDICTION_TOP_K,
+)
+
+
+def format_prediction(probabilities: np.ndarray, class_names, top_k: int = PREDICTION_TOP_K) -> Dict:
+    """Turn one row of class probabilities into the CrimeDetectionModel.predict format."""
+    top_indices = np.argsort(probabilities)[::-1][:top_k]
+    predictions = [
+        {'class': str(class_names[idx]), 'confidence': float(probabilities[idx])}
+        for idx in top_indices
+    ]
+    return {
+        'predictions': predictions,
+        'top_prediction': dict(predictions[0]),
+        'all_classes': {str(name): float(prob) for name, prob in zip(class_names, probabilities)}
+    }
+
+
+def predict_images(model, images: List[np.ndarray], preprocessor: BatchPreprocessor,
+                   backend: Optional[InferenceBackend] = None) -> List[Dict]:
+    """Run a list of BGR images through the model (or the given backend) in a single forward pass."""
+    metrics = get_metrics()
+    with metrics.stage("preprocess"):
+        batch = preprocessor.preprocess(images)
+    with metrics.stage("forward_pass"):
+        if backend is None:
+            probabilities = model.model.predict(batch, verbose=0)
+        else:
+            probabilities = backend.predict(batch)
+    class_names = model.label_encoder.classes_
+    with metrics.stage("postprocess"):
+        return [format_prediction(row, class_names) for row in probabilities]
+
+
+class InferenceScheduler:
+    """Gathers concurrent prediction requests into batched model calls."""
+
+    def __init__(self, model, max_batch_size: int = INFERENCE_MAX_BATCH_SIZE,
+                 max_wait_ms: float = INFERENCE_MAX_WAIT_MS, executor: Optional[Executor] = None,
+                 backend: Optional[InferenceBackend] = None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.model = model
+        # None runs the Keras model through model.predict()
+        self.backend = backend
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(max_wait_ms, 0.0) / 1000.0
+        # Only the single inference thread touches this buffer
+        self.preprocessor = BatchPreprocessor(max_batch_size=max_batch_size)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.batches_run = 0
+        self.images_processed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def start(self):
+        """Start the batching loop on the running event loop."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the batching loop and fail any requests still waiting."""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        while not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Inference scheduler stopped"))
+
+    async def submit(self, image: np.ndarray) -> Dict:
+        """Queue one BGR image and wait for its prediction."""
+        if not self.running:
+            raise RuntimeError("Inference scheduler is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, future, time.perf_counter()))
+        return await future
+
+    async def predict_batch(self, images: List[np.ndarray]) -> List[Dict]:
+        """
+        Run a list of BGR images as one forward pass on the inference thread,
+        bypassing the queue (for bulk uploads that already arrive in batches).
+        Shares the preprocessing buffer, so the executor must be single-threaded.
+        """
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(self.executor, predict_images, self.model, images,
+                                             self.preprocessor, self.backend)
+        self.batches_run += 1
+        self.images_processed += len(images)
+        get_metrics().observe_batch(len(images), "batch")
+        return results
+
+    async def warm_up(self, batch_sizes: Sequence[int]) -> Dict[int, float]:
+        """
+        Run one dummy batch of each size through preprocessing and the backend
+        (kernel setup, graph tracing, tensor allocation). Returns seconds per size.
+        """
+        loop = asyncio.get_running_loop()
+        image = np.zeros((self.preprocessor.height, self.preprocessor.width, 3), dtype=np.uint8)
+        timings = {}
+        for size in sorted(set(batch_sizes)):
+            start = time.perf_counter()
+            await loop.run_in_executor(self.executor, predict_images, self.model, [image] * size,
+                                       self.preprocessor, self.backend)
+            timings[size] = time.perf_counter() - start
+        return timings
+
+    def get_stats(self) -> Dict:
+        return {
+            'backend': self.backend.name if self.backend else 'keras',
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'queue_depth': self._queue.qsize() if self._queue else 0,
+            'batches_run': self.batches_run,
+            'images_processed': self.images_processed,
+            'average_batch_size': (self.images_processed / self.batches_run) if self.batches_run else 0.0
+        }
+
+    async def _collect_batch(self) -> List:
+        """Wait for one request, then gather more until the batch is full or the wait expires."""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            # Take everything that is already queued before waiting at all
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            # Drop requests whose callers already gave up
+            batch = [(image, future, queued) for image, future, queued in batch if not future.done()]
+            if not batch:
+                continue
+
+            metrics = get_metrics()
+            started = time.perf_counter()
+            for _, _, queued in batch:
+                metrics.observe_stage("scheduler_queue", started - queued)
+            images = [image for image, _, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, predict_images, self.model, images,
+                                                     self.preprocessor, self.backend)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches_run += 1
+            self.images_processed += len(images)
+            metrics.observe_batch(len(images))
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,255 @@
+"""
+Shared LLM gateway used by the chatbot and the AI agent.
+
+- One AsyncOpenAI client with an HTTP keep-alive connection pool for the whole process.
+- A semaphore caps the number of in-flight LLM requests.
+- Identical concurrent requests (same model, messages and parameters) are coalesced
+  into a single upstream call, run as its own task so that one cancelled caller
+  does not fail the others.
+- stream_chat_completion yields content deltas as they arrive.
+- LLM_BASE_URL points the client at any OpenAI-compatible server, e.g. the bundled
+  stub (python -m backend.llm_stub) for tests and benchmarks.
+
+The gateway runs on its own event loop thread, so it can be awaited from the API's
+event loop and also called synchronously (via sync_client()) from worker threads.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from types import SimpleNamespace
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+
+from backend.config import OPENAI_API_KEY
+from backend.metrics import get_metrics
+from backend.serving_config import (
+    LLM_BASE_URL,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_CONNECTIONS,
+    LLM_TIMEOUT_SECONDS,
+)
+
+
+class _SyncCompletions:
+    """Blocking `chat.completions.create` routed through the gateway."""
+
+    def __init__(self, gateway: "LLMGateway"):
+        self._gateway = gateway
+
+    def create(self, **kwargs):
+        return self._gateway.run_sync(self._gateway.chat_completion(**kwargs))
+
+
+class LLMGateway:
+    """Pooled, concurrency-limited, coalescing access to an OpenAI-compatible API."""
+
+    def __init__(self, api_key: Optional[str] = OPENAI_API_KEY, base_url: Optional[str] = LLM_BASE_URL,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY, max_connections: int = LLM_MAX_CONNECTIONS,
+                 timeout: float = LLM_TIMEOUT_SECONDS):
+        self.api_key = api_key
+        self.base_url = base_url or None
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.timeout = timeout
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        # AsyncOpenAI, created on the gateway loop by start() or the first request
+        self._client = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+        self.requests = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.active = 0
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=loop.run_forever, name="llm-gateway", daemon=True)
+                self._thread.start()
+                self._loop = loop
+        return self._loop
+
+    def _create_client(self):
+        # Imported here: the openai package is slow to import and not needed until the first call
+        from openai import AsyncOpenAI
+
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+            timeout=self.timeout
+        )
+        return AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http_client)
+
+    def run_sync(self, coro):
+        """Run a gateway coroutine from a thread that is not the gateway's own loop."""
+        loop = self._ensure_started()
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("run_sync cannot be called from the gateway event loop")
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    async def _on_gateway_loop(self, coro):
+        loop = self._ensure_started()
+        try:
+            if asyncio.get_running_loop() is loop:
+                return await coro
+        except RuntimeError:
+            pass
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    @staticmethod
+    def request_key(kwargs: Dict) -> str:
+        payload = json.dumps(kwargs, sort_keys=True, default=str)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    async def chat_completion(self, **kwargs):
+        """Create a chat completion (same arguments as `client.chat.completions.create`)."""
+        return await self._on_gateway_loop(self._chat_completion(**kwargs))
+
+    def _ensure_client(self):
+        # Called on the gateway loop, which owns the client and semaphore
+        if self._client is None:
+            self._client = self._create_client()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def start(self):
+        """Start the gateway loop and create the client ahead of the first request (blocking)."""
+        async def create():
+            self._ensure_client()
+        self.run_sync(create())
+
+    async def _chat_completion(self, **kwargs):
+        self._ensure_client()
+        self.requests += 1
+        key = self.request_key(kwargs)
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # Its own task: a cancelled caller stops waiting without failing identical requests
+            task = asyncio.get_running_loop().create_task(self._upstream(key, kwargs))
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self._in_flight[key] = task
+        return await asyncio.shield(task)
+
+    async def _upstream(self, key: str, kwargs: Dict):
+        try:
+            async with self._semaphore:
+                self.active += 1
+                self.upstream_calls += 1
+                start = time.perf_counter()
+                try:
+                    response = await self._client.chat.completions.create(**kwargs)
+                finally:
+                    self.active -= 1
+                get_metrics().observe_llm(kwargs.get('model', ''), time.perf_counter() - start,
+                                          getattr(response, 'usage', None))
+        except BaseException:
+            self.errors += 1
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+        return response
+
+    async def stream_chat_completion(self, **kwargs) -> AsyncIterator[str]:
+        """
+        Stream a chat completion, yielding content deltas as they arrive.
+        Streams are never coalesced; closing the iterator cancels the upstream request.
+        """
+        caller_loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        def emit(item):
+            try:
+                caller_loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # The caller's loop has already closed
+                pass
+
+        async def produce():
+            self._ensure_client()
+            self.requests += 1
+            try:
+                async with self._semaphore:
+                    self.active += 1
+                    self.upstream_calls += 1
+                    start = time.perf_counter()
+                    usage = None
+                    try:
+                        stream = await self._client.chat.completions.create(stream=True, **kwargs)
+                        async for chunk in stream:
+                            # Only sent when the request asks for it (stream_options)
+                            usage = getattr(chunk, 'usage', None) or usage
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                emit(chunk.choices[0].delta.content)
+                    finally:
+                        self.active -= 1
+                    get_metrics().observe_llm(kwargs.get('model', ''), time.perf_counter() - start, usage,
+                                              stream=True)
+            except Exception as e:
+                self.errors += 1
+                emit(e)
+            finally:
+                emit(done)
+
+        producer = asyncio.run_coroutine_threadsafe(produce(), self._ensure_started())
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            producer.cancel()
+
+    def sync_client(self):
+        """An object exposing a blocking `chat.completions.create`, like openai.OpenAI."""
+        return SimpleNamespace(chat=SimpleNamespace(completions=_SyncCompletions(self)))
+
+    def get_stats(self) -> Dict:
+        return {
+            'base_url': self.base_url or 'https://api.openai.com/v1',
+            'max_concurrency': self.max_concurrency,
+            'active_requests': self.active,
+            'requests': self.requests,
+            'upstream_calls': self.upstream_calls,
+            'coalesced_requests': self.coalesced,
+            'errors': self.errors
+        }
+
+    def close(self):
+        """Close the connection pool and stop the gateway loop."""
+        if self._loop is None:
+            return
+        if self._client is not None:
+            self.run_sync(self._client.close())
+            self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop.close()
+        self._loop = None
+        self._thread = None
+
+
+# Global gateway instance
+_gateway_instance = None
+
+
+def get_llm_gateway():
+    """Get or create the global LLM gateway."""
+    global _gateway_instance
+    if _gateway_instance is None:
+        _gateway_instance = LLMGateway()
+    return _gateway_instance
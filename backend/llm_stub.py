@@ -0,0 +1,128 @@
+"""
+Local OpenAI-compatible stub server for tests, load tests and benchmarks.
+
+Implements POST /v1/chat/completions with canned, deterministic answers and a
+configurable latency, so the API can run without network access or cost:
+
+    python -m backend.llm_stub --port 8001 --latency-ms 300
+    LLM_BASE_URL=http://127.0.0.1:8001/v1 python -m backend.main
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+stub_app = FastAPI(title="OpenAI-compatible LLM stub")
+
+STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", "50"))
+# Delay between streamed tokens
+STUB_TOKEN_MS = float(os.getenv("LLM_STUB_TOKEN_MS", "10"))
+
+_STUB_EXPLANATION = {
+    "summary": "Stub explanation of the detected incident",
+    "keyIndicators": ["stub indicator 1", "stub indicator 2", "stub indicator 3"],
+    "confidenceInterpretation": "Stub confidence interpretation",
+    "recommendedAction": "Stub recommended action",
+    "riskLevel": "Medium",
+    "immediateSteps": ["Step 1", "Step 2"],
+    "alternativeActions": ["Alternative 1"],
+    "potentialWarning": ""
+}
+
+
+class ChatCompletionRequest(BaseModel):
+    model: str = "gpt-3.5-turbo"
+    messages: List[Dict]
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+    stream: bool = False
+
+
+def _count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _answer_for(messages: List[Dict]) -> str:
+    system = " ".join(m.get("content", "") for m in messages if m.get("role") == "system")
+    if "JSON" in system:
+        return json.dumps(_STUB_EXPLANATION)
+    question = messages[-1].get("content", "") if messages else ""
+    return f"Stub answer ({_count_tokens(question)} prompt tokens in the last message)."
+
+
+async def _stream_answer(completion_id: str, model: str, answer: str):
+    words = answer.split(" ")
+    for i, word in enumerate(words):
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "delta": {"content": word if i == 0 else " " + word},
+                "finish_reason": None
+            }]
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(STUB_TOKEN_MS / 1000.0)
+    final = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+    }
+    yield f"data: {json.dumps(final)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@stub_app.post("/v1/chat/completions")
+async def chat_completions(request: ChatCompletionRequest):
+    await asyncio.sleep(STUB_LATENCY_MS / 1000.0)
+    answer = _answer_for(request.messages)
+    if request.stream:
+        return StreamingResponse(
+            _stream_answer(f"chatcmpl-{uuid.uuid4().hex}", request.model, answer),
+            media_type="text/event-stream"
+        )
+    prompt_tokens = sum(_count_tokens(m.get("content", "")) for m in request.messages)
+    completion_tokens = _count_tokens(answer)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": answer},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the OpenAI-compatible LLM stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=STUB_LATENCY_MS)
+    parser.add_argument("--token-ms", type=float, default=STUB_TOKEN_MS)
+    args = parser.parse_args()
+
+    STUB_LATENCY_MS = args.latency_ms
+    STUB_TOKEN_MS = args.token_ms
+    uvicorn.run(stub_app, host=args.host, port=args.port, log_level="warning")
@@ -1,18 +1,57 @@
 """
 FastAPI main application for Smart Predictive Field Intelligence System.
 """
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import asyncio
+import json
+import os
+import time
+import uuid
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import ClientDisconnect
 from pydantic import BaseModel
-from typing import List, Optional, Dict
-import numpy as np
-import cv2
+from typing import List, Optional, Dict, Literal
 from datetime import datetime
 
-from backend.model_utils import get_model
-from backend.ai_agent import get_ai_agent
+import cv2
+import numpy as np
+
 from backend.chatbot import get_chatbot
+from backend.conversation_store import DEFAULT_SESSION
+from backend.inference_scheduler import InferenceScheduler
+from backend.inference_backends import create_backend, model_factory
+from backend.execution import get_execution_layer, ServerOverloaded
+from backend.preprocessing import decode_image, decode_base64
+from backend.batch_prediction import (
+    BatchFormatError, BatchItem, BatchPredictor, DuplexStreamingResponse, multipart_boundary
+)
+from backend.prediction_cache import get_prediction_cache, content_key, perceptual_hash
+from backend.explanation_service import ExplanationService
+from backend.llm_gateway import get_llm_gateway
+from backend.incident_store import get_incident_store, parse_time_range
+from backend.anomaly_engine import get_anomaly_engine, replay_anomalies, risk_level
+from backend.incident_tracker import IncidentUpdate, get_incident_tracker
+from backend.pattern_analytics import get_pattern_analytics
+from backend.startup import StartupManager
+from backend.metrics import MetricsMiddleware, get_metrics, get_profiler, stats_gauges
+from backend.serving_config import (
+    EXPLANATION_MODE,
+    INCIDENT_RECOMMENDATIONS,
+    INCIDENT_TRACKING_ENABLED,
+    OVERLOAD_STATUS_CODE,
+    API_WORKERS,
+    INFERENCE_BACKEND,
+    PREDICTION_CACHE_ENABLED,
+    PREDICTION_CACHE_PERCEPTUAL,
+    STARTUP_WARMUP,
+    STARTUP_WARMUP_BATCH_SIZES,
+    VIDEO_DECODE_PARALLEL,
+    VIDEO_SAMPLE_FPS,
+)
+from backend.frame_stream import FrameStreamSession, StreamFrame
+from backend.video_ingest import VideoFormatError, VideoTimeline, spool_upload
 
 app = FastAPI(
     title="Smart Predictive Field Intelligence System",
@@ -28,24 +67,157 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Per-route latency for /metrics (and slow-request profiles when enabled)
+app.add_middleware(MetricsMiddleware)
 
 # Initialize model and AI agent
 model = None
 ai_agent = None
 chatbot = None
+scheduler = None
+explainer = None
+execution = get_execution_layer()
+prediction_cache = get_prediction_cache() if PREDICTION_CACHE_ENABLED else None
+incident_store = get_incident_store()
+anomaly_engine = get_anomaly_engine()
+incident_tracker = get_incident_tracker() if INCIDENT_TRACKING_ENABLED else None
+pattern_analytics = get_pattern_analytics()
+batch_predictor = None
+video_timeline = None
+metrics = get_metrics()
+# Fire-and-forget tasks are referenced here until they finish, so they are not garbage-collected mid-run
+background_tasks = set()
+
+startup = StartupManager()
+
+
+async def load_model():
+    """Load the model (importing TensorFlow) and start the inference scheduler."""
+    global model, scheduler, batch_predictor, video_timeline
+    if INFERENCE_BACKEND == "remote":
+        # The model lives in the model server; this worker only holds shared-memory slots
+        from backend.model_server import connect
+        loaded, inference_backend = await execution.run_io(connect)
+    else:
+        # Resolved here so the server starts accepting connections before TensorFlow is loaded
+        loaded = await execution.run_io(model_factory())
+        if not loaded or not loaded.loaded:
+            raise RuntimeError("Model not loaded. Please run train_model.py first")
+        inference_backend = await execution.run_io(create_backend, loaded)
+    scheduler = InferenceScheduler(loaded, executor=execution.inference_executor, backend=inference_backend)
+    scheduler.start()
+    batch_predictor = BatchPredictor(lambda data: execution.run_cpu(decode_image, data),
+                                     scheduler.predict_batch)
+    video_timeline = VideoTimeline(execution.run_cpu, scheduler.predict_batch,
+                                   parallel=VIDEO_DECODE_PARALLEL or execution.workers)
+    # Published last: prediction endpoints accept requests from here on
+    model = loaded
+
+
+async def warm_up_inference():
+    """Run the decode pool and dummy batches through the backend once, before /ready reports ready."""
+    await startup.wait("model")
+    if not STARTUP_WARMUP:
+        return
+    blank = np.full((480, 640, 3), 127, dtype=np.uint8)
+    encoded = cv2.imencode(".jpg", blank)[1].tobytes()
+    await asyncio.gather(*(execution.run_cpu(decode_image, encoded) for _ in range(execution.workers)))
+    timings = await scheduler.warm_up(STARTUP_WARMUP_BATCH_SIZES)
+    print("✓ Inference warmed up: " + ", ".join(f"batch {size} in {seconds:.2f}s"
+                                               for size, seconds in timings.items()))
+
+
+async def load_llm_gateway():
+    """Create the pooled OpenAI client ahead of the first LLM call."""
+    await execution.run_io(get_llm_gateway().start)
+
+
+async def load_ai_agent():
+    global ai_agent, explainer
+    # The agent module imports the OpenAI SDK
+    from backend.ai_agent import get_ai_agent
+
+    agent = await execution.run_io(get_ai_agent)
+    # Route the agent's OpenAI calls through the shared, pooled gateway
+    agent.client = get_llm_gateway().sync_client()
+    explainer = ExplanationService(agent, execution)
+    ai_agent = agent
+
+
+async def load_chatbot():
+    global chatbot
+    loaded = await execution.run_io(get_chatbot)
+    loaded.incident_store = incident_store
+    chatbot = loaded
+
+
+# Inference gates readiness; the LLM-backed components only report their progress
+startup.register("model", load_model)
+startup.register("warmup", warm_up_inference)
+startup.register("llm_gateway", load_llm_gateway, required=False)
+startup.register("ai_agent", load_ai_agent, required=False)
+startup.register("chatbot", load_chatbot, required=False)
+
+# Gauges are read from the components' own stats when /metrics is scraped
+metrics.gauge("inference_queue_depth", "Images waiting for the inference scheduler", [],
+              lambda: {(): scheduler.get_stats()['queue_depth']} if scheduler else {})
+metrics.gauge("pending_requests", "Requests holding an admission slot", [],
+              lambda: {(): execution.pending})
+metrics.gauge("rejected_requests", "Requests rejected by admission control since start", [],
+              lambda: {(): execution.rejected})
+metrics.gauge("prediction_cache", "Prediction cache statistics", ["field"],
+              stats_gauges(lambda: prediction_cache.get_stats() if prediction_cache else None,
+                           ("entries", "memory_bytes", "exact_hits", "perceptual_hits", "misses", "hit_rate")))
+metrics.gauge("explanation_cache", "Explanation cache statistics", ["field"],
+              stats_gauges(lambda: explainer.get_stats() if explainer else None,
+                           ("cache_entries", "cache_hits", "cache_misses", "cache_hit_rate", "pending_jobs")))
+metrics.gauge("llm_gateway", "LLM gateway statistics", ["field"],
+              stats_gauges(lambda: get_llm_gateway().get_stats(),
+                           ("active_requests", "requests", "upstream_calls", "coalesced_requests", "errors")))
+metrics.gauge("batch_upload_memory_mb", "Memory held by in-flight batch uploads", ["field"],
+              stats_gauges(lambda: batch_predictor.budget.get_stats() if batch_predictor else None,
+                           ("used_mb", "peak_mb", "waiting")))
+metrics.gauge("incident_tracker", "Incident tracker statistics", ["field"],
+              stats_gauges(lambda: incident_tracker.get_stats() if incident_tracker else None,
+                           ("open_incidents", "opened", "closed", "frames")))
+metrics.gauge("component_ready", "1 once a startup component has loaded", ["component"],
+              lambda: {(name,): float(c['state'] == "ready")
+                       for name, c in startup.status()['components'].items()})
+
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize model and AI agent on startup."""
-    global model, ai_agent, chatbot
-    try:
-        model = get_model()
-        ai_agent = get_ai_agent()
-        chatbot = get_chatbot()
-        print("✓ Model, AI agent, and Chatbot initialized successfully")
-    except Exception as e:
-        print(f"⚠ Warning: Could not initialize model: {e}")
-        print("⚠ Please run train_model.py first to train the model")
+    """Load the model, AI agent and chatbot concurrently in the background."""
+    startup.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the inference scheduler and worker pools."""
+    await startup.stop()
+    if scheduler:
+        await scheduler.stop()
+        if hasattr(scheduler.backend, "close"):
+            scheduler.backend.close()
+    execution.shutdown()
+    get_llm_gateway().close()
+    incident_store.close()
+
+
+@app.exception_handler(ServerOverloaded)
+async def overload_handler(request: Request, exc: ServerOverloaded):
+    """Reject work quickly when the admission queue is full."""
+    return JSONResponse(
+        status_code=OVERLOAD_STATUS_CODE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+async def admit_request():
+    """Dependency that holds an admission slot for the duration of a request."""
+    with execution.admit():
+        yield
 
 
 # Pydantic models
@@ -55,6 +227,9 @@ class PredictionResponse(BaseModel):
     confidence: float
     predicted_class: str
     explanation: Optional[Dict] = None
+    explanation_job_id: Optional[str] = None
+    # Incident the frame belongs to (streams with incident tracking)
+    incident: Optional[Dict] = None
     timestamp: str
 
 
@@ -64,13 +239,20 @@ class AlertRequest(BaseModel):
 
 
 class HistoricalAnalysisRequest(BaseModel):
-    data: List[Dict]
-    time_range: Optional[str] = None
+    data: Optional[List[Dict]] = []  # Empty: analyze the server-side incident store
+    time_range: Optional[str] = None  # e.g. "1h", "24h", "7d"
+    predicted_class: Optional[str] = None
+    stream_id: Optional[str] = None
+    # Ask the LLM to narrate the computed statistics
+    narrate: bool = True
 
 
 class AnomalyDetectionRequest(BaseModel):
-    predictions: List[Dict]
+    # Historical predictions to replay; when empty, live anomalies are returned
+    predictions: Optional[List[Dict]] = []
     threshold: Optional[float] = 0.7
+    stream_id: Optional[str] = None
+    limit: int = 100
 
 
 class ChatRequest(BaseModel):
@@ -78,12 +260,227 @@ class ChatRequest(BaseModel):
     predictions: Optional[List[Dict]] = []
     alerts: Optional[List[Dict]] = []
     historical_data: Optional[List[Dict]] = []
+    # Keeps conversation history separate per operator; omitted means the shared default session
+    session_id: Optional[str] = None
 
 
 class FrameRequest(BaseModel):
     frame_data: str  # Base64 encoded image
     include_explanation: bool = True
+    explanation_mode: Literal["inline", "async"] = EXPLANATION_MODE
     timestamp: Optional[float] = None  # Video timestamp in seconds
+    stream_id: Optional[str] = None  # Camera / video stream identifier
+
+
+# /api/predict/batch reads its multipart body itself; document the form for OpenAPI
+BATCH_UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+                    "required": ["files"]
+                }
+            }
+        }
+    }
+}
+
+
+def classify_confidence(confidence: float):
+    """
+    Classify a prediction based on confidence.
+    >= 90%: confirmed (مؤكد)
+    70-90%: potential (محتمل)
+    < 70%: ignored (متجاهل)
+    """
+    if confidence >= 0.9:
+        return "confirmed", True
+    elif confidence >= 0.7:
+        return "potential", False
+    return "ignored", False
+
+
+async def predict_encoded_image(image_data: bytes, include_explanation: bool,
+                                context: Optional[Dict] = None,
+                                explanation_mode: str = EXPLANATION_MODE) -> Optional[Dict]:
+    """
+    Decode, predict and (optionally) explain one encoded image.
+    Duplicate and near-duplicate frames are served from the prediction cache,
+    skipping inference and explanation. In "async" explanation mode the
+    explanation is generated in the background and only its job id is returned.
+    Returns None if the image is invalid.
+    """
+    key = content_key(image_data) if prediction_cache else None
+    cached = prediction_cache.get(key) if prediction_cache else None
+    image = None
+    phash = None
+
+    if cached is None:
+        with metrics.stage("image_decode"):
+            image = await execution.run_cpu(decode_image, image_data)
+        if image is None:
+            return None
+        if prediction_cache and PREDICTION_CACHE_PERCEPTUAL:
+            with metrics.stage("perceptual_hash"):
+                phash = perceptual_hash(image.pixels)
+            # A hit also indexes these exact bytes, without extending the matched entry
+            cached = prediction_cache.get_similar(phash, key)
+        elif prediction_cache:
+            prediction_cache.record_miss()
+
+    if cached is not None:
+        result, explanation = cached['result'], cached['explanation']
+        if not (include_explanation and explainer and explanation is None):
+            return {"result": result, "explanation": explanation, "explanation_job_id": None, "cached": True}
+        image_size = cached['image_size']
+    else:
+        # Predict (batched with concurrent requests)
+        with metrics.stage("inference"):
+            result = await scheduler.submit(image.pixels)
+        prediction_status, should_count = classify_confidence(result['top_prediction']['confidence'])
+        result['top_prediction']['status'] = prediction_status
+        result['top_prediction']['should_count'] = should_count
+        explanation = None
+        image_size = image.original_shape
+
+    # Generate explanation if requested
+    job_id = None
+    if include_explanation and explainer:
+        explanation_context = {
+            "image_size": image_size,
+            "timestamp": datetime.now().isoformat(),
+            **(context or {}),
+            "confidence": result['top_prediction']['confidence'],
+            "prediction_status": result['top_prediction']['status']
+        }
+        if explanation_mode == "async":
+            job_id = explainer.submit(result, explanation_context)
+        else:
+            with metrics.stage("explanation"):
+                explanation = await explainer.explain(result, explanation_context)
+
+    if prediction_cache:
+        value = {"result": result, "explanation": explanation, "image_size": image_size}
+        if cached is None:
+            prediction_cache.put(key, value, phash)
+        else:
+            # Explanation added to a cached result: keep the entry's expiry and hash
+            prediction_cache.update(key, value)
+    return {"result": result, "explanation": explanation, "explanation_job_id": job_id, "cached": cached is not None}
+
+
+def run_in_background(coro) -> asyncio.Task:
+    """Start a task that no request awaits (attaching explanations, recommendations)."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def record_prediction(prediction: Dict, source: str, stream_id: Optional[str] = None,
+                      extra: Optional[Dict] = None) -> Dict:
+    """
+    Add a prediction to the incident store and the anomaly engine;
+    a pending async explanation is attached when ready.
+    """
+    top = prediction['result']['top_prediction']
+    record = incident_store.add({
+        "predicted_class": top['class'],
+        "confidence": top['confidence'],
+        "status": top.get('status'),
+        "should_count": top.get('should_count'),
+        "stream_id": stream_id,
+        "source": source,
+        "explanation": prediction.get('explanation'),
+        **(extra or {})
+    })
+    anomaly_engine.observe(stream_id or source, top['class'], top['confidence'],
+                           record['ts'], record['timestamp'])
+
+    job_id = prediction.get('explanation_job_id')
+    if job_id:
+        async def attach_explanation():
+            job = await explainer.wait(job_id)
+            if job and job.get('explanation'):
+                incident_store.update(record['id'], explanation=job['explanation'])
+        run_in_background(attach_explanation())
+    return record
+
+
+async def recommend_for_incident(incident: Dict, context: Dict):
+    """Generate recommendations for a new incident and attach them to it."""
+    try:
+        recommendations = await execution.run_io(ai_agent.generate_recommendation,
+                                                  [incident_tracker.as_alert(incident)], context)
+    except Exception as e:
+        print(f"⚠ Recommendations for incident {incident['id']} failed: {e}")
+        return
+    incident_tracker.update(incident['id'], recommendations=recommendations)
+
+
+async def track_prediction(prediction: Dict, stream_id: str, stream_time: Optional[float] = None,
+                           include_explanation: bool = False,
+                           explanation_mode: str = EXPLANATION_MODE) -> IncidentUpdate:
+    """
+    Feed a stream's prediction to the incident tracker. The explanation and
+    recommendations are requested once, when the frame opens an incident;
+    later frames of the incident share them instead of calling the LLM again.
+    """
+    update = incident_tracker.observe(stream_id, prediction['result'], stream_time)
+    if not (update.opened and include_explanation and explainer):
+        return update
+
+    incident = update.incident
+    top = prediction['result']['top_prediction']
+    context = {
+        "timestamp": datetime.now().isoformat(),
+        "stream_id": stream_id,
+        "video_timestamp": stream_time,
+        "incident_id": incident['id'],
+        "confidence": top['confidence'],
+        "prediction_status": top.get('status')
+    }
+    job_id = explainer.submit(prediction['result'], context)
+    incident_tracker.update(incident['id'], explanation_job_id=job_id)
+
+    async def attach_explanation():
+        job = await explainer.wait(job_id)
+        if job and job.get('explanation'):
+            incident_tracker.update(incident['id'], explanation=job['explanation'])
+
+    attached = run_in_background(attach_explanation())
+    if INCIDENT_RECOMMENDATIONS and ai_agent:
+        run_in_background(recommend_for_incident(incident, context))
+    if explanation_mode == "inline":
+        with metrics.stage("explanation"):
+            await asyncio.shield(attached)
+    return update
+
+
+def build_prediction_response(prediction: Dict, incident: Optional[Dict] = None) -> PredictionResponse:
+    """
+    Build the API response for a prediction from predict_encoded_image.
+    Frames of a tracked incident carry the incident's explanation.
+    """
+    result = prediction['result']
+    if incident is not None:
+        incident = dict(incident)
+        explanation, job_id = incident['explanation'], incident['explanation_job_id']
+    else:
+        explanation, job_id = prediction['explanation'], prediction['explanation_job_id']
+    return PredictionResponse(
+        predictions=result['predictions'],
+        top_prediction=result['top_prediction'],
+        confidence=result['top_prediction']['confidence'],
+        predicted_class=result['top_prediction']['class'],
+        explanation=explanation,
+        explanation_job_id=job_id,
+        incident=incident,
+        timestamp=datetime.now().isoformat()
+    )
 
 
 # API Endpoints
@@ -96,18 +493,55 @@ async def root():
         "status": "operational",
             "endpoints": {
             "health": "/health",
+            "ready": "/ready",
+            "metrics": "/metrics",
             "predict": "/api/predict",
             "predict_frame": "/api/predict/frame",
             "predict_batch": "/api/predict/batch",
+            "predict_video": "/api/predict/video",
+            "stream": "/ws/stream/{camera_id}",
             "explain": "/api/explain",
+            "explanation_job": "/api/explain/jobs/{job_id}",
             "recommendations": "/api/recommendations",
             "analyze_patterns": "/api/analyze/patterns",
             "anomaly_detection": "/api/anomaly/detect",
-            "chat": "/api/chat"
+            "incidents": "/api/incidents",
+            "tracked_incidents": "/api/incidents/tracked",
+            "chat": "/api/chat",
+            "chat_stream": "/api/chat/stream"
         }
     }
 
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: 200 once the model is loaded and inference is warmed up,
+    503 before that. Reports load progress and timings per component.
+    """
+    status = startup.status()
+    status["timestamp"] = datetime.now().isoformat()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint: stage and request latency histograms, batch sizes, LLM tokens and gauges."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/debug/slow-requests")
+async def slow_requests():
+    """Folded-stack profiles of recent slow requests (METRICS_PROFILE_SLOW_MS > 0)."""
+    profiler = get_profiler()
+    return {
+        "enabled": profiler.enabled,
+        "threshold_ms": profiler.threshold * 1000.0,
+        "profiled": profiler.profiled,
+        "requests": profiler.reports()
+    }
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
@@ -120,200 +554,335 @@ async def health_check():
     }
 
 
-@app.post("/api/predict", response_model=PredictionResponse)
-async def predict_crime(file: UploadFile = File(...), include_explanation: bool = True):
+@app.post("/api/predict", response_model=PredictionResponse, dependencies=[Depends(admit_request)])
+async def predict_crime(file: UploadFile = File(...), include_explanation: bool = True,
+                        explanation_mode: Literal["inline", "async"] = EXPLANATION_MODE):
     """
     Predict crime type from uploaded image.
+    With explanation_mode=async the explanation is fetched later from /api/explain/jobs/{job_id}.
     """
     if not model or not model.loaded:
         raise HTTPException(status_code=503, detail="Model not loaded. Please train the model first.")
     
     try:
-        # Read image
         contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        prediction = await predict_encoded_image(contents, include_explanation, explanation_mode=explanation_mode)
         
-        if img is None:
+        if prediction is None:
             raise HTTPException(status_code=400, detail="Invalid image file")
         
-        # Convert BGR to RGB
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        
-        # Predict
-        result = model.predict(img_rgb)
-        
-        confidence = result['top_prediction']['confidence']
-        predicted_class = result['top_prediction']['class']
-        
-        # Classify prediction based on confidence
-        # >= 90%: confirmed (مؤكد)
-        # 70-90%: potential (محتمل)
-        # < 70%: ignored (متجاهل)
-        if confidence >= 0.9:
-            prediction_status = "confirmed"
-            should_count = True
-        elif confidence >= 0.7:
-            prediction_status = "potential"
-            should_count = False
-        else:
-            prediction_status = "ignored"
-            should_count = False
-        
-        # Generate explanation if requested
-        explanation = None
-        if include_explanation and ai_agent:
-            context = {
-                "image_size": img.shape,
-                "timestamp": datetime.now().isoformat(),
-                "confidence": confidence,
-                "prediction_status": prediction_status
-            }
-            explanation = ai_agent.generate_explanation(result, context)
-        
-        # Add status and should_count to result
-        result['top_prediction']['status'] = prediction_status
-        result['top_prediction']['should_count'] = should_count
-        
-        return PredictionResponse(
-            predictions=result['predictions'],
-            top_prediction=result['top_prediction'],
-            confidence=confidence,
-            predicted_class=predicted_class,
-            explanation=explanation,
-            timestamp=datetime.now().isoformat()
-        )
+        record_prediction(prediction, "upload", extra={"filename": file.filename})
+        return build_prediction_response(prediction)
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
 
-@app.post("/api/predict/frame", response_model=PredictionResponse)
+@app.post("/api/predict/frame", response_model=PredictionResponse, dependencies=[Depends(admit_request)])
 async def predict_frame(request: FrameRequest):
     """
     Predict crime type from a video frame (base64 encoded image).
-    Used for real-time video processing.
+    Used for real-time video processing. Frames with a stream_id are merged into
+    incidents; the explanation is then generated once per incident and returned
+    with every frame that belongs to it.
     """
     if not model or not model.loaded:
         raise HTTPException(status_code=503, detail="Model not loaded. Please train the model first.")
     
     try:
-        import base64
-        
-        # Decode base64 image
-        image_data = base64.b64decode(request.frame_data.split(',')[-1])
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        # Decode base64 image off the event loop
+        with metrics.stage("base64_decode"):
+            image_data = await execution.run_cpu(decode_base64, request.frame_data)
+        tracked = incident_tracker is not None and request.stream_id is not None
+        prediction = await predict_encoded_image(
+            image_data,
+            request.include_explanation and not tracked,
+            {"video_timestamp": request.timestamp},
+            request.explanation_mode
+        )
         
-        if img is None:
+        if prediction is None:
             raise HTTPException(status_code=400, detail="Invalid frame data")
         
-        # Convert BGR to RGB
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        
-        # Predict
-        result = model.predict(img_rgb)
-        
-        confidence = result['top_prediction']['confidence']
-        predicted_class = result['top_prediction']['class']
-        
-        # Classify prediction based on confidence
-        # >= 90%: confirmed (مؤكد)
-        # 70-90%: potential (محتمل)
-        # < 70%: ignored (متجاهل)
-        if confidence >= 0.9:
-            prediction_status = "confirmed"
-            should_count = True
-        elif confidence >= 0.7:
-            prediction_status = "potential"
-            should_count = False
-        else:
-            prediction_status = "ignored"
-            should_count = False
-        
-        # Generate explanation if requested
-        explanation = None
-        if request.include_explanation and ai_agent:
-            context = {
-                "image_size": img.shape,
-                "timestamp": datetime.now().isoformat(),
-                "video_timestamp": request.timestamp,
-                "confidence": confidence,
-                "prediction_status": prediction_status
+        incident = None
+        extra = {"video_timestamp": request.timestamp}
+        if tracked:
+            update = await track_prediction(prediction, request.stream_id, request.timestamp,
+                                            request.include_explanation, request.explanation_mode)
+            incident = update.incident
+            if incident is not None:
+                extra["incident_id"] = incident['id']
+        record_prediction(prediction, "frame", request.stream_id, extra)
+        return build_prediction_response(prediction, incident)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Frame prediction error: {str(e)}")
+
+
+@app.websocket("/ws/stream/{camera_id}")
+async def stream_frames(websocket: WebSocket, camera_id: str, include_explanation: bool = False,
+                        explanation_mode: Literal["inline", "async"] = EXPLANATION_MODE):
+    """
+    Persistent per-camera frame stream.
+    Accepts binary messages (header + raw JPEG bytes, see backend.frame_stream)
+    and pushes predictions back on the same connection. Only the latest frame
+    is kept when inference falls behind. Frames are merged into incidents, and
+    with include_explanation one explanation is generated per incident; in async
+    explanation mode it is pushed as a separate "explanation" message when ready.
+    """
+    await websocket.accept()
+    if not model or not model.loaded:
+        await websocket.close(code=1013, reason="Model not loaded")
+        return
+
+    push_tasks = set()
+
+    async def push_explanation(job_id: str, incident_id: Optional[int] = None):
+        job = await explainer.wait(job_id)
+        message = {"type": "explanation", "camera_id": camera_id, **jsonable_encoder(job)}
+        if incident_id is not None:
+            message["incident_id"] = incident_id
+        try:
+            await websocket.send_json(message)
+        except Exception:
+            # Connection closed before the explanation was ready
+            pass
+
+    async def process_frame(frame: StreamFrame) -> Dict:
+        prediction = await predict_encoded_image(
+            frame.payload,
+            include_explanation and incident_tracker is None,
+            {"video_timestamp": frame.timestamp, "camera_id": camera_id},
+            explanation_mode
+        )
+        if prediction is None:
+            return {"type": "error", "detail": "Invalid frame data"}
+
+        update = None
+        extra = {"video_timestamp": frame.timestamp}
+        job_id, incident_id = prediction["explanation_job_id"], None
+        if incident_tracker is not None:
+            update = await track_prediction(prediction, camera_id, frame.timestamp,
+                                            include_explanation, explanation_mode)
+            if update.incident is not None:
+                extra["incident_id"] = update.incident['id']
+            if update.opened and explanation_mode == "async":
+                job_id, incident_id = update.incident['explanation_job_id'], update.incident['id']
+        record_prediction(prediction, "stream", camera_id, extra)
+
+        if job_id:
+            task = asyncio.create_task(push_explanation(job_id, incident_id))
+            push_tasks.add(task)
+            task.add_done_callback(push_tasks.discard)
+
+        response = jsonable_encoder(build_prediction_response(prediction, update.incident if update else None))
+        response["camera_id"] = camera_id
+        response["cached"] = prediction["cached"]
+        if update and update.closed:
+            response["closed_incidents"] = jsonable_encoder([dict(incident) for incident in update.closed])
+        return response
+
+    await FrameStreamSession(websocket, process_frame).run()
+
+
+@app.post("/api/predict/batch", dependencies=[Depends(admit_request)],
+          openapi_extra=BATCH_UPLOAD_OPENAPI)
+async def predict_batch(request: Request, format: Literal["ndjson", "json"] = "ndjson"):
+    """
+    Predict crime types for multiple images (multipart form, one or more "files").
+    Files are decoded in parallel and run through the model in fixed-size chunks
+    while the upload is still arriving. Results are streamed in upload order, one
+    JSON object per line, followed by a {"done": true, ...} summary line.
+    Use format=json for a single {"results": [...], "total": n} response.
+    """
+    if not model or not model.loaded:
+        raise HTTPException(status_code=503, detail="Model not loaded. Please train the model first.")
+    content_type = request.headers.get("content-type", "")
+    try:
+        multipart_boundary(content_type)
+    except BatchFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    def to_result(item: BatchItem) -> Dict:
+        if item.error is not None:
+            return {
+                "filename": item.filename,
+                "error": item.error,
+                "timestamp": datetime.now().isoformat()
             }
-            explanation = ai_agent.generate_explanation(result, context)
-        
-        # Add status and should_count to result
+        result = item.result
+        prediction_status, should_count = classify_confidence(result['top_prediction']['confidence'])
         result['top_prediction']['status'] = prediction_status
         result['top_prediction']['should_count'] = should_count
-        
-        return PredictionResponse(
-            predictions=result['predictions'],
-            top_prediction=result['top_prediction'],
-            confidence=confidence,
-            predicted_class=predicted_class,
-            explanation=explanation,
-            timestamp=datetime.now().isoformat()
-        )
+        record_prediction({"result": result}, "batch", extra={"filename": item.filename})
+        return {
+            "filename": item.filename,
+            "prediction": result['top_prediction'],
+            "all_predictions": result['all_classes'],
+            "timestamp": datetime.now().isoformat()
+        }
     
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Frame prediction error: {str(e)}")
+    items = batch_predictor.predict(request.stream(), content_type)
+    
+    if format == "json":
+        try:
+            results = [to_result(item) async for item in items]
+        except BatchFormatError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"results": results, "total": len(results)}
+    
+    async def encode():
+        total, errors = 0, 0
+        try:
+            async for item in items:
+                total += 1
+                errors += item.error is not None
+                yield json.dumps(to_result(item)) + "\n"
+        except BatchFormatError as e:
+            yield json.dumps({"done": True, "total": total, "errors": errors, "error": str(e)}) + "\n"
+            return
+        except ClientDisconnect:
+            return
+        yield json.dumps({"done": True, "total": total, "errors": errors}) + "\n"
+    
+    return DuplexStreamingResponse(encode(), media_type="application/x-ndjson",
+                                   headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
-@app.post("/api/predict/batch")
-async def predict_batch(files: List[UploadFile] = File(...)):
+@app.post("/api/predict/video", dependencies=[Depends(admit_request)])
+async def predict_video(file: UploadFile = File(...), sample_fps: float = VIDEO_SAMPLE_FPS,
+                        stream_id: Optional[str] = None, format: Literal["ndjson", "json"] = "ndjson"):
     """
-    Predict crime types for multiple images.
+    Predict a timeline for an uploaded video file, decoded server-side.
+    The video is split into time chunks decoded in parallel; sample_fps frames
+    per second of video are run through the model in batches. One JSON object
+    per sampled frame is streamed in video order, followed by a {"done": true, ...}
+    summary line. Use format=json for a single {"timeline": [...], ...} response.
+    Predictions are recorded under stream_id (default: the file name), and the
+    incidents found in the video are listed with the summary.
     """
     if not model or not model.loaded:
         raise HTTPException(status_code=503, detail="Model not loaded. Please train the model first.")
+    if sample_fps <= 0:
+        raise HTTPException(status_code=400, detail="sample_fps must be positive")
+    
+    suffix = os.path.splitext(file.filename or "")[1]
+    try:
+        path = await execution.run_io(spool_upload, file.file, suffix)
+    except VideoFormatError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        info = await video_timeline.probe(path)
+    except VideoFormatError as e:
+        os.unlink(path)
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    source = stream_id or file.filename
+    # Each upload is tracked on its own, even when concurrent uploads share a name or stream_id
+    track_key = f"{source}#{uuid.uuid4().hex}"
+    video = {
+        "filename": file.filename,
+        "fps": info.fps,
+        "frame_count": info.frame_count,
+        "duration": info.duration,
+        "width": info.width,
+        "height": info.height,
+        "sample_fps": min(sample_fps, info.fps)
+    }
+    
+    incident_ids: Dict[int, None] = {}
+    
+    def to_entry(frame) -> Dict:
+        result = frame.result
+        prediction_status, should_count = classify_confidence(result['top_prediction']['confidence'])
+        result['top_prediction']['status'] = prediction_status
+        result['top_prediction']['should_count'] = should_count
+        extra = {"video_timestamp": frame.timestamp, "filename": file.filename}
+        entry = {
+            "timestamp": frame.timestamp,
+            "frame": frame.frame,
+            "prediction": result['top_prediction'],
+            "all_predictions": result['all_classes']
+        }
+        if incident_tracker is not None:
+            incident = incident_tracker.observe(track_key, result, frame.timestamp, label=source).incident
+            if incident is not None:
+                incident_ids[incident['id']] = None
+                extra["incident_id"] = entry["incident_id"] = incident['id']
+        record_prediction({"result": result}, "video", source, extra)
+        return entry
     
-    results = []
+    def video_incidents() -> List[Dict]:
+        """Incidents of this video; the one still open at the end of the file is closed."""
+        if incident_tracker is None:
+            return []
+        incident_tracker.close_stream(track_key)
+        return [incident for incident in map(incident_tracker.get, incident_ids) if incident is not None]
     
-    for file in files:
+    started = time.perf_counter()
+    frames = video_timeline.frames(path, info, sample_fps)
+    
+    if format == "json":
         try:
-            contents = await file.read()
-            nparr = np.frombuffer(contents, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            if img is None:
-                continue
-            
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            result = model.predict(img_rgb)
-            
-            results.append({
-                "filename": file.filename,
-                "prediction": result['top_prediction'],
-                "all_predictions": result['all_classes'],
-                "timestamp": datetime.now().isoformat()
-            })
+            timeline = [to_entry(frame) async for frame in frames]
         except Exception as e:
-            results.append({
-                "filename": file.filename,
-                "error": str(e),
-                "timestamp": datetime.now().isoformat()
-            })
+            raise HTTPException(status_code=500, detail=f"Video prediction error: {str(e)}")
+        finally:
+            os.unlink(path)
+        return {"video": video, "timeline": timeline, "frames": len(timeline), "incidents": video_incidents(),
+                "seconds": round(time.perf_counter() - started, 2)}
     
-    return {"results": results, "total": len(results)}
+    async def encode():
+        total = 0
+        try:
+            async for frame in frames:
+                total += 1
+                yield json.dumps(to_entry(frame)) + "\n"
+        except Exception as e:
+            yield json.dumps({"done": True, "frames": total, "video": video, "incidents": video_incidents(),
+                              "error": str(e)}) + "\n"
+            return
+        finally:
+            await frames.aclose()
+            os.unlink(path)
+        yield json.dumps({"done": True, "frames": total, "video": video, "incidents": video_incidents(),
+                          "seconds": round(time.perf_counter() - started, 2)}) + "\n"
+    
+    return StreamingResponse(encode(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
-@app.post("/api/explain")
+@app.post("/api/explain", dependencies=[Depends(admit_request)])
 async def explain_prediction(prediction_result: Dict):
     """
     Generate explainable AI explanation for a prediction.
     """
-    if not ai_agent:
+    if not explainer:
         raise HTTPException(status_code=503, detail="AI agent not available")
     
     try:
-        explanation = ai_agent.generate_explanation(prediction_result)
+        explanation = await explainer.explain(prediction_result)
         return explanation
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Explanation error: {str(e)}")
 
 
-@app.post("/api/recommendations")
+@app.get("/api/explain/jobs/{job_id}")
+async def get_explanation_job(job_id: str):
+    """
+    Get the status and result of a background explanation job.
+    """
+    job = explainer.get_job(job_id) if explainer else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Explanation job not found")
+    return job
+
+
+@app.post("/api/recommendations", dependencies=[Depends(admit_request)])
 async def get_recommendations(request: AlertRequest):
     """
     Get intelligent recommendations based on multiple alerts.
@@ -322,7 +891,8 @@ async def get_recommendations(request: AlertRequest):
         raise HTTPException(status_code=503, detail="AI agent not available")
     
     try:
-        recommendations = ai_agent.generate_recommendation(
+        recommendations = await execution.run_io(
+            ai_agent.generate_recommendation,
             request.alerts,
             request.context
         )
@@ -331,74 +901,116 @@ async def get_recommendations(request: AlertRequest):
         raise HTTPException(status_code=500, detail=f"Recommendation error: {str(e)}")
 
 
-@app.post("/api/analyze/patterns")
+@app.post("/api/analyze/patterns", dependencies=[Depends(admit_request)])
 async def analyze_patterns(request: HistoricalAnalysisRequest):
     """
     Analyze patterns in historical data for predictive insights.
+    Statistics are computed locally; the LLM only narrates the compact summary.
     """
-    if not ai_agent:
-        raise HTTPException(status_code=503, detail="AI agent not available")
-    
     try:
-        analysis = ai_agent.analyze_pattern(request.data)
+        if request.data:
+            # NumPy releases the GIL for the heavy parts of the analysis
+            statistics = await execution.run_io(pattern_analytics.summarize_records, request.data)
+        else:
+            # Analyze what the prediction endpoints have recorded server-side
+            statistics = await execution.run_io(
+                pattern_analytics.summarize_store,
+                incident_store,
+                predicted_class=request.predicted_class,
+                stream_id=request.stream_id,
+                window_seconds=parse_time_range(request.time_range)
+            )
+        
+        analysis = {
+            "statistics": statistics,
+            "pattern_analysis": None,
+            "timestamp": datetime.now().isoformat()
+        }
+        if request.narrate and statistics.get('total_records'):
+            try:
+                analysis["pattern_analysis"] = await pattern_analytics.narrate(statistics)
+            except Exception as e:
+                analysis["pattern_analysis"] = {"error": f"Error analyzing patterns: {str(e)}"}
         return analysis
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Pattern analysis error: {str(e)}")
 
 
+@app.get("/api/incidents")
+async def list_incidents(predicted_class: Optional[str] = None, stream_id: Optional[str] = None,
+                         time_range: Optional[str] = None, status: Optional[str] = None,
+                         limit: int = 100):
+    """
+    Query recorded predictions from the server-side incident store (newest first).
+    """
+    window = parse_time_range(time_range)
+    incidents = incident_store.query(
+        predicted_class=predicted_class,
+        stream_id=stream_id,
+        since=time.time() - window if window else None,
+        statuses=[status] if status else None,
+        limit=min(max(limit, 1), 1000)
+    )
+    return {"incidents": incidents, "total": len(incidents), "timestamp": datetime.now().isoformat()}
+
+
+@app.get("/api/incidents/tracked")
+async def list_tracked_incidents(stream_id: Optional[str] = None, predicted_class: Optional[str] = None,
+                                 status: Optional[Literal["open", "closed"]] = None, limit: int = 100):
+    """
+    Incident feed: open and recently closed incidents merged from the frames of
+    each stream (newest first), with their explanation and recommendations.
+    One entry per event instead of one per frame; 'alerts' has the same
+    incidents in the alert format.
+    """
+    if incident_tracker is None:
+        raise HTTPException(status_code=503, detail="Incident tracking is disabled")
+    incidents = incident_tracker.feed(stream_id, status, predicted_class, min(max(limit, 1), 1000))
+    return {
+        "incidents": incidents,
+        "alerts": [incident_tracker.as_alert(incident) for incident in incidents],
+        "total": len(incidents),
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+@app.get("/api/incidents/tracked/{incident_id}")
+async def get_tracked_incident(incident_id: int):
+    """
+    Get one tracked incident.
+    """
+    incident = incident_tracker.get(incident_id) if incident_tracker else None
+    if incident is None:
+        raise HTTPException(status_code=404, detail="Incident not found")
+    return incident
+
+
 @app.post("/api/anomaly/detect")
 async def detect_anomaly(request: AnomalyDetectionRequest):
     """
-    Detect anomalies in predictions based on confidence thresholds and patterns.
+    Detect anomalies in predictions based on confidence thresholds and rate spikes.
+    With `predictions`, the batch is replayed in bulk (vectorized); otherwise the
+    anomalies raised live by the prediction endpoints are returned (optionally for
+    one stream_id).
     """
-    predictions = request.predictions
-    threshold = request.threshold
-    
-    if not predictions:
-        return {"anomalies": [], "risk_level": "Low"}
-    
-    anomalies = []
-    high_risk_classes = ['Shooting', 'Explosion', 'Assault', 'Fighting']
-    
-    for pred in predictions:
-        class_name = pred.get('predicted_class', '')
-        confidence = pred.get('confidence', 0.0)
-        
-        # Check for high-risk predictions
-        if class_name in high_risk_classes and confidence > threshold:
-            anomalies.append({
-                "type": "high_risk_detection",
-                "class": class_name,
-                "confidence": confidence,
-                "severity": "High",
-                "timestamp": pred.get('timestamp', datetime.now().isoformat())
-            })
-        # Check for unexpected high confidence in non-normal classes
-        elif class_name != 'NormalVideos' and confidence > 0.9:
-            anomalies.append({
-                "type": "unusual_activity",
-                "class": class_name,
-                "confidence": confidence,
-                "severity": "Medium",
-                "timestamp": pred.get('timestamp', datetime.now().isoformat())
-            })
-    
-    # Determine overall risk level
-    if any(a['severity'] == 'High' for a in anomalies):
-        risk_level = "Critical"
-    elif len(anomalies) >= 3:
-        risk_level = "High"
-    elif len(anomalies) >= 1:
-        risk_level = "Medium"
+    if request.predictions:
+        anomalies = await execution.run_cpu(
+            replay_anomalies, request.predictions, request.threshold, anomaly_engine.high_risk_classes,
+            anomaly_engine.bucket_seconds, anomaly_engine.buckets, anomaly_engine.spike_factor,
+            anomaly_engine.min_count
+        )
     else:
-        risk_level = "Low"
+        anomalies = anomaly_engine.recent(request.stream_id, request.limit)
     
-    return {
+    response = {
         "anomalies": anomalies,
-        "risk_level": risk_level,
+        "risk_level": risk_level(anomalies),
         "total_anomalies": len(anomalies),
         "timestamp": datetime.now().isoformat()
     }
+    if request.stream_id and not request.predictions:
+        response["stream_state"] = anomaly_engine.stream_state(request.stream_id)
+    return response
 
 
 @app.get("/api/stats")
@@ -418,12 +1030,27 @@ async def get_statistics():
         "classes": model.label_encoder.classes_.tolist() if model.label_encoder else [],
         "model_path": str(model.model_path) if hasattr(model, 'model_path') else "N/A",
         "ai_agent_ready": ai_agent is not None,
+        "inference_scheduler": scheduler.get_stats() if scheduler else None,
+        "model_server": (await execution.run_io(scheduler.backend.server_stats)
+                         if scheduler and hasattr(scheduler.backend, "server_stats") else None),
+        "batch_predictions": batch_predictor.get_stats() if batch_predictor else None,
+        "video_ingest": video_timeline.get_stats() if video_timeline else None,
+        "execution": execution.get_stats(),
+        "prediction_cache": prediction_cache.get_stats() if prediction_cache else None,
+        "explanations": explainer.get_stats() if explainer else None,
+        "llm": get_llm_gateway().get_stats(),
+        "incident_store": incident_store.get_stats(),
+        "anomaly_engine": anomaly_engine.get_stats(),
+        "incident_tracker": incident_tracker.get_stats() if incident_tracker else None,
+        "pattern_analytics": pattern_analytics.get_stats(),
+        "conversations": chatbot.conversations.get_stats() if chatbot else None,
+        "chat_prompts": chatbot.prompts.get_stats() if chatbot else None,
         "chatbot_ready": chatbot is not None,
         "timestamp": datetime.now().isoformat()
     }
 
 
-@app.post("/api/chat")
+@app.post("/api/chat", dependencies=[Depends(admit_request)])
 async def chat_with_system(request: ChatRequest):
     """
     Chat with the system-aware AI assistant.
@@ -447,20 +1074,74 @@ async def chat_with_system(request: ChatRequest):
             }
         
         # Generate response
-        response = chatbot.chat(
+        response = await chatbot.achat(
             query=request.query,
             predictions=request.predictions or [],
             alerts=request.alerts or [],
             historical_data=request.historical_data or [],
-            stats=stats
+            stats=stats,
+            session_id=request.session_id or DEFAULT_SESSION
         )
         
-        return response
+        return {**response, "session_id": request.session_id or DEFAULT_SESSION}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
 
 
+@app.post("/api/chat/stream", dependencies=[Depends(admit_request)])
+async def chat_with_system_stream(request: ChatRequest, format: Literal["sse", "ndjson"] = "sse"):
+    """
+    Streaming variant of /api/chat.
+    Forwards answer tokens as they arrive ("token" events), then sends a final
+    "metadata" event with context_used. Use format=ndjson for one JSON object per line.
+    """
+    if not chatbot:
+        raise HTTPException(status_code=503, detail="Chatbot not available")
+    
+    stats = None
+    if model and model.loaded:
+        stats = {
+            "model_loaded": True,
+            "classes": model.label_encoder.classes_.tolist() if model.label_encoder else []
+        }
+    
+    events = chatbot.astream_chat(
+        query=request.query,
+        predictions=request.predictions or [],
+        alerts=request.alerts or [],
+        historical_data=request.historical_data or [],
+        stats=stats,
+        session_id=request.session_id or DEFAULT_SESSION
+    )
+    
+    async def encode():
+        async for event in events:
+            payload = json.dumps(event['data'])
+            if format == "ndjson":
+                yield json.dumps({"event": event['event'], **event['data']}) + "\n"
+            else:
+                yield f"event: {event['event']}\ndata: {payload}\n\n"
+    
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/event-stream"
+    return StreamingResponse(encode(), media_type=media_type,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 if __name__ == "__main__":
+    import secrets
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if API_WORKERS > 1:
+        # One model copy per host: a model server process plus API_WORKERS I/O workers,
+        # which read the channel's key from the environment they inherit
+        from backend.model_server import start_model_server
+        if not os.environ.get("MODEL_SERVER_AUTHKEY"):
+            os.environ["MODEL_SERVER_AUTHKEY"] = secrets.token_hex(32)
+        model_server = start_model_server(INFERENCE_BACKEND if INFERENCE_BACKEND != "remote" else "keras")
+        os.environ["INFERENCE_BACKEND"] = "remote"
+        try:
+            uvicorn.run("backend.main:app", host="0.0.0.0", port=8000, workers=API_WORKERS)
+        finally:
+            model_server.terminate()
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
 
@@ -0,0 +1,388 @@
+"""
+Low-overhead metrics for the hot path, exposed in the Prometheus text format at /metrics.
+
+- Histograms of per-stage latency (base64 decode, image decode, preprocessing,
+  forward pass, explanation, LLM calls, chat retrieval, ...), HTTP request
+  latency per route, and inference batch sizes.
+- Counters of LLM token usage (from the API's usage field).
+- Gauges read from the existing get_stats() of each component when /metrics is
+  scraped (queue depths, in-flight requests, cache hit rates), so the hot path
+  pays nothing for them.
+
+Recording an observation is a bisect and three additions under a lock. No
+prometheus_client dependency is needed. Every uvicorn worker keeps its own
+registry; scrape workers individually or run one worker per target.
+
+Optionally, a sampling profiler (METRICS_PROFILE_SLOW_MS) samples the stacks of
+all threads while requests are in flight. When a request exceeds the threshold,
+the samples taken during its lifetime are folded into a profile, which can be
+read from /api/debug/slow-requests. Samples cover every thread, so concurrent
+requests show up in each other's profiles.
+"""
+import bisect
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from backend.serving_config import (
+    METRICS_ENABLED,
+    METRICS_PROFILE_INTERVAL_MS,
+    METRICS_PROFILE_KEEP,
+    METRICS_PROFILE_SLOW_MS,
+)
+
+# Seconds; covers sub-millisecond decodes up to slow LLM calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+# Request methods labelled as themselves; anything else is "other"
+HTTP_METHODS = frozenset({"GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"})
+
+_PREFIX = "abshir_"
+
+# Innermost frames of threads that are idle (pool workers waiting for work, the
+# event loop waiting in select); leaving them out keeps profiles about real work
+_IDLE_FRAMES = {("thread.py", "_worker"), ("threading.py", "wait"), ("selectors.py", "select"),
+                ("queues.py", "get"), ("connection.py", "_recv")}
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = _PREFIX + name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self._header() + [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                                 for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        lines = self._header()
+        for key, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class GaugeCollector(_Metric):
+    """Gauges computed at scrape time by a callback returning {label values: value}."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str],
+                 collect: Callable[[], Dict[Tuple, float]]):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        try:
+            values = self.collect()
+        except Exception:
+            # A component that is still loading (or failed) must not break the scrape
+            values = {}
+        lines = self._header()
+        for key, value in values.items():
+            if value is None:
+                continue
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """The process's metrics, rendered together for /metrics."""
+
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self._metrics: Dict[str, _Metric] = {}
+        self.stage_seconds = self.register(Histogram(
+            "stage_seconds", "Latency of one processing stage", ["stage"]))
+        self.request_seconds = self.register(Histogram(
+            "http_request_seconds", "HTTP request latency until the response is complete",
+            ["method", "route", "status"]))
+        self.batch_size = self.register(Histogram(
+            "inference_batch_size", "Images per forward pass", ["source"], BATCH_SIZE_BUCKETS))
+        self.llm_seconds = self.register(Histogram(
+            "llm_request_seconds", "Latency of upstream LLM calls", ["model", "stream"]))
+        self.llm_tokens = self.register(Counter(
+            "llm_tokens_total", "LLM tokens reported by the API", ["model", "kind"]))
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str],
+              collect: Callable[[], Dict[Tuple, float]]):
+        """Register (or replace) a gauge computed from component stats at scrape time."""
+        self.register(GaugeCollector(name, documentation, labels, collect))
+
+    def observe_stage(self, stage: str, seconds: float):
+        if self.enabled:
+            self.stage_seconds.observe(seconds, stage)
+
+    @contextmanager
+    def stage(self, stage: str):
+        """Time a block as one stage."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds.observe(time.perf_counter() - start, stage)
+
+    def observe_batch(self, size: int, source: str = "scheduler"):
+        if self.enabled:
+            self.batch_size.observe(size, source)
+
+    def observe_llm(self, model: str, seconds: float, usage=None, stream: bool = False):
+        """Record one upstream LLM call; usage is the response's usage object, if any."""
+        if not self.enabled:
+            return
+        self.llm_seconds.observe(seconds, model, "true" if stream else "false")
+        if usage is not None:
+            self.llm_tokens.inc(getattr(usage, 'prompt_tokens', 0) or 0, model, "prompt")
+            self.llm_tokens.inc(getattr(usage, 'completion_tokens', 0) or 0, model, "completion")
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def stats_gauges(source: Callable[[], Optional[Dict]], fields: Iterable[str]) -> Callable[[], Dict[Tuple, float]]:
+    """Collect callback reading numeric fields of a component's get_stats(), labelled by field name."""
+    def collect() -> Dict[Tuple, float]:
+        stats = source()
+        if not stats:
+            return {}
+        return {(field,): float(stats[field]) for field in fields if isinstance(stats.get(field), (int, float))}
+    return collect
+
+
+class SlowRequestProfiler:
+    """
+    Samples the stacks of all threads while requests are in flight; requests
+    slower than the threshold get a folded-stack profile of their lifetime.
+    """
+
+    def __init__(self, threshold_ms: float = METRICS_PROFILE_SLOW_MS,
+                 interval_ms: float = METRICS_PROFILE_INTERVAL_MS, keep: int = METRICS_PROFILE_KEEP,
+                 max_depth: int = 48, window_seconds: float = 60.0):
+        self.threshold = threshold_ms / 1000.0
+        self.interval = max(interval_ms, 1.0) / 1000.0
+        self.max_depth = max_depth
+        # Bounded: at most window_seconds of samples are kept
+        self._samples: deque = deque(maxlen=max(1, int(window_seconds / self.interval)))
+        self._reports: deque = deque(maxlen=keep)
+        self._active = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.profiled = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def begin(self) -> float:
+        with self._lock:
+            self._active += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="metrics-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return time.perf_counter()
+
+    def end(self, started: float, description: str):
+        finished = time.perf_counter()
+        with self._lock:
+            self._active -= 1
+        if finished - started >= self.threshold:
+            self._report(started, finished, description)
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            if not self._active:
+                self._wake.clear()
+                self._wake.wait()
+            now = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (frame.f_code.co_filename.rsplit('/', 1)[-1], frame.f_code.co_name) in _IDLE_FRAMES:
+                    continue
+                self._samples.append((now, names.get(ident, str(ident)), self._fold(frame)))
+            time.sleep(self.interval)
+
+    def _fold(self, frame) -> str:
+        parts = []
+        while frame is not None and len(parts) < self.max_depth:
+            code = frame.f_code
+            parts.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        return ";".join(reversed(parts))
+
+    def _report(self, started: float, finished: float, description: str):
+        stacks: Dict[str, int] = {}
+        samples = 0
+        for ts, thread_name, stack in list(self._samples):
+            if started <= ts <= finished:
+                samples += 1
+                key = f"{thread_name};{stack}"
+                stacks[key] = stacks.get(key, 0) + 1
+        top = sorted(stacks.items(), key=lambda item: item[1], reverse=True)[:25]
+        self.profiled += 1
+        self._reports.append({
+            'request': description,
+            'duration_ms': round((finished - started) * 1000.0, 3),
+            'timestamp': datetime.now().isoformat(),
+            'samples': samples,
+            'interval_ms': self.interval * 1000.0,
+            'stacks': [{'stack': stack, 'samples': count} for stack, count in top]
+        })
+        print(f"⚠ Slow request profiled: {description} took {(finished - started) * 1000.0:.0f}ms")
+
+    def reports(self) -> List[Dict]:
+        return list(reversed(self._reports))
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by route template (and profiling slow ones)."""
+
+    def __init__(self, app, registry: Optional[MetricsRegistry] = None,
+                 profiler: Optional[SlowRequestProfiler] = None):
+        self.app = app
+        self.registry = registry or get_metrics()
+        self.profiler = profiler or get_profiler()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.registry.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        profiling = self.profiler.enabled
+        if profiling:
+            self.profiler.begin()
+        status = {'code': 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status['code'] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Unmatched paths and unknown methods share one label each so scanners
+            # cannot blow up the series count
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"] if scope["method"] in HTTP_METHODS else "other"
+            self.registry.request_seconds.observe(time.perf_counter() - start, method, path,
+                                                  str(status['code']))
+            if profiling:
+                self.profiler.end(start, f"{scope['method']} {scope['path']} -> {status['code']}")
+
+
+# Global metrics registry and profiler instances
+_metrics_instance = None
+_profiler_instance = None
+
+
+def get_metrics():
+    """Get or create the global metrics registry."""
+    global _metrics_instance
+    if _metrics_instance is None:
+        _metrics_instance = MetricsRegistry()
+    return _metrics_instance
+
+
+def get_profiler():
+    """Get or create the global slow-request profiler."""
+    global _profiler_instance
+    if _profiler_instance is None:
+        _profiler_instance = SlowRequestProfiler()
+    return _profiler_instance
@@ -0,0 +1,465 @@
+"""
+Dedicated model server: one process per host owns the model, HTTP workers share it.
+
+    export MODEL_SERVER_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(32))")
+    python -m backend.model_server            # then start workers with INFERENCE_BACKEND=remote
+    API_WORKERS=8 python -m backend.main      # or let main start both (with a key of its own)
+
+Each HTTP worker connects over a multiprocessing.connection channel (TCP on
+localhost, authenticated with MODEL_SERVER_AUTHKEY) and creates one
+shared-memory block with MODEL_SERVER_SLOTS slots. A slot holds a preprocessed
+float32 input batch followed by its output probabilities, so tensors never go
+through the socket; only small (request id, slot, count) messages do.
+
+The server merges requests from all workers into forward passes of up to
+MODEL_SERVER_MAX_BATCH images on a single inference thread, writes each
+worker's probabilities back into its slot and replies on its channel.
+"""
+import argparse
+import itertools
+import mmap
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import get_context
+from multiprocessing.connection import Client, Connection, Listener
+from multiprocessing.shared_memory import SharedMemory
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend.inference_backends import InferenceBackend
+from backend.serving_config import (
+    BATCH_PREDICT_CHUNK_SIZE,
+    INFERENCE_BACKEND,
+    INFERENCE_MAX_BATCH_SIZE,
+    MODEL_SERVER_AUTHKEY,
+    MODEL_SERVER_CONNECT_TIMEOUT_SECONDS,
+    MODEL_SERVER_HOST,
+    MODEL_SERVER_MAX_BATCH,
+    MODEL_SERVER_PORT,
+    MODEL_SERVER_REQUEST_TIMEOUT_SECONDS,
+    MODEL_SERVER_SLOTS,
+)
+
+# Images per slot: the largest batch a worker sends in one request
+SLOT_CAPACITY = max(INFERENCE_MAX_BATCH_SIZE, BATCH_PREDICT_CHUNK_SIZE)
+
+
+def resolve_authkey(authkey: str) -> bytes:
+    """
+    The channel's authkey. The channel unpickles what it receives, so there is
+    no default: anyone holding the key can run code in the model server.
+    """
+    if not authkey:
+        raise ValueError("MODEL_SERVER_AUTHKEY must be set for the model server and its workers")
+    return authkey.encode()
+
+
+def _slot_views(buffer, slots: int, capacity: int, input_shape: Tuple[int, ...],
+                classes: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(inputs, outputs) arrays over a shared-memory buffer laid out slot by slot."""
+    input_size = capacity * int(np.prod(input_shape))
+    slot_size = input_size + capacity * classes
+    flat = np.ndarray((slots, slot_size), dtype=np.float32, buffer=buffer)
+    inputs = flat[:, :input_size].reshape((slots, capacity, *input_shape))
+    outputs = flat[:, input_size:].reshape((slots, capacity, classes))
+    return inputs, outputs
+
+
+def _slot_bytes(slots: int, capacity: int, input_shape: Tuple[int, ...], classes: int) -> int:
+    return slots * capacity * (int(np.prod(input_shape)) + classes) * 4
+
+
+class _AttachedBlock:
+    """A worker's shared-memory block mapped without registering it with the resource tracker."""
+
+    def __init__(self, name: str):
+        import _posixshmem
+        fd = _posixshmem.shm_open("/" + name, os.O_RDWR, mode=0o600)
+        try:
+            self._mmap = mmap.mmap(fd, os.fstat(fd).st_size)
+        finally:
+            os.close(fd)
+        self.name = name
+        self.buf = memoryview(self._mmap)
+
+    def close(self):
+        self.buf.release()
+        self._mmap.close()
+
+
+def _attach(name: str):
+    """
+    Map a block created by a worker. The creating worker owns it: the server
+    must not register it with a resource tracker, which may be the one the
+    workers share (when main starts them all), or it would be unlinked when
+    the server exits and forgotten for the worker that created it.
+    """
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching always registers the block
+        pass
+    if os.name == "nt":
+        # No resource tracker on Windows
+        return SharedMemory(name=name)
+    return _AttachedBlock(name)
+
+
+# Server side
+
+class _Worker:
+    """One connected HTTP worker: its channel and shared-memory slots."""
+
+    def __init__(self, conn: Connection, shm, inputs: np.ndarray, outputs: np.ndarray):
+        self.conn = conn
+        # Replies come from the inference thread, stats from the worker's own thread
+        self.send_lock = threading.Lock()
+        self.shm = shm
+        self.inputs = inputs
+        self.outputs = outputs
+
+
+class _Request:
+    __slots__ = ("worker", "request_id", "slot", "count")
+
+    def __init__(self, worker: _Worker, request_id: int, slot: int, count: int):
+        self.worker = worker
+        self.request_id = request_id
+        self.slot = slot
+        self.count = count
+
+
+class ModelServer:
+    """Accepts HTTP workers and runs their batches through one inference backend."""
+
+    def __init__(self, model, backend: InferenceBackend, input_shape: Tuple[int, ...],
+                 host: str = MODEL_SERVER_HOST, port: int = MODEL_SERVER_PORT,
+                 authkey: str = MODEL_SERVER_AUTHKEY, max_batch: int = MODEL_SERVER_MAX_BATCH):
+        self.authkey = resolve_authkey(authkey)
+        self.model = model
+        self.backend = backend
+        self.input_shape = tuple(input_shape)
+        self.class_names = [str(name) for name in model.label_encoder.classes_]
+        self.address = (host, port)
+        self.max_batch = max_batch
+        self._requests: "queue.Queue[_Request]" = queue.Queue()
+        self._carry: Optional[_Request] = None
+
+        self.workers = 0
+        self.batches_run = 0
+        self.images_processed = 0
+
+    def serve_forever(self):
+        threading.Thread(target=self._inference_loop, name="inference", daemon=True).start()
+        with Listener(self.address, authkey=self.authkey) as listener:
+            print(f"✓ Model server listening on {self.address[0]}:{self.address[1]} ({self.backend.name})")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # Failed authentication or a connection that dropped during the handshake
+                    print(f"⚠ Rejected model server connection: {e}")
+                    continue
+                threading.Thread(target=self._serve_worker, args=(conn,), daemon=True).start()
+
+    def _serve_worker(self, conn: Connection):
+        worker = None
+        try:
+            conn.send(("hello", {
+                'class_names': self.class_names,
+                'input_shape': self.input_shape,
+                'backend': self.backend.name,
+                'model_path': str(getattr(self.model, 'model_path', 'N/A'))
+            }))
+            _, shm_name, slots, capacity = conn.recv()
+            shm = _attach(shm_name)
+            inputs, outputs = _slot_views(shm.buf, slots, capacity, self.input_shape, len(self.class_names))
+            worker = _Worker(conn, shm, inputs, outputs)
+            self.workers += 1
+            conn.send(("attached",))
+
+            while True:
+                message = conn.recv()
+                if message[0] == "predict":
+                    _, request_id, slot, count = message
+                    self._requests.put(_Request(worker, request_id, slot, count))
+                elif message[0] == "stats":
+                    with worker.send_lock:
+                        conn.send(("stats", message[1], self.get_stats()))
+        except (EOFError, OSError):
+            pass
+        finally:
+            if worker is not None:
+                self.workers -= 1
+                # Views into the block must be gone before it can be closed
+                worker.inputs = worker.outputs = None
+                try:
+                    worker.shm.close()
+                except BufferError:
+                    pass
+            conn.close()
+
+    def _next_batch(self) -> List[_Request]:
+        """Block for one request, then merge whatever else is queued up to max_batch images."""
+        first = self._carry or self._requests.get()
+        self._carry = None
+        batch, images = [first], first.count
+        while images < self.max_batch:
+            try:
+                request = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if images + request.count > self.max_batch:
+                self._carry = request
+                break
+            batch.append(request)
+            images += request.count
+        return batch
+
+    def _inference_loop(self):
+        while True:
+            # Skip requests of workers that disconnected while queued
+            batch = [request for request in self._next_batch() if request.worker.inputs is not None]
+            if not batch:
+                continue
+            try:
+                if len(batch) == 1:
+                    request = batch[0]
+                    tensor = request.worker.inputs[request.slot, :request.count]
+                else:
+                    tensor = np.concatenate([r.worker.inputs[r.slot, :r.count] for r in batch])
+                probabilities = self.backend.predict(tensor)
+            except Exception as e:
+                for request in batch:
+                    self._reply(request, ("error", request.request_id, str(e)))
+                continue
+
+            self.batches_run += 1
+            self.images_processed += len(probabilities)
+            offset = 0
+            for request in batch:
+                request.worker.outputs[request.slot, :request.count] = probabilities[offset:offset + request.count]
+                offset += request.count
+                self._reply(request, ("ok", request.request_id))
+
+    @staticmethod
+    def _reply(request: _Request, message: Tuple):
+        try:
+            with request.worker.send_lock:
+                request.worker.conn.send(message)
+        except (OSError, ValueError):
+            # The worker went away; its reader thread cleans up
+            pass
+
+    def get_stats(self) -> Dict:
+        return {
+            'backend': self.backend.name,
+            'workers': self.workers,
+            'batches_run': self.batches_run,
+            'images_processed': self.images_processed,
+            'average_batch_size': (self.images_processed / self.batches_run) if self.batches_run else 0.0,
+            'queue_depth': self._requests.qsize()
+        }
+
+
+def serve(backend_kind: str = INFERENCE_BACKEND, host: str = MODEL_SERVER_HOST, port: int = MODEL_SERVER_PORT):
+    """Load the model and serve it until the process is stopped."""
+    from backend.inference_backends import create_backend, model_factory
+    from backend.preprocessing import BatchPreprocessor
+
+    try:
+        resolve_authkey(MODEL_SERVER_AUTHKEY)
+    except ValueError as e:
+        raise SystemExit(f"⚠ {e}")
+    model = model_factory()()
+    if not model.loaded:
+        raise SystemExit("⚠ Model not loaded. Please run train_model.py first.")
+    backend = create_backend(model, kind=backend_kind)
+    preprocessor = BatchPreprocessor(max_batch_size=1)
+    input_shape = (preprocessor.height, preprocessor.width, preprocessor.channels)
+    ModelServer(model, backend, input_shape, host, port).serve_forever()
+
+
+def start_model_server(backend_kind: str = INFERENCE_BACKEND):
+    """Start the model server in a child process (used by `python -m backend.main` with API_WORKERS > 1)."""
+    process = get_context("spawn").Process(target=serve, args=(backend_kind,), name="model-server", daemon=True)
+    process.start()
+    return process
+
+
+# Worker side
+
+class RemoteModel:
+    """Stands in for CrimeDetectionModel in HTTP workers; the network lives in the model server."""
+
+    def __init__(self, class_names: List[str], model_path: str):
+        self.model = None
+        self.loaded = True
+        self.label_encoder = SimpleNamespace(classes_=np.array(class_names))
+        self.model_path = model_path
+
+
+class RemoteBackend(InferenceBackend):
+    """
+    Sends preprocessed batches to the model server through shared memory.
+    Thread-safe; reconnects (reusing its shared memory) if the server restarts.
+    """
+
+    name = "remote"
+
+    def __init__(self, host: str = MODEL_SERVER_HOST, port: int = MODEL_SERVER_PORT,
+                 authkey: str = MODEL_SERVER_AUTHKEY, slots: int = MODEL_SERVER_SLOTS,
+                 capacity: int = SLOT_CAPACITY, connect_timeout: float = MODEL_SERVER_CONNECT_TIMEOUT_SECONDS,
+                 request_timeout: float = MODEL_SERVER_REQUEST_TIMEOUT_SECONDS):
+        self.address = (host, port)
+        self.authkey = resolve_authkey(authkey)
+        self.slots = slots
+        self.capacity = capacity
+        self.request_timeout = request_timeout
+
+        self.shm: Optional[SharedMemory] = None
+        self.info: Dict = {}
+        self._conn: Optional[Connection] = None
+        self._send_lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+        self._pending: Dict[int, Future] = {}
+        self._ids = itertools.count()
+        self._free: "queue.Queue[int]" = queue.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+        self.requests = 0
+
+        self._connect(connect_timeout)
+
+    def _connect(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                conn = Client(self.address, authkey=self.authkey)
+                break
+            except (ConnectionRefusedError, FileNotFoundError):
+                if time.monotonic() >= deadline:
+                    raise ConnectionError(f"Model server not reachable at {self.address[0]}:{self.address[1]}")
+                time.sleep(0.25)
+
+        _, info = conn.recv()
+        input_shape = tuple(info['input_shape'])
+        classes = len(info['class_names'])
+        if self.shm is None:
+            self.shm = SharedMemory(create=True, size=_slot_bytes(self.slots, self.capacity, input_shape, classes))
+            self._inputs, self._outputs = _slot_views(self.shm.buf, self.slots, self.capacity, input_shape, classes)
+        elif tuple(self.info['input_shape']) != input_shape or len(self.info['class_names']) != classes:
+            conn.close()
+            raise ConnectionError("Model server now serves a model with a different input or class count")
+        conn.send(("attach", self.shm.name, self.slots, self.capacity))
+        conn.recv()
+
+        self.info = info
+        self._conn = conn
+        threading.Thread(target=self._receive, args=(conn,), name="model-server-client", daemon=True).start()
+
+    def _receive(self, conn: Connection):
+        try:
+            while True:
+                message = conn.recv()
+                future = self._pending.pop(message[1], None)
+                if future is None:
+                    continue
+                if message[0] == "error":
+                    future.set_exception(RuntimeError(f"Model server error: {message[2]}"))
+                else:
+                    future.set_result(message[2] if message[0] == "stats" else None)
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._send_lock:
+                if self._conn is conn:
+                    self._conn = None
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(ConnectionError("Lost connection to the model server"))
+
+    def _request(self, message: Tuple) -> Future:
+        with self._connect_lock:
+            if self._conn is None:
+                self._connect(self.request_timeout)
+        future = Future()
+        request_id = next(self._ids)
+        with self._send_lock:
+            if self._conn is None:
+                raise ConnectionError("Lost connection to the model server")
+            self._pending[request_id] = future
+            self._conn.send((message[0], request_id, *message[1:]))
+        return future
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        results = []
+        for start in range(0, len(batch), self.capacity):
+            part = batch[start:start + self.capacity]
+            slot = self._free.get()
+            future = None
+            try:
+                self._inputs[slot, :len(part)] = part
+                future = self._request(("predict", slot, len(part)))
+                future.result(self.request_timeout)
+                results.append(self._outputs[slot, :len(part)].copy())
+                self.requests += 1
+            finally:
+                if future is None:
+                    self._free.put(slot)
+                else:
+                    # After a timeout the server may still write into the slot: it is
+                    # reused only once the late reply (or the disconnect) resolves it
+                    future.add_done_callback(lambda _, slot=slot: self._free.put(slot))
+        return results[0] if len(results) == 1 else np.concatenate(results)
+
+    def remote_model(self) -> RemoteModel:
+        return RemoteModel(self.info['class_names'], self.info['model_path'])
+
+    def server_stats(self, timeout: float = 1.0) -> Optional[Dict]:
+        """The model server's own counters (shared by all workers), or None if it does not answer."""
+        try:
+            return self._request(("stats",)).result(timeout)
+        except Exception:
+            return None
+
+    def get_stats(self) -> Dict:
+        return {
+            'backend': self.name,
+            'server_backend': self.info.get('backend'),
+            'address': f"{self.address[0]}:{self.address[1]}",
+            'connected': self._conn is not None,
+            'slots': self.slots,
+            'requests': self.requests
+        }
+
+    def close(self):
+        with self._send_lock:
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+        if self.shm is not None:
+            self._inputs = self._outputs = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+def connect() -> Tuple[RemoteModel, RemoteBackend]:
+    """Connect an HTTP worker to the model server (waiting for it to come up)."""
+    backend = RemoteBackend()
+    return backend.remote_model(), backend
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the crime detection model to HTTP workers")
+    parser.add_argument("--backend", default=INFERENCE_BACKEND if INFERENCE_BACKEND != "remote" else "keras")
+    parser.add_argument("--host", default=MODEL_SERVER_HOST)
+    parser.add_argument("--port", type=int, default=MODEL_SERVER_PORT)
+    args = parser.parse_args()
+    serve(args.backend, args.host, args.port)
@@ -0,0 +1,383 @@
+"""
+Local, vectorized pattern analysis of prediction history.
+
+Records are converted to NumPy columns (the IncidentStore already keeps them in
+that form) and summarized in a few array passes:
+
+- class distribution and mean confidence per class
+- hour-of-day and day-of-week histograms of incidents (non-normal classes)
+- trend slopes (incidents per day, or per hour for short histories), overall and per class
+- co-occurrence of classes on the same stream within PATTERN_COOCCURRENCE_SECONDS
+- peak windows of PATTERN_PEAK_WINDOW_SECONDS with the most incidents
+
+Summaries are cached by a fingerprint of the column arrays. The LLM only receives the
+compact summary to narrate, never the raw records.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from backend.llm_gateway import get_llm_gateway
+from backend.serving_config import (
+    PATTERN_CACHE_SIZE,
+    PATTERN_COOCCURRENCE_SECONDS,
+    PATTERN_PEAK_WINDOW_SECONDS,
+)
+
+NORMAL_CLASS = 'NormalVideos'
+_WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+# Upper bound on the number of time buckets used for peak detection
+_MAX_PEAK_BUCKETS = 200000
+# Largest (stream, bucket) x class table built densely for co-occurrence
+_MAX_DENSE_PRESENCE = 64 * 1024 * 1024
+
+PATTERN_SYSTEM_PROMPT = ("You are an expert security analyst. You MUST respond with ONLY valid JSON, "
+                         "no markdown, no code blocks, no explanations. Just the raw JSON object.")
+
+PATTERN_PROMPT = """You are an AI security analyst identifying patterns and predicting future risks.
+
+Historical Data Summary (computed statistics, JSON):
+{summary}
+
+Return ONLY a valid JSON object with this exact structure (no markdown, no code blocks):
+{{
+  "patternsAndTrends": {{"summary": "Brief overview of identified patterns", "details": ["pattern detail 1", "pattern detail 2", "pattern detail 3"]}},
+  "highRiskPeriods": {{"summary": "Brief overview of high-risk time periods", "details": ["period detail 1", "period detail 2", "period detail 3"]}},
+  "preventiveMeasures": {{"summary": "Brief overview of preventive measures", "details": ["measure 1", "measure 2", "measure 3"]}},
+  "monitoringAreas": {{"summary": "Brief overview of areas requiring monitoring", "details": ["area 1", "area 2", "area 3"]}},
+  "strategicRecommendations": {{"summary": "Brief overview of strategic recommendations", "details": ["recommendation 1", "recommendation 2", "recommendation 3"]}}
+}}
+
+Base every statement on the statistics above. Return ONLY the JSON, nothing else."""
+
+
+def _local_offset() -> float:
+    return datetime.now().astimezone().utcoffset().total_seconds()
+
+
+def _wall_clock_seconds(record: Dict, offset: float) -> float:
+    ts = record.get('ts')
+    if ts is not None:
+        return float(ts) + offset
+    timestamp = record.get('timestamp')
+    if not timestamp:
+        return np.nan
+    try:
+        parsed = datetime.fromisoformat(str(timestamp).replace('Z', '+00:00'))
+    except ValueError:
+        return np.nan
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.replace(tzinfo=timezone.utc).timestamp()
+
+
+def columns_from_records(records: Sequence[Dict]) -> Dict:
+    """Convert prediction dicts to the column layout of IncidentStore.columns()."""
+    n = len(records)
+    class_names, class_idx = np.unique(
+        np.array([str(r.get('predicted_class', 'Unknown')) for r in records], dtype=object), return_inverse=True
+    )
+    stream_names, stream_idx = np.unique(
+        np.array([str(r.get('stream_id') or '') for r in records], dtype=object), return_inverse=True
+    )
+    offset = _local_offset()
+    return {
+        'class_names': class_names,
+        'class_idx': class_idx.astype(np.int32),
+        'stream_names': stream_names,
+        'stream_idx': stream_idx.astype(np.int32),
+        'confidence': np.fromiter((float(r.get('confidence', 0.0) or 0.0) for r in records),
+                                  dtype=np.float32, count=n),
+        # Local wall-clock seconds (hour-of-day and weekday use local time)
+        'wall_clock': np.fromiter((_wall_clock_seconds(r, offset) for r in records), dtype=np.float64, count=n)
+    }
+
+
+def _iso(wall_clock: float) -> str:
+    return datetime.fromtimestamp(wall_clock, tz=timezone.utc).replace(tzinfo=None).isoformat()
+
+
+def _slopes(bins: np.ndarray, class_idx: np.ndarray, n_classes: int):
+    """Least-squares slope of counts per bin, overall and per class."""
+    first = bins.min()
+    n_bins = int(bins.max() - first) + 1
+    if n_bins < 2:
+        return 0.0, np.zeros(n_classes)
+    series = np.bincount((bins - first) * n_classes + class_idx,
+                         minlength=n_bins * n_classes).reshape(n_bins, n_classes).astype(np.float64)
+    x = np.arange(n_bins, dtype=np.float64)
+    x -= x.mean()
+    denominator = float(x @ x)
+    per_class = x @ (series - series.mean(axis=0)) / denominator
+    overall = float(x @ (series.sum(axis=1) - series.sum(axis=1).mean()) / denominator)
+    return overall, per_class
+
+
+def analyze_columns(columns: Dict, cooccurrence_seconds: float = PATTERN_COOCCURRENCE_SECONDS,
+                    peak_window_seconds: float = PATTERN_PEAK_WINDOW_SECONDS) -> Dict:
+    """Compute the pattern summary from column arrays (module-level so it can run in a process pool)."""
+    class_names = [str(name) for name in columns['class_names']]
+    class_idx = np.asarray(columns['class_idx'], dtype=np.int64)
+    confidence = np.asarray(columns['confidence'], dtype=np.float64)
+    n_classes = len(class_names)
+    total = int(len(class_idx))
+    if total == 0:
+        return {'total_records': 0}
+
+    counts = np.bincount(class_idx, minlength=n_classes)
+    confidence_sums = np.bincount(class_idx, weights=confidence, minlength=n_classes)
+    order = np.argsort(-counts)
+    distribution = {
+        class_names[c]: {
+            'count': int(counts[c]),
+            'share': round(float(counts[c]) / total, 4),
+            'mean_confidence': round(float(confidence_sums[c] / counts[c]), 4)
+        }
+        for c in order if counts[c]
+    }
+    summary = {
+        'total_records': total,
+        'class_distribution': distribution,
+        'mean_confidence': round(float(confidence.mean()), 4)
+    }
+
+    normal_code = class_names.index(NORMAL_CLASS) if NORMAL_CLASS in class_names else -1
+    incident = class_idx != normal_code
+    summary['total_incidents'] = int(incident.sum())
+
+    wall_clock = np.asarray(columns['wall_clock'], dtype=np.float64)
+    timed = ~np.isnan(wall_clock)
+    if not timed.any():
+        return summary
+
+    # Whole seconds keep the bucketing below in integer arithmetic
+    t = wall_clock[timed].astype(np.int64)
+    t_classes = class_idx[timed]
+    t_incident = incident[timed]
+    t_streams = np.asarray(columns['stream_idx'], dtype=np.int64)[timed]
+    start, end = int(t.min()), int(t.max())
+    summary['time_span'] = {'start': _iso(start), 'end': _iso(end), 'hours': round((end - start) / 3600, 2)}
+
+    inc_t = t[t_incident]
+    inc_classes = t_classes[t_incident]
+    if len(inc_t):
+        hours = inc_t // 3600 % 24
+        # 1970-01-01 was a Thursday
+        weekdays = (inc_t // 86400 + 3) % 7
+        hourly = np.bincount(hours, minlength=24)
+        daily = np.bincount(weekdays, minlength=7)
+        summary['hourly_incidents'] = hourly.tolist()
+        summary['peak_hours'] = [int(h) for h in np.argsort(-hourly)[:3] if hourly[h]]
+        summary['weekday_incidents'] = {_WEEKDAYS[d]: int(daily[d]) for d in range(7)}
+
+    # Trends: per day when the data spans at least two days, otherwise per hour
+    bin_seconds = 86400 if end - start >= 2 * 86400 else 3600
+    overall, per_class = _slopes(t // bin_seconds, t_classes, n_classes)
+    unit = 'day' if bin_seconds == 86400 else 'hour'
+    summary['trend'] = {
+        'unit': f'records per {unit}',
+        'overall_slope': round(overall, 4),
+        'class_slopes': {class_names[c]: round(float(per_class[c]), 4)
+                         for c in order if counts[c] and per_class[c] != 0.0}
+    }
+
+    if len(inc_t):
+        summary['co_occurrence'] = _co_occurrence(inc_t, inc_classes, t_streams[t_incident], class_names,
+                                                  int(cooccurrence_seconds))
+        summary['peak_windows'] = _peak_windows(inc_t, inc_classes, class_names, int(cooccurrence_seconds),
+                                                int(peak_window_seconds))
+    return summary
+
+
+def _co_occurrence(t: np.ndarray, classes: np.ndarray, streams: np.ndarray, class_names: List[str],
+                   bucket_seconds: float) -> List[Dict]:
+    """Class pairs seen on the same stream within the same time bucket."""
+    n_classes = len(class_names)
+    buckets = t // bucket_seconds
+    buckets -= buckets.min()
+    keys = streams * (int(buckets.max()) + 1) + buckets
+    n_keys = int(keys.max()) + 1
+    if n_keys * n_classes <= _MAX_DENSE_PRESENCE:
+        # Scatter into a dense (stream, bucket) x class table and keep the non-empty rows
+        flat = np.zeros(n_keys * n_classes, dtype=bool)
+        flat[keys * n_classes + classes] = True
+        table = flat.reshape(n_keys, n_classes)
+        presence = table[table.any(axis=1)].astype(np.float32)
+    else:
+        _, group = np.unique(keys, return_inverse=True)
+        presence = np.zeros((int(group.max()) + 1, n_classes), dtype=np.float32)
+        presence[group, classes] = 1.0
+    matrix = presence.T @ presence
+    upper = np.triu_indices(n_classes, k=1)
+    pair_counts = matrix[upper]
+    pairs = []
+    for k in np.argsort(-pair_counts)[:5]:
+        if pair_counts[k] <= 0:
+            break
+        a, b = upper[0][k], upper[1][k]
+        pairs.append({
+            'classes': [class_names[a], class_names[b]],
+            'windows': int(pair_counts[k]),
+            # Share of the windows containing the rarer class that also contain the other
+            'overlap': round(float(pair_counts[k] / min(matrix[a, a], matrix[b, b])), 4)
+        })
+    return pairs
+
+
+def _peak_windows(t: np.ndarray, classes: np.ndarray, class_names: List[str], bucket_seconds: int,
+                  window_seconds: int, top: int = 3) -> List[Dict]:
+    """Non-overlapping windows with the most incidents."""
+    first = int(t.min()) // bucket_seconds
+    span = int(t.max()) // bucket_seconds - first + 1
+    if span > _MAX_PEAK_BUCKETS:
+        bucket_seconds *= -(-span // _MAX_PEAK_BUCKETS)
+        first = int(t.min()) // bucket_seconds
+        span = int(t.max()) // bucket_seconds - first + 1
+    width = max(1, int(round(window_seconds / bucket_seconds)))
+
+    per_bucket = np.bincount(t // bucket_seconds - first, minlength=span)
+    cumulative = np.concatenate([[0], np.cumsum(per_bucket)])
+    starts = np.arange(max(1, span - width + 1))
+    totals = cumulative[np.minimum(starts + width, span)] - cumulative[starts]
+
+    if np.all(t[1:] >= t[:-1]):
+        # Store columns are already in arrival order
+        ordered_t, ordered_classes = t, classes
+    else:
+        order = np.argsort(t, kind='stable')
+        ordered_t, ordered_classes = t[order], classes[order]
+    taken = np.zeros(len(totals), dtype=bool)
+    peaks = []
+    for s in np.argsort(-totals, kind='stable'):
+        if len(peaks) >= top or totals[s] <= 0:
+            break
+        if taken[s]:
+            continue
+        taken[max(0, s - width + 1):s + width] = True
+        window_start = (first + s) * bucket_seconds
+        window_end = window_start + width * bucket_seconds
+        lo, hi = np.searchsorted(ordered_t, [window_start, window_end])
+        top_class = np.bincount(ordered_classes[lo:hi], minlength=len(class_names)).argmax()
+        peaks.append({
+            'start': _iso(window_start),
+            'end': _iso(window_end),
+            'incidents': int(totals[s]),
+            'top_class': class_names[top_class]
+        })
+    return peaks
+
+
+def fingerprint_records(records: Sequence[Dict]) -> str:
+    payload = json.dumps(records, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def fingerprint_columns(columns: Dict) -> str:
+    """Hash of the arrays the analysis reads, so other record fields never enter the key."""
+    digest = hashlib.blake2b(digest_size=16)
+    for names in ('class_names', 'stream_names'):
+        digest.update('\x00'.join(map(str, columns[names])).encode('utf-8'))
+        digest.update(b'\x01')
+    for field in ('class_idx', 'stream_idx', 'confidence', 'wall_clock'):
+        digest.update(np.ascontiguousarray(columns[field]).tobytes())
+    return digest.hexdigest()
+
+
+class PatternAnalytics:
+    """Cached local pattern summaries with optional LLM narration."""
+
+    def __init__(self, llm=None, cache_size: int = PATTERN_CACHE_SIZE):
+        self.llm = llm
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _cached(self, key: str, compute) -> Dict:
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return cached
+            self.cache_misses += 1
+        value = compute()
+        with self._lock:
+            self._cache[key] = value
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return value
+
+    def summarize_records(self, records: Sequence[Dict]) -> Dict:
+        """Summary of client-provided prediction records."""
+        columns = columns_from_records(records)
+        key = 'records:' + fingerprint_columns(columns)
+        return self._cached(key, lambda: analyze_columns(columns))
+
+    def summarize_store(self, store, predicted_class: Optional[str] = None, stream_id: Optional[str] = None,
+                        window_seconds: Optional[float] = None) -> Dict:
+        """Summary of the IncidentStore, optionally limited to the last window_seconds."""
+        since = time.time() - window_seconds if window_seconds else None
+        # Sliding windows are reused for a minute while the store is unchanged
+        key = f"store:{store.fingerprint()}:{predicted_class}:{stream_id}:{window_seconds}:{int(time.time() // 60)}"
+
+        def compute():
+            columns = store.columns(predicted_class=predicted_class, stream_id=stream_id, since=since)
+            columns['wall_clock'] = columns.pop('ts') + _local_offset()
+            return analyze_columns(columns)
+        return self._cached(key, compute)
+
+    async def narrate(self, summary: Dict) -> Dict:
+        """Ask the LLM to interpret a summary (never the raw records)."""
+        key = 'narration:' + fingerprint_records([summary])
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return cached
+
+        response = await self.llm.chat_completion(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": PATTERN_SYSTEM_PROMPT},
+                {"role": "user", "content": PATTERN_PROMPT.format(summary=json.dumps(summary, separators=(',', ':')))}
+            ],
+            temperature=0.3,
+            max_tokens=900
+        )
+        text = response.choices[0].message.content.strip()
+        text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text)
+        try:
+            narration = json.loads(text)
+        except ValueError:
+            return {'summary': text}
+        return self._cached(key, lambda: narration)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'cache_entries': len(self._cache),
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses
+            }
+
+
+# Global pattern analytics instance
+_analytics_instance = None
+
+
+def get_pattern_analytics():
+    """Get or create the global pattern analytics engine."""
+    global _analytics_instance
+    if _analytics_instance is None:
+        _analytics_instance = PatternAnalytics(get_llm_gateway())
+    return _analytics_instance
@@ -0,0 +1,216 @@
+"""
+Content-addressed prediction cache for duplicate and near-duplicate frames.
+
+Fixed cameras send long runs of (almost) identical frames. Entries are keyed by
+a hash of the encoded bytes, and optionally matched by a 64-bit perceptual
+difference hash (dHash) of the downscaled frame so re-encoded or slightly noisy
+copies also hit. Entries expire after a TTL and are evicted in LRU order when
+the entry count or memory budget is exceeded.
+
+A perceptual hit never refreshes the matched entry: the new frame's bytes are
+only indexed as an exact alias with the original expiry and no hash of their
+own, so in a slowly changing scene a result cannot be handed from frame to
+frame beyond the original match. Lookups return copies, since callers amend
+the result (status, explanation).
+"""
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+from backend.serving_config import (
+    PREDICTION_CACHE_MAX_ENTRIES,
+    PREDICTION_CACHE_MAX_HAMMING,
+    PREDICTION_CACHE_MAX_MB,
+    PREDICTION_CACHE_TTL_SECONDS,
+)
+
+# The 64-bit hash is split into 8 bands of 8 bits; by pigeonhole, two hashes
+# within Hamming distance 7 share at least one band, so band lookups find them
+_BANDS = 8
+_BAND_BITS = 64 // _BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+_MAX_SUPPORTED_HAMMING = _BANDS - 1
+
+
+def content_key(data) -> str:
+    """Hash of the encoded image bytes."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def perceptual_hash(image: np.ndarray) -> int:
+    """64-bit difference hash of a BGR or grayscale image."""
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class _Entry:
+    __slots__ = ("value", "phash", "size", "expires_at")
+
+    def __init__(self, value: Dict, phash: Optional[int], size: int, expires_at: float):
+        self.value = value
+        self.phash = phash
+        self.size = size
+        self.expires_at = expires_at
+
+
+class PredictionCache:
+    """Thread-safe LRU + TTL cache with exact and perceptual lookups."""
+
+    def __init__(self, max_entries: int = PREDICTION_CACHE_MAX_ENTRIES,
+                 max_bytes: int = int(PREDICTION_CACHE_MAX_MB * 1024 * 1024),
+                 ttl_seconds: float = PREDICTION_CACHE_TTL_SECONDS,
+                 max_hamming: int = PREDICTION_CACHE_MAX_HAMMING):
+        if max_hamming > _MAX_SUPPORTED_HAMMING:
+            raise ValueError(f"max_hamming must be at most {_MAX_SUPPORTED_HAMMING}")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self.max_hamming = max_hamming
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bands: Dict[tuple, set] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.exact_hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _band_keys(phash: int):
+        return [(band, (phash >> (band * _BAND_BITS)) & _BAND_MASK) for band in range(_BANDS)]
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        if entry.phash is not None:
+            for band_key in self._band_keys(entry.phash):
+                bucket = self._bands.get(band_key)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._bands[band_key]
+
+    def _live(self, key: str, now: float) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Exact lookup by content key."""
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            if entry is None:
+                return None
+            self.exact_hits += 1
+            return copy.deepcopy(entry.value)
+
+    def get_similar(self, phash: int, key: Optional[str] = None) -> Optional[Dict]:
+        """
+        Lookup of the closest entry within max_hamming of a perceptual hash.
+        On a hit, `key` (the new frame's content key) becomes an exact alias of
+        the matched entry: same expiry, no perceptual hash.
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = set()
+            for band_key in self._band_keys(phash):
+                candidates.update(self._bands.get(band_key, ()))
+
+            best_key, best_distance = None, self.max_hamming + 1
+            for candidate in candidates:
+                distance = bin(self._entries[candidate].phash ^ phash).count("1")
+                if distance < best_distance:
+                    best_key, best_distance = candidate, distance
+
+            entry = self._live(best_key, now) if best_key is not None else None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.perceptual_hits += 1
+            if key is not None and key not in self._entries:
+                self._entries[key] = _Entry(entry.value, None, entry.size, entry.expires_at)
+                self._bytes += entry.size
+                self._evict()
+            return copy.deepcopy(entry.value)
+
+    def record_miss(self):
+        """Count a miss when no perceptual lookup follows the exact lookup."""
+        with self._lock:
+            self.misses += 1
+
+    def update(self, key: str, value: Dict):
+        """Replace the value of a live entry, keeping its expiry and perceptual hash."""
+        size = len(json.dumps(value, default=str)) + 200
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            if entry is None:
+                return
+            self._bytes += size - entry.size
+            entry.value, entry.size = value, size
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def put(self, key: str, value: Dict, phash: Optional[int] = None):
+        size = len(json.dumps(value, default=str)) + 200
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = _Entry(value, phash, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            if phash is not None:
+                for band_key in self._band_keys(phash):
+                    self._bands.setdefault(band_key, set()).add(key)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bands.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            lookups = self.exact_hits + self.perceptual_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'memory_bytes': self._bytes,
+                'exact_hits': self.exact_hits,
+                'perceptual_hits': self.perceptual_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.exact_hits + self.perceptual_hits) / lookups if lookups else 0.0
+            }
+
+
+# Global prediction cache instance
+_cache_instance = None
+
+
+def get_prediction_cache():
+    """Get or create the global prediction cache."""
+    global _cache_instance
+    if _cache_instance is None:
+        _cache_instance = PredictionCache()
+    return _cache_instance
@@ -0,0 +1,267 @@
+"""
+Image decoding and batched preprocessing for inference.
+
+Decoding is resolution-aware: the model input (IMAGE_SIZE) is tiny compared to
+camera frames, so JPEGs are decoded directly at a reduced DCT scale (1/2, 1/4
+or 1/8) that still covers the model input. Images stay in OpenCV's BGR order;
+the channel conversion happens once per batch on the already-resized pixels.
+
+BatchPreprocessor resizes and normalizes a whole batch into a preallocated
+float32 tensor. Its output is checked against CrimeDetectionModel's PIL path
+with `python -m backend.preprocessing --parity <image dir>`.
+
+Functions are module-level so they can run in a thread or process pool.
+"""
+import argparse
+import base64
+import os
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from backend.config import IMAGE_SIZE, USE_TRANSFER_LEARNING, IMAGENET_MEAN, IMAGENET_STD
+from backend.serving_config import INFERENCE_MAX_BATCH_SIZE, PREPROCESS_NORMALIZATION
+
+# JPEG start-of-frame markers (baseline, progressive, lossless, ...) carry the image size
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+class DecodedImage(NamedTuple):
+    """Decoded BGR pixels (possibly reduced) and the original (height, width, channels)."""
+    pixels: np.ndarray
+    original_shape: Tuple[int, int, int]
+
+
+def jpeg_dimensions(data) -> Optional[Tuple[int, int]]:
+    """Read (height, width) from a JPEG header without decoding, or None if not a JPEG."""
+    view = memoryview(data)
+    size = len(view)
+    if size < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+
+    i = 2
+    while i + 9 < size:
+        if view[i] != 0xFF:
+            return None
+        marker = view[i + 1]
+        if marker == 0xFF:
+            # Fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without a length field
+            i += 2
+            continue
+        if marker in _SOF_MARKERS:
+            height = (view[i + 5] << 8) | view[i + 6]
+            width = (view[i + 7] << 8) | view[i + 8]
+            return height, width
+        i += 2 + ((view[i + 2] << 8) | view[i + 3])
+    return None
+
+
+def reduced_decode_flag(height: int, width: int, target_size: Tuple[int, int] = IMAGE_SIZE) -> int:
+    """Pick the smallest JPEG decode scale that still covers the target size."""
+    target_height, target_width = target_size
+    for factor, flag in _REDUCED_DECODE_FLAGS:
+        if height // factor >= target_height and width // factor >= target_width:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def decode_image(data, target_size: Optional[Tuple[int, int]] = IMAGE_SIZE) -> Optional[DecodedImage]:
+    """
+    Decode encoded image bytes (JPEG, PNG, ...) to BGR pixels, or None if invalid.
+    JPEGs are decoded at reduced resolution when target_size is given.
+    """
+    nparr = np.frombuffer(data, np.uint8)
+    dimensions = jpeg_dimensions(data) if target_size else None
+
+    if dimensions:
+        img = cv2.imdecode(nparr, reduced_decode_flag(*dimensions, target_size))
+    else:
+        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+
+    height, width = dimensions if dimensions else img.shape[:2]
+    return DecodedImage(img, (height, width, 3))
+
+
+def decode_base64(frame_data: str) -> bytes:
+    """Decode a base64 string or data URL to the encoded image bytes."""
+    return base64.b64decode(frame_data.split(',')[-1])
+
+
+def decode_base64_image(frame_data: str,
+                        target_size: Optional[Tuple[int, int]] = IMAGE_SIZE) -> Optional[DecodedImage]:
+    """Decode a base64 string or data URL, see decode_image."""
+    return decode_image(decode_base64(frame_data), target_size)
+
+
+class BatchPreprocessor:
+    """
+    Resizes and normalizes batches of BGR images into a reusable float32 tensor.
+    Not thread-safe: the returned tensor is overwritten by the next call.
+    """
+
+    def __init__(self, target_size: Tuple[int, int] = IMAGE_SIZE,
+                 max_batch_size: int = INFERENCE_MAX_BATCH_SIZE,
+                 grayscale: bool = not USE_TRANSFER_LEARNING,
+                 normalization: str = PREPROCESS_NORMALIZATION):
+        if normalization not in ("imagenet", "unit"):
+            raise ValueError(f"Unknown normalization: {normalization}")
+        self.height, self.width = target_size
+        self.grayscale = grayscale
+        self.channels = 1 if grayscale else 3
+
+        # (x / 255 - mean) / std folded into a single multiply and subtract
+        if normalization == "imagenet" and not grayscale:
+            std = np.asarray(IMAGENET_STD, dtype=np.float32)
+            mean = np.asarray(IMAGENET_MEAN, dtype=np.float32)
+            self._scale = (1.0 / (255.0 * std)).astype(np.float32)
+            self._offset = (mean / std).astype(np.float32)
+        else:
+            self._scale = np.float32(1.0 / 255.0)
+            self._offset = None
+
+        self._allocate(max_batch_size)
+
+    def _allocate(self, capacity: int):
+        shape = (capacity, self.height, self.width, self.channels)
+        self._staging = np.empty(shape, dtype=np.uint8)
+        self._output = np.empty(shape, dtype=np.float32)
+
+    @property
+    def capacity(self) -> int:
+        return self._output.shape[0]
+
+    def _to_bgr(self, image: np.ndarray) -> np.ndarray:
+        if image.ndim == 2 or image.shape[2] == 1:
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        if image.shape[2] == 4:
+            return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+        if image.shape[2] != 3:
+            raise ValueError(f"Unexpected image shape: {image.shape}")
+        return image
+
+    def _resize(self, image: np.ndarray) -> np.ndarray:
+        if image.shape[0] == self.height and image.shape[1] == self.width:
+            return image
+        shrinking = image.shape[0] >= self.height and image.shape[1] >= self.width
+        # INTER_AREA antialiases like PIL's LANCZOS when downscaling
+        interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LANCZOS4
+        return cv2.resize(image, (self.width, self.height), interpolation=interpolation)
+
+    def pixels(self, image: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Resize one BGR image to the model's (H, W, C) uint8 pixels (RGB or grayscale), before normalization."""
+        if out is None:
+            out = np.empty((self.height, self.width, self.channels), dtype=np.uint8)
+        if image.dtype != np.uint8:
+            image = np.clip(image, 0, 255).astype(np.uint8)
+        small = self._resize(self._to_bgr(image))
+        if self.grayscale:
+            out[:, :, 0] = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        else:
+            out[:] = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+        return out
+
+    def normalize(self, pixels: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Model input from a (N, H, W, C) uint8 batch of pixels() output."""
+        if out is None:
+            out = np.empty(pixels.shape, dtype=np.float32)
+        np.multiply(pixels, self._scale, out=out, casting='unsafe')
+        if self._offset is not None:
+            out -= self._offset
+        return out
+
+    def preprocess(self, images: Sequence[np.ndarray]) -> np.ndarray:
+        """Return a (N, H, W, C) float32 view over the preallocated buffer."""
+        count = len(images)
+        if count > self.capacity:
+            self._allocate(count)
+        staging = self._staging[:count]
+
+        for i, image in enumerate(images):
+            self.pixels(image, out=staging[i])
+        return self.normalize(staging, out=self._output[:count])
+
+
+def check_parity(model, paths: Sequence[str], batch_size: int = 32) -> dict:
+    """
+    Compare BatchPreprocessor (reduced decode + OpenCV) with the model's PIL path
+    on real images: tensor differences and top-1 agreement of the network.
+    """
+    preprocessor = BatchPreprocessor(max_batch_size=batch_size)
+    max_abs, abs_sum, values, agree, total = 0.0, 0.0, 0, 0, 0
+
+    for start in range(0, len(paths), batch_size):
+        fast_images, reference = [], []
+        for path in paths[start:start + batch_size]:
+            with open(path, 'rb') as f:
+                data = f.read()
+            decoded = decode_image(data)
+            full = decode_image(data, target_size=None)
+            if decoded is None or full is None:
+                continue
+            fast_images.append(decoded.pixels)
+            array = model.preprocess_image_array(cv2.cvtColor(full.pixels, cv2.COLOR_BGR2RGB))
+            reference.append(array if array.ndim == 4 else array[np.newaxis, ...])
+        if not fast_images:
+            continue
+
+        fast = preprocessor.preprocess(fast_images).copy()
+        slow = np.concatenate(reference, axis=0).astype(np.float32)
+        diff = np.abs(fast - slow.reshape(fast.shape))
+        max_abs = max(max_abs, float(diff.max()))
+        abs_sum += float(diff.sum())
+        values += diff.size
+
+        fast_top = np.argmax(model.model.predict(fast, verbose=0), axis=1)
+        slow_top = np.argmax(model.model.predict(slow, verbose=0), axis=1)
+        agree += int(np.sum(fast_top == slow_top))
+        total += len(fast_top)
+
+    return {
+        'images': total,
+        'max_abs_diff': max_abs,
+        'mean_abs_diff': abs_sum / values if values else 0.0,
+        'top1_agreement': agree / total if total else 0.0
+    }
+
+
+def _list_images(directory: str, limit: int) -> List[str]:
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')):
+                paths.append(os.path.join(root, name))
+                if len(paths) >= limit:
+                    return paths
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check batched preprocessing against the PIL path")
+    parser.add_argument("--parity", required=True, help="Directory of sample images (e.g. datasets/Test)")
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    args = parser.parse_args()
+
+    from backend.model_utils import get_model
+
+    report = check_parity(get_model(), _list_images(args.parity, args.samples))
+    print(f"Images compared:  {report['images']}")
+    print(f"Max abs diff:     {report['max_abs_diff']:.4f}")
+    print(f"Mean abs diff:    {report['mean_abs_diff']:.4f}")
+    print(f"Top-1 agreement:  {report['top1_agreement']:.2%}")
+    if report['top1_agreement'] < args.min_agreement:
+        print("⚠ Batched preprocessing changes predictions; check PREPROCESS_NORMALIZATION")
+        raise SystemExit(1)
+    print("✓ Batched preprocessing matches the PIL path")
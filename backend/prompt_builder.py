@@ -0,0 +1,175 @@
+"""
+Token-budgeted prompt assembly for LLM calls.
+
+Tokens are counted locally: with tiktoken when it is installed, otherwise with a
+~4 characters per token estimate. Static sections (system prompts, instruction
+blocks) are registered once and their token counts are cached.
+
+PromptBuilder.build() always keeps the system sections and the question, then
+fills the token budget with context items and conversation history in order of
+relevance (the latest exchange ranks near the top, older history near the
+bottom). Included context items are rendered in their original order, and
+every call reports its prompt token count.
+"""
+import threading
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from backend.serving_config import PROMPT_HISTORY_MESSAGES, PROMPT_MAX_TOKENS
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken not installed or its encoding files are unavailable
+    _ENCODING = None
+
+# Per-message framing overhead of the chat format
+_MESSAGE_TOKENS = 4
+
+
+@lru_cache(maxsize=4096)
+def _cached_count(text: str) -> int:
+    return _count(text)
+
+
+def _count(text: str) -> int:
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return len(text) // 4 + 1
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in a text (estimated when tiktoken is unavailable)."""
+    # Short texts repeat (questions, history, context lines); long ones rarely do
+    return _cached_count(text) if len(text) <= 2048 else _count(text)
+
+
+def count_message_tokens(messages: Sequence[Dict]) -> int:
+    return sum(_MESSAGE_TOKENS + count_tokens(m.get("content", "")) for m in messages) + 2
+
+
+class ContextItem(NamedTuple):
+    """One piece of retrieved context; higher relevance is kept first."""
+    text: str
+    relevance: float
+    # Optional heading line emitted once before the first included item of its group
+    group: Optional[str] = None
+
+
+class BuiltPrompt(NamedTuple):
+    messages: List[Dict]
+    prompt_tokens: int
+    context_items: int
+    dropped_items: int
+    history_messages: int
+
+
+class PromptBuilder:
+    """Assembles chat messages within a token budget."""
+
+    RECENT_HISTORY_RELEVANCE = 95.0
+    OLDER_HISTORY_RELEVANCE = 30.0
+
+    def __init__(self, max_tokens: int = PROMPT_MAX_TOKENS, history_messages: int = PROMPT_HISTORY_MESSAGES):
+        self.max_tokens = max_tokens
+        self.history_messages = history_messages
+        self._sections: Dict[str, str] = {}
+        self._section_tokens: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.total_prompt_tokens = 0
+        self.dropped_items = 0
+
+    def register(self, name: str, text: str) -> str:
+        """Register a static section once; its token count is computed a single time."""
+        self._sections[name] = text
+        self._section_tokens[name] = count_tokens(text)
+        return text
+
+    def section(self, name: str) -> str:
+        return self._sections[name]
+
+    def build(self, system_sections: Sequence[str], question: str, context_items: Sequence[ContextItem] = (),
+              history: Sequence[Dict] = (), context_header: str = "", context_footer: str = "",
+              max_tokens: Optional[int] = None) -> BuiltPrompt:
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        system_text = "\n\n".join(self._sections[name] for name in system_sections)
+        used = (sum(self._section_tokens[name] for name in system_sections)
+                + count_tokens(question) + count_tokens(context_header) + count_tokens(context_footer)
+                + 3 * _MESSAGE_TOKENS + 2)
+
+        # History competes with context items: the latest exchange ranks just below
+        # the most important context, older messages below the retrieved records.
+        # History is only ever kept as a contiguous, newest-first suffix.
+        recent = list(history)[-self.history_messages:] if self.history_messages else []
+        candidates = [(item.relevance, 'context', i) for i, item in enumerate(context_items)]
+        for age, message in enumerate(reversed(recent)):
+            relevance = self.RECENT_HISTORY_RELEVANCE if age < 2 else self.OLDER_HISTORY_RELEVANCE - age
+            candidates.append((relevance, 'history', age))
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+        included = set()
+        charged_groups = set()
+        kept_history = 0
+        history_closed = False
+        for _, kind, i in candidates:
+            if kind == 'history':
+                if history_closed or i != kept_history:
+                    continue
+                cost = _MESSAGE_TOKENS + count_tokens(recent[-1 - i].get("content", ""))
+                if used + cost > budget:
+                    history_closed = True
+                    continue
+                used += cost
+                kept_history += 1
+                continue
+
+            item = context_items[i]
+            cost = count_tokens(item.text) + 1
+            if item.group and item.group not in charged_groups:
+                cost += count_tokens(item.group) + 1
+            if used + cost > budget:
+                continue
+            used += cost
+            included.add(i)
+            if item.group:
+                charged_groups.add(item.group)
+        kept_messages = recent[len(recent) - kept_history:] if kept_history else []
+
+        lines = [context_header] if context_header else []
+        current_group = None
+        for i, item in enumerate(context_items):
+            if i not in included:
+                continue
+            if item.group and item.group != current_group:
+                lines.append(item.group)
+            current_group = item.group
+            lines.append(item.text)
+        if context_footer:
+            lines.append(context_footer)
+        context_text = "\n".join(lines)
+
+        user_content = f"{context_text}\n\nUSER QUESTION: {question}" if context_text else question
+        messages = [{"role": "system", "content": system_text}, *kept_messages,
+                    {"role": "user", "content": user_content}]
+        prompt_tokens = count_message_tokens(messages)
+
+        dropped = len(context_items) - len(included)
+        with self._lock:
+            self.calls += 1
+            self.total_prompt_tokens += prompt_tokens
+            self.dropped_items += dropped
+        return BuiltPrompt(messages, prompt_tokens, len(included), dropped, kept_history)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'tokenizer': 'tiktoken' if _ENCODING is not None else 'estimate',
+                'max_tokens': self.max_tokens,
+                'calls': self.calls,
+                'avg_prompt_tokens': self.total_prompt_tokens / self.calls if self.calls else 0.0,
+                'dropped_context_items': self.dropped_items
+            }
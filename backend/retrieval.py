@@ -0,0 +1,285 @@
+"""
+Indexed context retrieval for the chatbot.
+
+QueryParser turns a question into a ParsedQuery with precompiled patterns:
+crime classes and their synonyms ("theft" -> Stealing, "car crash" ->
+RoadAccidents) and time phrases ("last hour", "past 30 minutes", "today",
+"yesterday").
+
+ContextRetriever answers from the IncidentStore's indexes: per-class id lists,
+binary search over arrival time and incrementally maintained per-minute class
+counts, so a lookup touches only the records it returns. Prediction lists sent
+by the client are still supported and are filtered in a single pass.
+"""
+import heapq
+import re
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Class name -> synonyms (regular expressions, matched on word boundaries)
+CLASS_SYNONYMS = {
+    'Abuse': [r'abuse[sd]?', r'abusing', r'abusive'],
+    'Arrest': [r'arrest(?:s|ed|ing)?'],
+    'Arson': [r'arson', r'arsonists?', r'fires?', r'set on fire'],
+    'Assault': [r'assault(?:s|ed|ing)?', r'attack(?:s|ed)?'],
+    'Burglary': [r'burglar(?:y|ies|s)?', r'break[- ]?ins?', r'breaking in'],
+    'Explosion': [r'explosions?', r'explod(?:e|ed|ing)', r'blasts?', r'bomb(?:s|ing)?'],
+    'Fighting': [r'fight(?:s|ing)?', r'fought', r'brawls?'],
+    'NormalVideos': [r'normal ?videos?', r'normal activity'],
+    'RoadAccidents': [r'road ?accidents?', r'(?:car|traffic|vehicle) (?:accidents?|crash(?:es)?)',
+                      r'accidents?', r'crash(?:es)?', r'collisions?'],
+    'Robbery': [r'robber(?:y|ies|s)?', r'robb(?:ed|ing)', r'rob', r'muggings?'],
+    'Shooting': [r'shootings?', r'shoot(?:er|ers|s)?', r'guns?', r'gunfire', r'gunshots?'],
+    'Shoplifting': [r'shoplift(?:ing|ers?|ed)?'],
+    'Stealing': [r'steal(?:s|ing)?', r'stole(?:n)?', r'thefts?', r'thie(?:f|ves)'],
+    'Vandalism': [r'vandal(?:s|ism|ized|ised)?', r'graffiti'],
+}
+
+_UNIT_SECONDS = {'second': 1, 'minute': 60, 'min': 60, 'hour': 3600, 'hr': 3600,
+                 'day': 86400, 'week': 604800}
+_NUMBER_WORDS = {'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+                 'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'twelve': 12,
+                 'fifteen': 15, 'twenty': 20, 'thirty': 30, 'few': 3, 'couple of': 2}
+
+
+class ParsedQuery(NamedTuple):
+    """What a question asks about: classes, an optional time window and 'recent' intent."""
+    classes: Tuple[str, ...]
+    since: Optional[float]
+    until: Optional[float]
+    time_label: str
+    wants_recent: bool
+
+    @property
+    def has_window(self) -> bool:
+        return self.since is not None or self.until is not None
+
+
+class QueryParser:
+    """Extracts classes and time windows from free-text questions."""
+
+    def __init__(self, synonyms: Dict[str, List[str]] = CLASS_SYNONYMS):
+        # One alternation with a named group per class; longer phrases first
+        groups = []
+        for class_name, patterns in synonyms.items():
+            alternatives = '|'.join(sorted(patterns, key=len, reverse=True))
+            groups.append(f'(?P<{class_name}>{alternatives})')
+        self._class_pattern = re.compile(r'\b(?:' + '|'.join(groups) + r')\b', re.IGNORECASE)
+
+        numbers = '|'.join(sorted(map(re.escape, _NUMBER_WORDS), key=len, reverse=True))
+        units = '|'.join(sorted(_UNIT_SECONDS, key=len, reverse=True))
+        self._window_pattern = re.compile(
+            rf'\b(?:last|past|previous|within the last|in the last)\s+(?:(\d+(?:\.\d+)?|{numbers})\s+)?'
+            rf'({units})s?\b',
+            re.IGNORECASE
+        )
+        self._this_pattern = re.compile(r'\bthis (hour|morning|week)\b', re.IGNORECASE)
+        self._day_pattern = re.compile(r'\b(today|tonight|yesterday)\b', re.IGNORECASE)
+        self._recent_pattern = re.compile(r'\b(?:recent|recently|latest|last|new|newest)\b', re.IGNORECASE)
+
+    def parse(self, query: str, now: Optional[float] = None) -> ParsedQuery:
+        now = time.time() if now is None else now
+        classes = []
+        for match in self._class_pattern.finditer(query):
+            if match.lastgroup not in classes:
+                classes.append(match.lastgroup)
+
+        since, until, label = self._parse_window(query, now)
+        return ParsedQuery(tuple(classes), since, until, label, bool(self._recent_pattern.search(query)))
+
+    def _parse_window(self, query: str, now: float) -> Tuple[Optional[float], Optional[float], str]:
+        match = self._window_pattern.search(query)
+        if match:
+            amount, unit = match.group(1), match.group(2).lower()
+            if amount is None:
+                count = 1.0
+            elif amount.lower() in _NUMBER_WORDS:
+                count = float(_NUMBER_WORDS[amount.lower()])
+            else:
+                count = float(amount)
+            return now - count * _UNIT_SECONDS[unit], None, match.group(0).lower()
+
+        midnight = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+        match = self._day_pattern.search(query)
+        if match:
+            word = match.group(1).lower()
+            if word == 'yesterday':
+                start = midnight - timedelta(days=1)
+                return start.timestamp(), midnight.timestamp(), word
+            return midnight.timestamp(), None, 'today'
+
+        match = self._this_pattern.search(query)
+        if match:
+            unit = match.group(1).lower()
+            if unit == 'hour':
+                start = datetime.fromtimestamp(now).replace(minute=0, second=0, microsecond=0)
+            elif unit == 'morning':
+                start = midnight
+            else:
+                start = midnight - timedelta(days=midnight.weekday())
+            return start.timestamp(), None, match.group(0).lower()
+        return None, None, ''
+
+
+def _record_time(record: Dict) -> Optional[float]:
+    ts = record.get('ts')
+    if ts is not None:
+        return float(ts)
+    timestamp = record.get('timestamp')
+    if not timestamp:
+        return None
+    try:
+        return datetime.fromisoformat(str(timestamp).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+class ContextRetriever:
+    """Finds the predictions, alerts and statistics relevant to a chat question."""
+
+    def __init__(self, store=None, parser: Optional[QueryParser] = None, max_results: int = 20):
+        self.store = store
+        self.parser = parser or QueryParser()
+        self.max_results = max_results
+
+    def retrieve(self, query: str, predictions: Optional[List[Dict]] = None, alerts: Optional[List[Dict]] = None,
+                 historical_data: Optional[List[Dict]] = None, stats: Optional[Dict] = None) -> Dict:
+        parsed = self.parser.parse(query)
+        use_store = self.store is not None and len(self.store) > 0
+        context = {
+            'relevant_predictions': [],
+            'relevant_alerts': [],
+            'system_stats': stats or {},
+            'summary': '',
+            'query': {
+                'classes': list(parsed.classes),
+                'time_range': parsed.time_label or None
+            }
+        }
+
+        if parsed.classes or parsed.wants_recent or parsed.has_window:
+            if predictions:
+                records = self._filter(predictions, parsed)
+            elif use_store:
+                records = self._from_store(parsed)
+            else:
+                records = []
+            include_explanation = bool(parsed.classes)
+            context['relevant_predictions'] = [
+                self._as_context(record, include_explanation) for record in records
+            ]
+
+        if parsed.classes:
+            if alerts:
+                context['relevant_alerts'] = [
+                    self._alert_context(alert) for alert in alerts
+                    if self._alert_matches(alert, parsed)
+                ][:self.max_results]
+            elif use_store:
+                context['relevant_alerts'] = self._alerts_from_store(parsed)
+
+        if historical_data:
+            counts: Dict[str, int] = {}
+            for entry in historical_data:
+                class_name = entry.get('predicted_class', 'Unknown')
+                counts[class_name] = counts.get(class_name, 0) + 1
+            context['summary'] = self._summarize(counts, None, parsed)
+        elif use_store:
+            window = self.store.counts_between(parsed.since, parsed.until) if parsed.has_window else None
+            context['summary'] = self._summarize(self.store.class_counts(), window, parsed)
+        return context
+
+    # Client-provided lists: one pass, no cap on how far back matches are found
+
+    def _filter(self, predictions: Iterable[Dict], parsed: ParsedQuery) -> List[Dict]:
+        classes = set(parsed.classes)
+        matches = []
+        for record in predictions:
+            if classes and record.get('predicted_class') not in classes:
+                continue
+            if parsed.has_window and not self._in_window(record, parsed):
+                continue
+            matches.append(record)
+            if len(matches) >= self.max_results:
+                break
+        return matches
+
+    def _alert_matches(self, alert: Dict, parsed: ParsedQuery) -> bool:
+        if alert.get('type') not in parsed.classes:
+            return False
+        return not parsed.has_window or self._in_window(alert, parsed)
+
+    @staticmethod
+    def _in_window(record: Dict, parsed: ParsedQuery) -> bool:
+        ts = _record_time(record)
+        if ts is None:
+            return False
+        if parsed.since is not None and ts < parsed.since:
+            return False
+        return parsed.until is None or ts <= parsed.until
+
+    # Server-side store: index lookups only
+
+    def _from_store(self, parsed: ParsedQuery) -> List[Dict]:
+        if not parsed.classes:
+            return self.store.query(since=parsed.since, until=parsed.until, limit=self.max_results)
+        per_class = [
+            self.store.query(predicted_class=class_name, since=parsed.since, until=parsed.until,
+                             limit=self.max_results)
+            for class_name in parsed.classes
+        ]
+        # Each list is newest first; merge them by id
+        merged = heapq.merge(*per_class, key=lambda record: record['id'], reverse=True)
+        return list(islice(merged, self.max_results))
+
+    def _alerts_from_store(self, parsed: ParsedQuery) -> List[Dict]:
+        alerts = []
+        for class_name in parsed.classes:
+            alerts.extend(self.store.alerts(self.max_results, predicted_class=class_name,
+                                            since=parsed.since, until=parsed.until))
+        alerts.sort(key=lambda alert: alert.get('timestamp') or '', reverse=True)
+        return alerts[:self.max_results]
+
+    # Formatting
+
+    @staticmethod
+    def _as_context(record: Dict, include_explanation: bool) -> Dict:
+        item = {
+            'class': record.get('predicted_class'),
+            'confidence': record.get('confidence', 0),
+            'timestamp': record.get('timestamp', '')
+        }
+        if include_explanation:
+            item['explanation'] = record.get('explanation')
+        return item
+
+    @staticmethod
+    def _alert_context(alert: Dict) -> Dict:
+        return {
+            'type': alert.get('type'),
+            'message': alert.get('message'),
+            'severity': alert.get('severity'),
+            'timestamp': alert.get('timestamp'),
+            'confidence': alert.get('confidence')
+        }
+
+    @staticmethod
+    def _summarize(counts: Dict[str, int], window_counts: Optional[Dict[str, int]], parsed: ParsedQuery) -> str:
+        total = sum(counts.values())
+        if not total:
+            return ''
+        summary = f"Total incidents: {total}. "
+        most_common = max(counts.items(), key=lambda x: x[1])
+        summary += f"Most common: {most_common[0]} ({most_common[1]} occurrences). "
+        summary += f"Crime types detected: {', '.join(list(counts.keys())[:5])}"
+        for class_name in parsed.classes:
+            summary += f". {class_name}: {counts.get(class_name, 0)} total"
+        if window_counts is not None:
+            window_total = sum(window_counts.values())
+            summary += f". {parsed.time_label.capitalize()}: {window_total} incidents"
+            details = parsed.classes or sorted(window_counts, key=window_counts.get, reverse=True)[:5]
+            if details:
+                summary += " (" + ', '.join(f"{c}: {window_counts.get(c, 0)}" for c in details) + ")"
+        return summary
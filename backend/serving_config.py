@@ -0,0 +1,188 @@
+"""
+Serving configuration for the inference API.
+Every value can be overridden with an environment variable of the same name.
+"""
+import os
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
+# Micro-batching inference scheduler
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "16"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "2"))
+
+# Number of ranked classes returned in 'predictions'
+PREDICTION_TOP_K = int(os.getenv("PREDICTION_TOP_K", "3"))
+
+# Execution layer: pool for CPU-bound decoding ("thread" or "process")
+EXECUTOR_KIND = os.getenv("EXECUTOR_KIND", "thread")
+EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", str(os.cpu_count() or 4)))
+# Threads for blocking network calls (OpenAI)
+EXECUTOR_IO_WORKERS = int(os.getenv("EXECUTOR_IO_WORKERS", "32"))
+
+# Admission control: requests in flight before new ones are rejected
+MAX_PENDING_REQUESTS = int(os.getenv("MAX_PENDING_REQUESTS", "256"))
+OVERLOAD_STATUS_CODE = int(os.getenv("OVERLOAD_STATUS_CODE", "503"))
+OVERLOAD_RETRY_AFTER_SECONDS = int(os.getenv("OVERLOAD_RETRY_AFTER_SECONDS", "1"))
+
+# Batched preprocessing: "imagenet" (mean/std) or "unit" (pixels / 255);
+# must match the normalization the model was trained with
+PREPROCESS_NORMALIZATION = os.getenv("PREPROCESS_NORMALIZATION", "imagenet")
+
+# Prediction cache for duplicate / near-duplicate frames
+PREDICTION_CACHE_ENABLED = _env_bool("PREDICTION_CACHE_ENABLED", True)
+# Near-duplicate matching is opt-in: a matched frame may differ enough to change the prediction
+PREDICTION_CACHE_PERCEPTUAL = _env_bool("PREDICTION_CACHE_PERCEPTUAL", False)
+PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "10000"))
+PREDICTION_CACHE_MAX_MB = float(os.getenv("PREDICTION_CACHE_MAX_MB", "64"))
+PREDICTION_CACHE_TTL_SECONDS = float(os.getenv("PREDICTION_CACHE_TTL_SECONDS", "30"))
+# Max differing bits (of 64) for two frames to count as near-duplicates (at most 7)
+PREDICTION_CACHE_MAX_HAMMING = int(os.getenv("PREDICTION_CACHE_MAX_HAMMING", "4"))
+
+# Explanations: "inline" waits for the LLM, "async" returns a job id
+EXPLANATION_MODE = os.getenv("EXPLANATION_MODE", "inline")
+EXPLANATION_CACHE_SIZE = int(os.getenv("EXPLANATION_CACHE_SIZE", "512"))
+# Width of the confidence buckets that share a cached explanation
+EXPLANATION_CONFIDENCE_BUCKET = float(os.getenv("EXPLANATION_CONFIDENCE_BUCKET", "0.05"))
+EXPLANATION_MAX_JOBS = int(os.getenv("EXPLANATION_MAX_JOBS", "10000"))
+
+# Shared LLM gateway; set LLM_BASE_URL to use an OpenAI-compatible server
+# such as the bundled stub (python -m backend.llm_stub)
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+
+# Incident store: prediction records kept in memory (ring buffer) and,
+# optionally, persisted to SQLite (*.db / *.sqlite) or a JSON-lines file
+INCIDENT_STORE_CAPACITY = int(os.getenv("INCIDENT_STORE_CAPACITY", "100000"))
+INCIDENT_STORE_PATH = os.getenv("INCIDENT_STORE_PATH", "")
+
+# Chatbot conversation history, kept per session id
+CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "10"))
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", "10000"))
+CONVERSATION_IDLE_TTL_SECONDS = float(os.getenv("CONVERSATION_IDLE_TTL_SECONDS", "3600"))
+CONVERSATION_MAX_MB = float(os.getenv("CONVERSATION_MAX_MB", "32"))
+
+# Chat prompt assembly: token budget for system prompt, history, context and question
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "1500"))
+PROMPT_HISTORY_MESSAGES = int(os.getenv("PROMPT_HISTORY_MESSAGES", "5"))
+
+# Streaming anomaly engine: per-stream sliding windows of time buckets
+ANOMALY_BUCKET_SECONDS = float(os.getenv("ANOMALY_BUCKET_SECONDS", "10"))
+ANOMALY_WINDOW_SECONDS = float(os.getenv("ANOMALY_WINDOW_SECONDS", "60"))
+# A class "spikes" when its window count exceeds this multiple of its baseline
+ANOMALY_SPIKE_FACTOR = float(os.getenv("ANOMALY_SPIKE_FACTOR", "3.0"))
+ANOMALY_MIN_COUNT = int(os.getenv("ANOMALY_MIN_COUNT", "5"))
+# Smoothing of the per-class confidence and baseline-rate EWMAs
+ANOMALY_EWMA_ALPHA = float(os.getenv("ANOMALY_EWMA_ALPHA", "0.2"))
+ANOMALY_CONFIDENCE_THRESHOLD = float(os.getenv("ANOMALY_CONFIDENCE_THRESHOLD", "0.7"))
+ANOMALY_HIGH_RISK_CLASSES = [c.strip() for c in os.getenv(
+    "ANOMALY_HIGH_RISK_CLASSES", "Shooting,Explosion,Assault,Fighting").split(",") if c.strip()]
+ANOMALY_MAX_STREAMS = int(os.getenv("ANOMALY_MAX_STREAMS", "10000"))
+ANOMALY_MAX_CLASSES = int(os.getenv("ANOMALY_MAX_CLASSES", "32"))
+
+# Pattern analytics: results cached by data fingerprint
+PATTERN_CACHE_SIZE = int(os.getenv("PATTERN_CACHE_SIZE", "64"))
+# Bucket width for co-occurrence (same stream) and the length of peak windows
+PATTERN_COOCCURRENCE_SECONDS = float(os.getenv("PATTERN_COOCCURRENCE_SECONDS", "300"))
+PATTERN_PEAK_WINDOW_SECONDS = float(os.getenv("PATTERN_PEAK_WINDOW_SECONDS", "3600"))
+
+# Bulk uploads (/api/predict/batch): images per forward pass and how long a
+# partial chunk waits for more decoded images before it is run anyway
+BATCH_PREDICT_CHUNK_SIZE = int(os.getenv("BATCH_PREDICT_CHUNK_SIZE", "32"))
+BATCH_PREDICT_MAX_WAIT_MS = float(os.getenv("BATCH_PREDICT_MAX_WAIT_MS", "20"))
+# Upload bytes and decoded pixels held in memory, shared by all batch requests;
+# the request body is only read further while there is room
+BATCH_MAX_INFLIGHT_MB = float(os.getenv("BATCH_MAX_INFLIGHT_MB", "256"))
+BATCH_MAX_FILE_MB = float(os.getenv("BATCH_MAX_FILE_MB", "32"))
+
+# Inference backend: "keras", "onnx", "onnx-int8", "tflite" or "tflite-int8"
+# (exported with python -m backend.export_model); falls back to keras when unavailable
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "keras")
+# Exported model file; empty means the export tool's default next to MODEL_PATH
+INFERENCE_MODEL_PATH = os.getenv("INFERENCE_MODEL_PATH", "")
+# Intra-op threads of the inference runtime (0 = runtime default)
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0"))
+
+# Startup: batch sizes run once through the inference path before /ready reports ready
+STARTUP_WARMUP = _env_bool("STARTUP_WARMUP", True)
+STARTUP_WARMUP_BATCH_SIZES = [int(size) for size in os.getenv(
+    "STARTUP_WARMUP_BATCH_SIZES", f"1,{INFERENCE_MAX_BATCH_SIZE},{BATCH_PREDICT_CHUNK_SIZE}").split(",") if size.strip()]
+
+# Dedicated model server (python -m backend.model_server) that owns the only copy
+# of the model per host; HTTP workers use it with INFERENCE_BACKEND=remote
+MODEL_SERVER_HOST = os.getenv("MODEL_SERVER_HOST", "127.0.0.1")
+MODEL_SERVER_PORT = int(os.getenv("MODEL_SERVER_PORT", "8765"))
+# Shared secret of the server and its workers (required; the channel unpickles
+# what it receives). `python -m backend.main` generates one for the processes it starts
+MODEL_SERVER_AUTHKEY = os.getenv("MODEL_SERVER_AUTHKEY", "")
+# Shared-memory tensor slots per HTTP worker (requests in flight per worker)
+MODEL_SERVER_SLOTS = int(os.getenv("MODEL_SERVER_SLOTS", "4"))
+# Requests from different workers are merged into forward passes of up to this many images
+MODEL_SERVER_MAX_BATCH = int(os.getenv("MODEL_SERVER_MAX_BATCH", "64"))
+MODEL_SERVER_CONNECT_TIMEOUT_SECONDS = float(os.getenv("MODEL_SERVER_CONNECT_TIMEOUT_SECONDS", "120"))
+MODEL_SERVER_REQUEST_TIMEOUT_SECONDS = float(os.getenv("MODEL_SERVER_REQUEST_TIMEOUT_SECONDS", "30"))
+# uvicorn worker processes for `python -m backend.main`; above 1 a model server
+# is started alongside them and the workers switch to INFERENCE_BACKEND=remote
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+
+# Alternative model loader as "module:function" returning a CrimeDetectionModel-like
+# object (e.g. benchmarks.standin_model:get_model); empty uses backend.model_utils.get_model
+MODEL_FACTORY = os.getenv("MODEL_FACTORY", "")
+
+# Metrics: per-stage latency histograms and gauges exposed at /metrics (Prometheus text format)
+METRICS_ENABLED = _env_bool("METRICS_ENABLED", True)
+# Sampling profiler: requests slower than this are profiled (0 = off); stacks of all
+# threads are sampled every METRICS_PROFILE_INTERVAL_MS while requests are in flight
+METRICS_PROFILE_SLOW_MS = float(os.getenv("METRICS_PROFILE_SLOW_MS", "0"))
+METRICS_PROFILE_INTERVAL_MS = float(os.getenv("METRICS_PROFILE_INTERVAL_MS", "10"))
+# Slow-request profiles kept for /api/debug/slow-requests
+METRICS_PROFILE_KEEP = int(os.getenv("METRICS_PROFILE_KEEP", "20"))
+
+# Feature store (python -m backend.feature_store): decoded, resized training images
+# in memory-mapped .npy shards per class; empty means CACHE_DIR/feature_store
+FEATURE_STORE_DIR = os.getenv("FEATURE_STORE_DIR", "")
+# Extraction processes (0 = one per CPU) and images per task
+FEATURE_STORE_WORKERS = int(os.getenv("FEATURE_STORE_WORKERS", "0"))
+FEATURE_STORE_CHUNK_SIZE = int(os.getenv("FEATURE_STORE_CHUNK_SIZE", "256"))
+
+# Dataset manifest (python -m backend.dataset_manifest): one row per image with class,
+# dimensions and file stats; .csv or .parquet (needs pyarrow), empty means CACHE_DIR/dataset_manifest.csv
+DATASET_MANIFEST_PATH = os.getenv("DATASET_MANIFEST_PATH", "")
+
+# Streaming training pipeline (backend.training_pipeline): decode threads and
+# batches prepared ahead of the training step (bounds memory to that many batches)
+TRAINING_DECODE_WORKERS = int(os.getenv("TRAINING_DECODE_WORKERS", "0"))
+TRAINING_PREFETCH_BATCHES = int(os.getenv("TRAINING_PREFETCH_BATCHES", "4"))
+
+# Video ingestion (/api/predict/video): frames sampled per second of video, length of
+# the time chunks decoded independently, and chunks decoded at once (0 = one per CPU)
+VIDEO_SAMPLE_FPS = float(os.getenv("VIDEO_SAMPLE_FPS", "2"))
+VIDEO_CHUNK_SECONDS = float(os.getenv("VIDEO_CHUNK_SECONDS", "30"))
+VIDEO_DECODE_PARALLEL = int(os.getenv("VIDEO_DECODE_PARALLEL", "0"))
+# Decoder threads per capture (0 = decoder default); parallel chunks already use the cores
+VIDEO_DECODE_THREADS = int(os.getenv("VIDEO_DECODE_THREADS", "1"))
+VIDEO_MAX_UPLOAD_MB = float(os.getenv("VIDEO_MAX_UPLOAD_MB", "4096"))
+
+# Incident tracking (backend.incident_tracker): frames of a stream are merged into
+# incidents, and explanations / recommendations are requested once per incident
+INCIDENT_TRACKING_ENABLED = _env_bool("INCIDENT_TRACKING_ENABLED", True)
+# EWMA weight of the newest frame in the smoothed class probabilities
+INCIDENT_EWMA_ALPHA = float(os.getenv("INCIDENT_EWMA_ALPHA", "0.4"))
+# Smoothed score that opens an incident (for INCIDENT_MIN_FRAMES frames in a row)
+# and the lower score that keeps it open
+INCIDENT_OPEN_CONFIDENCE = float(os.getenv("INCIDENT_OPEN_CONFIDENCE", "0.7"))
+INCIDENT_CLOSE_CONFIDENCE = float(os.getenv("INCIDENT_CLOSE_CONFIDENCE", "0.5"))
+INCIDENT_MIN_FRAMES = int(os.getenv("INCIDENT_MIN_FRAMES", "2"))
+# Stream seconds without a supporting frame before an incident closes
+INCIDENT_GAP_SECONDS = float(os.getenv("INCIDENT_GAP_SECONDS", "5"))
+# Wall-clock seconds without any frame before a stream's incident closes
+INCIDENT_IDLE_SECONDS = float(os.getenv("INCIDENT_IDLE_SECONDS", "30"))
+INCIDENT_MAX_STREAMS = int(os.getenv("INCIDENT_MAX_STREAMS", "10000"))
+# Closed incidents kept for /api/incidents/tracked
+INCIDENT_TRACKER_KEEP = int(os.getenv("INCIDENT_TRACKER_KEEP", "1000"))
+# Generate recommendations for each new incident (with explanations enabled)
+INCIDENT_RECOMMENDATIONS = _env_bool("INCIDENT_RECOMMENDATIONS", True)
@@ -0,0 +1,128 @@
+"""
+Background startup of the API's subsystems.
+
+Each subsystem (model, warm-up, AI agent, chatbot, ...) is a named component
+with an async loader. StartupManager runs all loaders concurrently as soon as
+the server starts, so the process accepts connections (and answers /health and
+/ready) while the heavy imports and model loading happen. A loader can wait
+for another component with `await manager.wait(name)`.
+
+Components marked required gate readiness: /ready only reports ready once
+every required component has finished, i.e. the model is loaded and the
+inference path has been warmed up. Optional components (the LLM clients) are
+reported but never block traffic.
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+class ComponentFailed(Exception):
+    """Raised by StartupManager.wait when the awaited component failed to load."""
+
+
+class Component:
+    """One subsystem: its loader, state and timings."""
+
+    def __init__(self, name: str, loader: Callable[[], Awaitable], required: bool = True):
+        self.name = name
+        self.loader = loader
+        self.required = required
+        self.state = "pending"  # pending -> loading -> ready | failed
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.done = asyncio.Event()
+
+    @property
+    def seconds(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return end - self.started_at
+
+    def status(self) -> Dict:
+        return {
+            'state': self.state,
+            'required': self.required,
+            'seconds': round(self.seconds, 3) if self.seconds is not None else None,
+            'error': self.error
+        }
+
+
+class StartupManager:
+    """Loads registered components concurrently and tracks their progress."""
+
+    def __init__(self):
+        self._components: Dict[str, Component] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._started_at: Optional[float] = None
+        self.started = None
+
+    def register(self, name: str, loader: Callable[[], Awaitable], required: bool = True):
+        self._components[name] = Component(name, loader, required)
+
+    def start(self):
+        """Start every loader on the running event loop; returns immediately."""
+        self._started_at = time.perf_counter()
+        self.started = datetime.now().isoformat()
+        for component in self._components.values():
+            self._tasks.append(asyncio.get_running_loop().create_task(self._load(component)))
+
+    async def _load(self, component: Component):
+        component.state = "loading"
+        component.started_at = time.perf_counter()
+        try:
+            await component.loader()
+            component.state = "ready"
+            print(f"✓ {component.name} ready in {component.seconds:.2f}s")
+        except Exception as e:
+            component.state = "failed"
+            component.error = str(e)
+            print(f"⚠ Warning: Could not initialize {component.name}: {e}")
+        finally:
+            component.finished_at = time.perf_counter()
+            component.done.set()
+
+    async def wait(self, name: str):
+        """Wait until a component has loaded; raises ComponentFailed if it failed."""
+        component = self._components[name]
+        await component.done.wait()
+        if component.state != "ready":
+            raise ComponentFailed(f"{name} failed to load: {component.error}")
+
+    async def wait_all(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def state(self, name: str) -> str:
+        return self._components[name].state
+
+    @property
+    def ready(self) -> bool:
+        return all(c.state == "ready" for c in self._components.values() if c.required)
+
+    @property
+    def failed(self) -> bool:
+        return any(c.state == "failed" for c in self._components.values() if c.required)
+
+    def status(self) -> Dict:
+        finished = all(c.done.is_set() for c in self._components.values())
+        elapsed = None
+        if self._started_at is not None:
+            ends = [c.finished_at for c in self._components.values() if c.finished_at is not None]
+            end = max(ends) if finished and ends else time.perf_counter()
+            elapsed = round(end - self._started_at, 3)
+        return {
+            'ready': self.ready,
+            'status': "ready" if self.ready else ("failed" if self.failed else "starting"),
+            'started': self.started,
+            'elapsed_seconds': elapsed,
+            'components': {name: c.status() for name, c in self._components.items()}
+        }
@@ -0,0 +1,295 @@
+"""
+Streaming, class-balanced training input pipeline.
+
+Instead of materializing one balanced subset in memory before model.fit,
+every epoch draws a fresh stratified sample. Each crime class is capped at
+TARGET_SAMPLES_PER_CLASS and NormalVideos at NORMAL_VIDEOS_SAMPLES (default
+1.5x the target), as in DATASET_BALANCING_IMPROVEMENT.md. A large class is
+walked through a shuffled permutation across epochs, so successive epochs see
+different frames, and over enough epochs every one of the ~947K normal frames
+is used, rather than the same fixed subset each time.
+
+Images come from either source:
+- ManifestSource: the dataset manifest (backend.dataset_manifest); files are
+  read and decoded by a thread pool (OpenCV releases the GIL)
+- FeatureStoreSource: the memory-mapped feature store (backend.feature_store);
+  no decoding, rows are read straight from the shards
+
+A background thread keeps TRAINING_PREFETCH_BATCHES batches ready, so memory
+stays bounded by a few batches whatever the dataset size. Preprocessing is the
+serving path (BatchPreprocessor), so training and inference inputs match.
+
+    pipeline = BalancedPipeline(ManifestSource.from_manifest(load_manifest()))
+    model.fit(pipeline.repeat(), steps_per_epoch=pipeline.steps_per_epoch, epochs=EPOCHS)
+    # or: model.fit(pipeline.to_tf_dataset(), ...)
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend.config import (
+    BATCH_SIZE, DATASET_DIR, IMAGE_SIZE, NORMAL_VIDEOS_SAMPLES, TARGET_SAMPLES_PER_CLASS, USE_TRANSFER_LEARNING
+)
+from backend.preprocessing import BatchPreprocessor, decode_image
+from backend.serving_config import TRAINING_DECODE_WORKERS, TRAINING_PREFETCH_BATCHES
+
+NORMAL_CLASS = "NormalVideos"
+
+
+class ManifestSource:
+    """Images listed in the dataset manifest, decoded on demand."""
+
+    def __init__(self, paths: Sequence[str], labels: np.ndarray, class_names: List[str],
+                 target_size: Tuple[int, int] = IMAGE_SIZE, grayscale: bool = not USE_TRANSFER_LEARNING,
+                 workers: int = TRAINING_DECODE_WORKERS):
+        self.paths = np.asarray(paths, dtype=object)
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.class_names = class_names
+        self.target_size = tuple(target_size)
+        self.preprocessor = BatchPreprocessor(self.target_size, max_batch_size=1, grayscale=grayscale)
+        self.failed = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count(), thread_name_prefix="decode")
+
+    @classmethod
+    def from_manifest(cls, manifest, split: str = "Train", root=DATASET_DIR, **kwargs) -> "ManifestSource":
+        """Readable images of one split; labels follow the sorted class names, like LabelEncoder."""
+        images = manifest[(manifest['split'] == split) & (manifest['error'] == "")]
+        class_names = sorted(images['class'].unique())
+        index = {name: i for i, name in enumerate(class_names)}
+        paths = [os.path.join(str(root), path) for path in images['path']]
+        return cls(paths, images['class'].map(index).to_numpy(), class_names, **kwargs)
+
+    def _load_one(self, path: str, out: np.ndarray) -> bool:
+        try:
+            with open(path, 'rb') as f:
+                decoded = decode_image(f.read(), self.target_size)
+        except OSError:
+            return False
+        if decoded is None:
+            return False
+        self.preprocessor.pixels(decoded.pixels, out=out)
+        return True
+
+    def load(self, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(uint8 pixels, labels) of the given samples; images that fail to load are dropped."""
+        pixels = np.empty((len(indices), *self.target_size, self.preprocessor.channels), dtype=np.uint8)
+        loaded = list(self._pool.map(self._load_one, self.paths[indices], pixels))
+        if all(loaded):
+            return pixels, self.labels[indices]
+        keep = np.flatnonzero(loaded)
+        self.failed += len(loaded) - len(keep)
+        return pixels[keep], self.labels[indices][keep]
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class FeatureStoreSource:
+    """Images already decoded into a FeatureStore; loading is a read of memory-mapped rows."""
+
+    def __init__(self, store):
+        self.store = store
+        self.class_names = store.classes
+        self._class_ids, self._rows = store.samples()
+        self.labels = self._class_ids
+        self.preprocessor = BatchPreprocessor(store.image_size, max_batch_size=1, grayscale=store.grayscale)
+
+    def load(self, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return self.store.gather(self._class_ids[indices], self._rows[indices]), self.labels[indices]
+
+    def close(self):
+        pass
+
+
+class StratifiedEpochSampler:
+    """
+    Per-epoch class-balanced sample indices. Every class keeps its own shuffled
+    permutation; each epoch takes the next `cap` indices of it (wrapping around
+    and reshuffling at the end), so capped classes rotate through all their images.
+    """
+
+    def __init__(self, labels: np.ndarray, class_names: Sequence[str],
+                 target_per_class: int = TARGET_SAMPLES_PER_CLASS,
+                 normal_samples: Optional[int] = NORMAL_VIDEOS_SAMPLES, seed: int = 42):
+        if normal_samples is None:
+            normal_samples = int(target_per_class * 1.5)
+        self.rng = np.random.default_rng(seed)
+        self._members: Dict[int, np.ndarray] = {}
+        self._caps: Dict[int, int] = {}
+        self._cursors: Dict[int, int] = {}
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(len(class_names) + 1))
+        for class_id, name in enumerate(class_names):
+            members = order[bounds[class_id]:bounds[class_id + 1]]
+            if not len(members):
+                continue
+            self._members[class_id] = self.rng.permutation(members)
+            self._caps[class_id] = min(len(members), normal_samples if name == NORMAL_CLASS else target_per_class)
+            self._cursors[class_id] = 0
+
+    @property
+    def epoch_size(self) -> int:
+        return sum(self._caps.values())
+
+    def class_counts(self) -> Dict[int, int]:
+        return dict(self._caps)
+
+    def _take(self, class_id: int) -> np.ndarray:
+        members, cap, cursor = self._members[class_id], self._caps[class_id], self._cursors[class_id]
+        if cap == len(members):
+            return members
+        taken = members[cursor:cursor + cap]
+        cursor += cap
+        if len(taken) < cap:
+            # End of the permutation: reshuffle and continue from its start. The
+            # images already taken this epoch go last, so none is taken twice
+            rest = members[:len(members) - len(taken)]
+            self._members[class_id] = members = np.concatenate([self.rng.permutation(rest),
+                                                                self.rng.permutation(taken)])
+            cursor = cap - len(taken)
+            taken = np.concatenate([taken, members[:cursor]])
+        self._cursors[class_id] = cursor
+        return taken
+
+    def epoch(self) -> np.ndarray:
+        """Shuffled indices of the next epoch."""
+        indices = np.concatenate([self._take(class_id) for class_id in self._members])
+        self.rng.shuffle(indices)
+        return indices
+
+
+class BalancedPipeline:
+    """Batches of (float32 model input, labels) from a source, balanced and prefetched per epoch."""
+
+    def __init__(self, source, batch_size: int = BATCH_SIZE, target_per_class: int = TARGET_SAMPLES_PER_CLASS,
+                 normal_samples: Optional[int] = NORMAL_VIDEOS_SAMPLES, prefetch: int = TRAINING_PREFETCH_BATCHES,
+                 seed: int = 42):
+        self.source = source
+        self.batch_size = batch_size
+        self.prefetch = max(1, prefetch)
+        self.sampler = StratifiedEpochSampler(source.labels, source.class_names, target_per_class,
+                                              normal_samples, seed)
+        self.epochs_started = 0
+
+    @property
+    def steps_per_epoch(self) -> int:
+        return -(-self.sampler.epoch_size // self.batch_size)
+
+    @property
+    def class_names(self) -> List[str]:
+        return self.source.class_names
+
+    def _batches(self, indices: np.ndarray) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        for start in range(0, len(indices), self.batch_size):
+            pixels, labels = self.source.load(indices[start:start + self.batch_size])
+            if len(labels):
+                yield self.source.preprocessor.normalize(pixels), labels
+
+    def _prefetched(self, batches: Iterator) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Run a batch iterator on a background thread, keeping at most `prefetch` batches ready."""
+        ready: queue.Queue = queue.Queue(maxsize=self.prefetch)
+        done = object()
+        stop = threading.Event()
+
+        def offer(item) -> bool:
+            """Queue an item unless the consumer stops first; False once it has."""
+            while not stop.is_set():
+                try:
+                    ready.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for batch in batches:
+                    if not offer(batch):
+                        return
+                offer(done)
+            except BaseException as e:
+                offer(e)
+
+        producer = threading.Thread(target=produce, name="training-prefetch", daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = ready.get()
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # The consumer stopped early (e.g. Keras ended the epoch): let the producer exit
+            stop.set()
+
+    def epoch(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """One epoch of freshly sampled, balanced batches."""
+        self.epochs_started += 1
+        return self._prefetched(self._batches(self.sampler.epoch()))
+
+    def repeat(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Endless epochs, for model.fit(..., steps_per_epoch=pipeline.steps_per_epoch)."""
+        while True:
+            yield from self.epoch()
+
+    def to_tf_dataset(self):
+        """The endless stream as a tf.data.Dataset with TensorFlow-side prefetching."""
+        import tensorflow as tf
+
+        height, width = self.source.preprocessor.height, self.source.preprocessor.width
+        signature = (tf.TensorSpec((None, height, width, self.source.preprocessor.channels), tf.float32),
+                     tf.TensorSpec((None,), tf.int64))
+        return tf.data.Dataset.from_generator(self.repeat, output_signature=signature).prefetch(tf.data.AUTOTUNE)
+
+    def close(self):
+        self.source.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the streaming training pipeline (no training)")
+    parser.add_argument("--source", choices=["manifest", "feature-store"], default="manifest")
+    parser.add_argument("--manifest", help="Dataset manifest (default: DATASET_MANIFEST_PATH)")
+    parser.add_argument("--store", help="Feature store directory (default: the Train store)")
+    parser.add_argument("--split", default="Train")
+    parser.add_argument("--root", default=str(DATASET_DIR), help="Dataset directory the manifest paths are relative to")
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--steps", type=int, help="Stop each epoch after this many batches")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--target", type=int, default=TARGET_SAMPLES_PER_CLASS)
+    parser.add_argument("--normal-samples", type=int, default=NORMAL_VIDEOS_SAMPLES)
+    args = parser.parse_args()
+
+    if args.source == "manifest":
+        from backend.dataset_manifest import load_manifest
+        source = ManifestSource.from_manifest(load_manifest(args.manifest), args.split, args.root)
+    else:
+        from backend.feature_store import FeatureStore, default_store_path
+        source = FeatureStoreSource(FeatureStore.open(args.store or default_store_path(args.split)))
+
+    pipeline = BalancedPipeline(source, args.batch_size, args.target, args.normal_samples)
+    counts = pipeline.sampler.class_counts()
+    print(f"{len(source.labels)} images, {pipeline.sampler.epoch_size} per epoch "
+          f"({pipeline.steps_per_epoch} batches of {args.batch_size})")
+    for class_id, count in counts.items():
+        print(f"  {source.class_names[class_id]:<16} {count} of {int(np.sum(source.labels == class_id))}")
+
+    for epoch in range(args.epochs):
+        start = time.perf_counter()
+        images = 0
+        for step, (x, _) in enumerate(pipeline.epoch()):
+            images += len(x)
+            if args.steps and step + 1 >= args.steps:
+                break
+        seconds = time.perf_counter() - start
+        print(f"✓ Epoch {epoch + 1}: {images} images in {seconds:.1f}s ({images / seconds:.0f} images/s)")
+    if getattr(source, 'failed', 0):
+        print(f"⚠ {source.failed} images could not be read")
+    pipeline.close()
@@ -0,0 +1,298 @@
+"""
+Server-side video ingestion for /api/predict/video.
+
+Instead of the browser extracting frames and posting them one by one, the
+video file is uploaded once and decoded here with cv2.VideoCapture. The video
+is split into time chunks of VIDEO_CHUNK_SECONDS; each chunk is decoded by its
+own capture in the execution layer's CPU pool, several chunks at a time. A
+worker seeks to the start of its chunk and then only grab()s the frames that
+are not sampled; frames at the sampling rate are retrieve()d (converted to
+pixels) and shrunk to the model input size right away, so a decoded chunk is a
+handful of small arrays however long or high-resolution the video is.
+
+Sampled frames run through the model in batches of up to
+BATCH_PREDICT_CHUNK_SIZE, and the timeline is produced in video order while
+later chunks are still decoding. Offline review of long footage without the
+API server:
+
+    python -m backend.video_ingest recording.mp4 --sample-fps 1 --output timeline.ndjson
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from backend.config import IMAGE_SIZE
+from backend.metrics import get_metrics
+from backend.serving_config import (
+    BATCH_PREDICT_CHUNK_SIZE,
+    VIDEO_CHUNK_SECONDS,
+    VIDEO_DECODE_PARALLEL,
+    VIDEO_DECODE_THREADS,
+    VIDEO_MAX_UPLOAD_MB,
+    VIDEO_SAMPLE_FPS,
+)
+
+# Copy buffer when spooling an upload to disk
+_COPY_BUFFER = 1024 * 1024
+
+
+class VideoFormatError(ValueError):
+    """Raised when an upload cannot be opened as a video."""
+
+
+class VideoInfo(NamedTuple):
+    """Stream properties reported by the container; frame_count is 0 when unknown."""
+    fps: float
+    frame_count: int
+    width: int
+    height: int
+
+    @property
+    def duration(self) -> Optional[float]:
+        return self.frame_count / self.fps if self.frame_count > 0 else None
+
+
+class VideoFrame(NamedTuple):
+    """One sampled frame: its index, position in seconds and prediction result."""
+    frame: int
+    timestamp: float
+    result: Dict
+
+
+def open_capture(path: str, threads: int = VIDEO_DECODE_THREADS) -> cv2.VideoCapture:
+    """Open a capture; threads limits the decoder's own threads (0 = decoder default)."""
+    params = [cv2.CAP_PROP_N_THREADS, threads] if threads > 0 else []
+    capture = cv2.VideoCapture(path, cv2.CAP_ANY, params)
+    if not capture.isOpened():
+        capture.release()
+        raise VideoFormatError("Could not open the video file")
+    return capture
+
+
+def probe_video(path: str) -> VideoInfo:
+    capture = open_capture(path)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        if not fps or not math.isfinite(fps) or fps <= 0:
+            raise VideoFormatError("Video has no frame rate")
+        return VideoInfo(fps, max(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), 0),
+                         int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    finally:
+        capture.release()
+
+
+def plan_chunks(info: VideoInfo, chunk_seconds: float = VIDEO_CHUNK_SECONDS) -> List[Tuple[int, Optional[int]]]:
+    """[start, stop) frame ranges of about chunk_seconds; one open-ended chunk when the length is unknown."""
+    if info.frame_count <= 0:
+        return [(0, None)]
+    frames_per_chunk = max(int(round(chunk_seconds * info.fps)), 1)
+    return [(start, min(start + frames_per_chunk, info.frame_count))
+            for start in range(0, info.frame_count, frames_per_chunk)]
+
+
+def _shrink(frame: np.ndarray, target_size: Tuple[int, int]) -> np.ndarray:
+    """Resize to the model input like BatchPreprocessor does, so its own resize becomes a no-op."""
+    height, width = target_size
+    if frame.shape[0] >= height and frame.shape[1] >= width:
+        return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    return frame
+
+
+def decode_chunk(path: str, start: int, stop: Optional[int], step: float,
+                 target_size: Tuple[int, int] = IMAGE_SIZE) -> List[Tuple[int, np.ndarray]]:
+    """
+    (frame index, BGR pixels) of the sampled frames in [start, stop), where
+    frame floor(k * step) is sampled for every k. Frames in between are grabbed
+    but never converted. Module-level so it can run in a process pool.
+    """
+    capture = open_capture(path)
+    frames = []
+    try:
+        if start:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        position = int(capture.get(cv2.CAP_PROP_POS_FRAMES))
+        k = math.ceil(start / step)
+        while True:
+            target = int(k * step)
+            if stop is not None and target >= stop:
+                break
+            while position < target:
+                if not capture.grab():
+                    return frames
+                position += 1
+            if not capture.grab():
+                return frames
+            position += 1
+            ok, frame = capture.retrieve()
+            if ok:
+                frames.append((target, _shrink(frame, target_size)))
+            k += 1
+    finally:
+        capture.release()
+    return frames
+
+
+def spool_upload(source, suffix: str = "", max_bytes: int = int(VIDEO_MAX_UPLOAD_MB * 1024 * 1024)) -> str:
+    """Copy an uploaded file object to a temporary file (VideoCapture needs a path); returns the path."""
+    handle, path = tempfile.mkstemp(prefix="video-", suffix=suffix)
+    try:
+        written = 0
+        with os.fdopen(handle, 'wb') as target:
+            while True:
+                block = source.read(_COPY_BUFFER)
+                if not block:
+                    break
+                written += len(block)
+                if written > max_bytes:
+                    raise VideoFormatError(f"Video exceeds {max_bytes / (1024 * 1024):g} MB")
+                target.write(block)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+class VideoTimeline:
+    """Decodes video chunks in parallel and runs the sampled frames through the model in batches."""
+
+    def __init__(self, run_cpu: Callable[..., Awaitable], infer: Callable[[List], Awaitable[List[Dict]]],
+                 chunk_seconds: float = VIDEO_CHUNK_SECONDS, parallel: int = VIDEO_DECODE_PARALLEL,
+                 batch_size: int = BATCH_PREDICT_CHUNK_SIZE, target_size: Tuple[int, int] = IMAGE_SIZE):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.run_cpu = run_cpu
+        self.infer = infer
+        self.chunk_seconds = chunk_seconds
+        self.parallel = parallel or os.cpu_count() or 4
+        self.batch_size = batch_size
+        self.target_size = tuple(target_size)
+
+        self.videos = 0
+        self.chunks_decoded = 0
+        self.frames_processed = 0
+        self.video_seconds = 0.0
+
+    async def probe(self, path: str) -> VideoInfo:
+        return await self.run_cpu(probe_video, path)
+
+    async def frames(self, path: str, info: VideoInfo,
+                     sample_fps: float = VIDEO_SAMPLE_FPS) -> AsyncIterator[VideoFrame]:
+        """Yield a VideoFrame per sampled frame, in video order."""
+        if sample_fps <= 0:
+            raise ValueError("sample_fps must be positive")
+        # Never sample more often than every frame
+        step = max(info.fps / sample_fps, 1.0)
+        chunks = plan_chunks(info, self.chunk_seconds)
+        self.videos += 1
+        if info.duration:
+            self.video_seconds += info.duration
+
+        pending: List[asyncio.Future] = []
+        next_chunk = 0
+
+        def schedule():
+            nonlocal next_chunk
+            while next_chunk < len(chunks) and len(pending) < self.parallel:
+                start, stop = chunks[next_chunk]
+                pending.append(asyncio.ensure_future(self._decode(path, start, stop, step)))
+                next_chunk += 1
+
+        try:
+            schedule()
+            while pending:
+                decoded = await pending[0]
+                pending.pop(0)
+                # Refill the window before inference so decoding overlaps the forward passes
+                schedule()
+                for begin in range(0, len(decoded), self.batch_size):
+                    batch = decoded[begin:begin + self.batch_size]
+                    results = await self.infer([pixels for _, pixels in batch])
+                    self.frames_processed += len(batch)
+                    for (index, _), result in zip(batch, results):
+                        yield VideoFrame(index, round(index / info.fps, 3), result)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _decode(self, path: str, start: int, stop: Optional[int], step: float):
+        with get_metrics().stage("video_decode"):
+            decoded = await self.run_cpu(decode_chunk, path, start, stop, step, self.target_size)
+        self.chunks_decoded += 1
+        return decoded
+
+    def get_stats(self) -> Dict:
+        return {
+            'videos': self.videos,
+            'chunks_decoded': self.chunks_decoded,
+            'frames_processed': self.frames_processed,
+            'video_seconds': round(self.video_seconds, 1),
+            'chunk_seconds': self.chunk_seconds,
+            'parallel_chunks': self.parallel
+        }
+
+
+async def _review(path: str, sample_fps: float, output: Optional[str], workers: Optional[int]):
+    from backend.inference_backends import create_backend, model_factory
+    from backend.inference_scheduler import predict_images
+    from backend.preprocessing import BatchPreprocessor
+
+    model = model_factory()()
+    backend = create_backend(model)
+    preprocessor = BatchPreprocessor(max_batch_size=BATCH_PREDICT_CHUNK_SIZE)
+    loop = asyncio.get_running_loop()
+    decode_pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count(), thread_name_prefix="video")
+    inference_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+    async def run_cpu(fn, *args):
+        return await loop.run_in_executor(decode_pool, fn, *args)
+
+    async def infer(images):
+        return await loop.run_in_executor(inference_pool, predict_images, model, images, preprocessor, backend)
+
+    timeline = VideoTimeline(run_cpu, infer, parallel=workers or 0)
+    info = await timeline.probe(path)
+    duration = f"{info.duration:.0f}s" if info.duration else "unknown length"
+    print(f"Video: {info.width}x{info.height} at {info.fps:.2f} fps, {duration}")
+
+    out = open(output, 'w') if output else None
+    start = time.perf_counter()
+    counts: Dict[str, int] = {}
+    try:
+        async for frame in timeline.frames(path, info, sample_fps):
+            top = frame.result['top_prediction']
+            counts[top['class']] = counts.get(top['class'], 0) + 1
+            if out:
+                out.write(json.dumps({"timestamp": frame.timestamp, "frame": frame.frame, "prediction": top}) + "\n")
+    finally:
+        if out:
+            out.close()
+        decode_pool.shutdown(cancel_futures=True)
+        inference_pool.shutdown()
+
+    seconds = time.perf_counter() - start
+    frames = timeline.frames_processed
+    print(f"✓ {frames} frames in {seconds:.1f}s ({frames / seconds:.0f} frames/s, "
+          f"{timeline.chunks_decoded} chunks)")
+    for class_name, count in sorted(counts.items(), key=lambda item: -item[1]):
+        print(f"  {class_name:<16} {count:>7}")
+    if output:
+        print(f"✓ Timeline written to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predict a timeline for a video file without the API server")
+    parser.add_argument("video")
+    parser.add_argument("--sample-fps", type=float, default=VIDEO_SAMPLE_FPS)
+    parser.add_argument("--workers", type=int, help="Chunks decoded in parallel (default: one per CPU)")
+    parser.add_argument("--output", help="Write the timeline as NDJSON to this file")
+    args = parser.parse_args()
+    asyncio.run(_review(args.video, args.sample_fps, args.output, args.workers))
@@ -0,0 +1,457 @@
+"""
+End-to-end benchmark of the API.
+
+Starts the FastAPI app (uvicorn, optionally with several workers and the model
+server) with the stand-in model from benchmarks.standin_model and the local
+OpenAI-compatible stub (backend.llm_stub), then drives /api/predict,
+/api/predict/frame, /api/predict/batch and /api/chat with synthetic JPEG frames
+at several resolutions and concurrency levels:
+
+    python -m benchmarks.api_benchmark --endpoints predict frame batch chat \\
+        --resolutions vga 720p --concurrency 1 8 32 --duration 10 --output results.json
+
+Each scenario runs a closed loop (every client sends its next request as soon
+as the previous one returns) and reports throughput, p50/p95/p99 latency and
+the peak RSS of the server's process tree. Results are written as JSON;
+--compare baseline.json prints the change per scenario and exits with status 1
+when throughput or p95 latency regressed by more than --threshold.
+
+--url benchmarks an already running server instead (the real model, if it is
+loaded there); the server-side options are then ignored.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+
+from benchmarks.frames import make_frames
+
+ENDPOINTS = ("predict", "frame", "batch", "chat")
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+_CHAT_QUERIES = [
+    "What is the system status?",
+    "Show me recent alerts",
+    "What are the details of the stealing incident?",
+    "Which camera had the most incidents today?",
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Memory
+
+def _children(pid: int) -> List[int]:
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def tree_rss(pid: int) -> int:
+    """Resident memory of a process and all its descendants, in bytes."""
+    try:
+        import psutil
+    except ImportError:
+        total, pending = 0, [pid]
+        while pending:
+            current = pending.pop()
+            total += _rss_bytes(current)
+            pending.extend(_children(current))
+        return total
+    try:
+        root = psutil.Process(pid)
+        processes = [root] + root.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return 0
+    total = 0
+    for process in processes:
+        try:
+            total += process.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+class RSSSampler:
+    """Samples the RSS of a set of process trees on a background thread; peak() since the last reset."""
+
+    def __init__(self, pids: List[int], interval: float = 0.05):
+        self.pids = pids
+        self.interval = interval
+        self._peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, self.current())
+
+    def current(self) -> int:
+        return sum(tree_rss(pid) for pid in self.pids)
+
+    def reset(self):
+        self._peak = self.current()
+
+    def peak(self) -> int:
+        return max(self._peak, self.current())
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+# Server under test
+
+class ServerProcesses:
+    """The API (uvicorn), the LLM stub and, with several workers, the model server."""
+
+    def __init__(self, args):
+        self.args = args
+        self.processes: Dict[str, subprocess.Popen] = {}
+        self.api_port = _free_port()
+        self.url = f"http://127.0.0.1:{self.api_port}"
+
+    def _spawn(self, name: str, command: List[str], env: Dict[str, str]):
+        log = open(Path(self.args.log_dir) / f"{name}.log", "w") if self.args.log_dir else subprocess.DEVNULL
+        self.processes[name] = subprocess.Popen(command, env=env, cwd=ROOT_DIR, stdout=log, stderr=subprocess.STDOUT)
+
+    def start(self):
+        if self.args.log_dir:
+            Path(self.args.log_dir).mkdir(parents=True, exist_ok=True)
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT_DIR), env.get("PYTHONPATH")]))
+        env["STANDIN_BATCH_MS"] = str(self.args.model_batch_ms)
+        env["STANDIN_IMAGE_MS"] = str(self.args.model_image_ms)
+
+        llm_port = _free_port()
+        self._spawn("llm_stub", [sys.executable, "-m", "backend.llm_stub", "--port", str(llm_port),
+                                 "--latency-ms", str(self.args.llm_latency_ms)], env)
+
+        env.update({
+            "MODEL_FACTORY": "benchmarks.standin_model:get_model",
+            "LLM_BASE_URL": f"http://127.0.0.1:{llm_port}/v1",
+            "PREDICTION_CACHE_ENABLED": "true" if self.args.with_cache else "false",
+        })
+        if self.args.workers > 1:
+            model_port = _free_port()
+            self._spawn("model_server", [sys.executable, "-m", "backend.model_server", "--backend", "keras",
+                                         "--port", str(model_port)], env)
+            env.update({"INFERENCE_BACKEND": "remote", "MODEL_SERVER_PORT": str(model_port)})
+
+        self._spawn("api", [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1",
+                            "--port", str(self.api_port), "--workers", str(self.args.workers),
+                            "--log-level", "warning"], env)
+
+    async def wait_ready(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient(base_url=self.url, timeout=5.0) as client:
+            while time.monotonic() < deadline:
+                for name, process in self.processes.items():
+                    if process.poll() is not None:
+                        raise RuntimeError(f"{name} exited with status {process.returncode}")
+                try:
+                    response = await client.get("/ready")
+                    if response.status_code == 200:
+                        return response.json()
+                    if response.json().get("status") == "failed":
+                        raise RuntimeError(f"Server failed to start: {response.json()}")
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise TimeoutError(f"Server not ready after {timeout:.0f}s")
+
+    def pids(self) -> List[int]:
+        """The processes whose memory is reported: everything but the LLM stub."""
+        return [process.pid for name, process in self.processes.items() if name != "llm_stub"]
+
+    def stop(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+# Workload
+
+class Workload:
+    """Builds the request for one endpoint; returns (method kwargs, items per request)."""
+
+    def __init__(self, endpoint: str, frames: List[bytes], batch_files: int, explanations: bool):
+        self.endpoint = endpoint
+        self.frames = frames
+        self.encoded = [base64.b64encode(frame).decode() for frame in frames] if endpoint == "frame" else []
+        self.batch_files = batch_files
+        self.explanations = explanations
+        self._next = 0
+
+    def _frame_index(self) -> int:
+        index = self._next % len(self.frames)
+        self._next += 1
+        return index
+
+    def build(self):
+        if self.endpoint == "predict":
+            frame = self.frames[self._frame_index()]
+            return dict(url="/api/predict", params={"include_explanation": self.explanations},
+                        files={"file": ("frame.jpg", frame, "image/jpeg")}), 1
+        if self.endpoint == "frame":
+            index = self._frame_index()
+            return dict(url="/api/predict/frame", json={
+                "frame_data": self.encoded[index], "include_explanation": self.explanations,
+                "timestamp": index / 30.0, "stream_id": "bench"}), 1
+        if self.endpoint == "batch":
+            files = [("files", (f"frame{i}.jpg", self.frames[self._frame_index()], "image/jpeg"))
+                     for i in range(self.batch_files)]
+            return dict(url="/api/predict/batch", params={"format": "json"}, files=files), self.batch_files
+        query = _CHAT_QUERIES[self._next % len(_CHAT_QUERIES)]
+        self._next += 1
+        return dict(url="/api/chat", json={"query": query, "session_id": f"bench-{self._next % 16}"}), 1
+
+
+def percentiles(latencies: List[float]) -> Dict:
+    if not latencies:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'mean_ms': None, 'max_ms': None}
+    values = np.asarray(latencies) * 1000.0
+    return {
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'mean_ms': round(float(values.mean()), 3),
+        'max_ms': round(float(values.max()), 3)
+    }
+
+
+async def run_scenario(client: httpx.AsyncClient, workload: Workload, concurrency: int, duration: float,
+                       max_requests: Optional[int], warmup: int, sampler: Optional[RSSSampler]) -> Dict:
+    for _ in range(warmup):
+        request, _ = workload.build()
+        await client.post(**request)
+
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    counters = {'issued': 0, 'items': 0}
+    deadline = time.perf_counter() + duration
+
+    async def client_loop():
+        while time.perf_counter() < deadline:
+            if max_requests is not None and counters['issued'] >= max_requests:
+                return
+            counters['issued'] += 1
+            request, items = workload.build()
+            start = time.perf_counter()
+            try:
+                response = await client.post(**request)
+                await response.aread()
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            if status == 200:
+                latencies.append(elapsed)
+                counters['items'] += items
+            else:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    if sampler:
+        sampler.reset()
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(wall, 3),
+        'requests_per_second': round(len(latencies) / wall, 3) if wall else 0.0,
+        'items_per_second': round(counters['items'] / wall, 3) if wall else 0.0,
+        'latency': percentiles(latencies),
+        'peak_rss_mb': round(sampler.peak() / 2 ** 20, 1) if sampler else None
+    }
+
+
+async def run_benchmark(args) -> Dict:
+    frames = make_frames(args.resolutions, args.frames_per_resolution) if set(args.endpoints) - {"chat"} else {}
+    server = None
+    sampler = None
+    url = args.url
+    if not url:
+        server = ServerProcesses(args)
+        server.start()
+    try:
+        if server:
+            readiness = await server.wait_ready(args.startup_timeout)
+            print(f"✓ Server ready in {readiness.get('elapsed_seconds')}s at {server.url}")
+            url = server.url
+            sampler = RSSSampler(server.pids())
+            sampler.start()
+        print_header()
+
+        limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+        scenarios = []
+        async with httpx.AsyncClient(base_url=url, timeout=args.request_timeout, limits=limits) as client:
+            for endpoint in args.endpoints:
+                for resolution in (["-"] if endpoint == "chat" else args.resolutions):
+                    for concurrency in args.concurrency:
+                        workload = Workload(endpoint, frames.get(resolution, []), args.batch_files,
+                                            args.with_explanations)
+                        result = await run_scenario(client, workload, concurrency, args.duration, args.requests,
+                                                    args.warmup, sampler)
+                        result.update({'endpoint': endpoint, 'resolution': resolution, 'concurrency': concurrency})
+                        scenarios.append(result)
+                        print_scenario(result)
+            stats = (await client.get("/api/stats")).json()
+    finally:
+        if sampler:
+            sampler.stop()
+        if server:
+            server.stop()
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key not in ("compare", "output")}
+        },
+        'scenarios': scenarios,
+        'server_stats': stats
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Reporting
+
+def scenario_key(scenario: Dict) -> str:
+    return f"{scenario['endpoint']}/{scenario['resolution']}/c{scenario['concurrency']}"
+
+
+def _fmt(value, spec: str) -> str:
+    return format(value, spec) if value is not None else "-"
+
+
+def print_header():
+    print(f"{'scenario':<24} {'req/s':>9} {'items/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'errors':>7} {'peak RSS MB':>12}")
+
+
+def print_scenario(scenario: Dict):
+    latency = scenario['latency']
+    print(f"{scenario_key(scenario):<24} {scenario['requests_per_second']:>9.1f} {scenario['items_per_second']:>9.1f} "
+          f"{_fmt(latency['p50_ms'], '>9.2f')} {_fmt(latency['p95_ms'], '>9.2f')} {_fmt(latency['p99_ms'], '>9.2f')} "
+          f"{sum(scenario['errors'].values()):>7} {_fmt(scenario['peak_rss_mb'], '>12.1f')}")
+
+
+def compare_results(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Prints the change per scenario; returns the scenarios that regressed by more than threshold."""
+    previous = {scenario_key(s): s for s in baseline['scenarios']}
+    regressions = []
+    print(f"\nCompared with {baseline['meta'].get('git_commit')} ({baseline['meta'].get('timestamp')}):")
+    print(f"{'scenario':<24} {'req/s':>9} {'change':>8} {'p95 ms':>9} {'change':>8}")
+    for scenario in current['scenarios']:
+        key = scenario_key(scenario)
+        before = previous.get(key)
+        if before is None:
+            continue
+        throughput = _change(scenario['requests_per_second'], before['requests_per_second'])
+        p95 = _change(scenario['latency']['p95_ms'], before['latency']['p95_ms'])
+        flag = ""
+        if (throughput is not None and throughput < -threshold) or (p95 is not None and p95 > threshold):
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print(f"{key:<24} {scenario['requests_per_second']:>9.1f} {_fmt(throughput, '>+8.1%')} "
+              f"{_fmt(scenario['latency']['p95_ms'], '>9.2f')} {_fmt(p95, '>+8.1%')}{flag}")
+    return regressions
+
+
+def _change(current, before) -> Optional[float]:
+    if current is None or not before:
+        return None
+    return current / before - 1.0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end API benchmark with a stand-in model and LLM stub")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--resolutions", nargs="+", default=["vga", "720p"],
+                        help="qvga, vga, 720p, 1080p or WIDTHxHEIGHT")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per scenario")
+    parser.add_argument("--requests", type=int, help="Stop a scenario after this many requests")
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed requests before each scenario")
+    parser.add_argument("--frames-per-resolution", type=int, default=32)
+    parser.add_argument("--batch-files", type=int, default=16, help="Images per /api/predict/batch request")
+    parser.add_argument("--with-explanations", action="store_true", help="Request LLM explanations with predictions")
+    parser.add_argument("--with-cache", action="store_true", help="Keep the prediction cache enabled")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers (>1 also starts the model server)")
+    parser.add_argument("--model-batch-ms", type=float, default=5.0, help="Stand-in model cost per call")
+    parser.add_argument("--model-image-ms", type=float, default=1.0, help="Stand-in model cost per image")
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0)
+    parser.add_argument("--url", help="Benchmark a running server instead of starting one")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--log-dir", help="Write the server processes' output here")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline results JSON to compare with")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative throughput drop / p95 increase counted as a regression")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmark(args))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✓ Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_results(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"⚠ {len(regressions)} scenario(s) regressed: {', '.join(regressions)}")
+            sys.exit(1)
@@ -0,0 +1,63 @@
+"""
+Synthetic camera frames for the benchmarks.
+
+Frames combine a gradient background, a few filled shapes and sensor-like
+noise, so their JPEG size and decode cost are close to real footage, and every
+frame is different (the prediction cache's near-duplicate matching cannot
+short-circuit them unless asked to).
+"""
+from typing import Dict, List, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+RESOLUTIONS = {
+    "qvga": (240, 320),
+    "vga": (480, 640),
+    "720p": (720, 1280),
+    "1080p": (1080, 1920),
+}
+
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    """(height, width) from a name in RESOLUTIONS or WIDTHxHEIGHT."""
+    if value in RESOLUTIONS:
+        return RESOLUTIONS[value]
+    width, height = value.lower().split("x")
+    return int(height), int(width)
+
+
+def synthetic_frame(height: int, width: int, rng: np.random.Generator) -> np.ndarray:
+    """One BGR frame."""
+    ys = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    xs = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    base = rng.uniform(40, 200, 3).astype(np.float32)
+    tilt = rng.uniform(-60, 60, 3).astype(np.float32)
+    frame = base + tilt * (ys[..., None] * 0.6 + xs[..., None] * 0.4)
+
+    image = np.clip(frame, 0, 255).astype(np.uint8)
+    for _ in range(rng.integers(3, 8)):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size = int(rng.integers(min(height, width) // 20, min(height, width) // 4))
+        if rng.random() < 0.5:
+            cv2.rectangle(image, (x, y), (x + size, y + size // 2), color, -1)
+        else:
+            cv2.circle(image, (x, y), size // 2, color, -1)
+
+    noise = rng.normal(0, 6, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def encode_jpeg(frame: np.ndarray, quality: int = 85) -> bytes:
+    return cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+def make_frames(resolutions: Sequence[str], per_resolution: int = 16, seed: int = 0) -> Dict[str, List[bytes]]:
+    """JPEG-encoded frames keyed by resolution name."""
+    rng = np.random.default_rng(seed)
+    frames = {}
+    for name in resolutions:
+        height, width = parse_resolution(name)
+        frames[name] = [encode_jpeg(synthetic_frame(height, width, rng)) for _ in range(per_resolution)]
+    return frames
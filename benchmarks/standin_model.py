@@ -0,0 +1,75 @@
+"""
+Tiny stand-in for CrimeDetectionModel, used by the benchmarks instead of the
+trained Keras model (no TensorFlow needed).
+
+The "network" pools the input into an 8x8 grid and applies a fixed random
+projection and a softmax, so outputs depend on the image. STANDIN_BATCH_MS and
+STANDIN_IMAGE_MS add a fixed per-call and per-image cost to emulate the real
+network's compute. Select it with MODEL_FACTORY=benchmarks.standin_model:get_model.
+"""
+import os
+import time
+
+import numpy as np
+
+from backend.config import IMAGE_SIZE, USE_TRANSFER_LEARNING
+
+CLASS_NAMES = ['Abuse', 'Arrest', 'Arson', 'Assault', 'Burglary', 'Explosion', 'Fighting', 'NormalVideos',
+               'RoadAccidents', 'Robbery', 'Shooting', 'Shoplifting', 'Stealing', 'Vandalism']
+
+STANDIN_BATCH_MS = float(os.getenv("STANDIN_BATCH_MS", "5"))
+STANDIN_IMAGE_MS = float(os.getenv("STANDIN_IMAGE_MS", "1"))
+
+_GRID = 8
+
+
+class StandInNetwork:
+    """Callable like a Keras model: batch (N, H, W, C) float32 -> probabilities (N, classes)."""
+
+    def __init__(self, channels: int, classes: int, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.weights = rng.normal(0, 1, (_GRID * _GRID * channels, classes)).astype(np.float32)
+        self.input_shape = (None, *IMAGE_SIZE, channels)
+
+    def __call__(self, batch, training=False):
+        batch = np.asarray(batch, dtype=np.float32)
+        count, height, width, channels = batch.shape
+        pooled = batch[:, :height - height % _GRID, :width - width % _GRID].reshape(
+            count, _GRID, height // _GRID, _GRID, width // _GRID, channels).mean(axis=(2, 4))
+        logits = pooled.reshape(count, -1) @ self.weights
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        time.sleep((STANDIN_BATCH_MS + STANDIN_IMAGE_MS * count) / 1000.0)
+        return probabilities
+
+    def predict(self, batch, verbose=0):
+        return self(batch)
+
+
+class _LabelEncoder:
+    def __init__(self, classes):
+        self.classes_ = np.array(classes)
+
+
+class StandInModel:
+    """Exposes the parts of CrimeDetectionModel the API uses."""
+
+    def __init__(self):
+        channels = 3 if USE_TRANSFER_LEARNING else 1
+        self.model = StandInNetwork(channels, len(CLASS_NAMES))
+        self.label_encoder = _LabelEncoder(CLASS_NAMES)
+        self.model_path = "stand-in"
+        self.loaded = True
+
+
+# Global stand-in model instance
+_model_instance = None
+
+
+def get_model():
+    """Get or create the global stand-in model."""
+    global _model_instance
+    if _model_instance is None:
+        _model_instance = StandInModel()
+    return _model_instance
@@ -1,27 +1,25 @@
-import os
-from PIL import Image
-import glob
+"""
+Dataset check: scans datasets/Train and datasets/Test into the dataset manifest
+(headers only, in parallel, reusing unchanged entries) and prints an inventory
+per class. See backend/dataset_manifest.py for the manifest and class balancing.
+"""
+import sys
 
-def check_image_sizes(base_path, num_samples=5):
-    print(f"Checking images in {base_path}...")
-    # Get all class directories
-    classes = [d for d in os.listdir(base_path) if os.path.isdir(os.path.join(base_path, d))]
-    
-    for class_name in classes:
-        class_path = os.path.join(base_path, class_name)
-        images = glob.glob(os.path.join(class_path, "*.*"))
-        
-        print(f"\nClass: {class_name} - Total images: {len(images)}")
-        
-        # Check first few images
-        for img_path in images[:num_samples]:
-            try:
-                with Image.open(img_path) as img:
-                    print(f"  {os.path.basename(img_path)}: {img.size} (Mode: {img.mode})")
-            except Exception as e:
-                print(f"  Could not read {os.path.basename(img_path)}: {e}")
+from backend.dataset_manifest import build_manifest, print_summary, summarize
 
-print("--- TRAIN DATA ---")
-check_image_sizes("datasets/Train", num_samples=3)
-print("\n--- TEST DATA ---")
-check_image_sizes("datasets/Test", num_samples=3)
+
+def check_images(root="datasets", splits=("Train", "Test")):
+    manifest, stats = build_manifest(root, splits)
+    print(f"Scanned {stats['images']} images in {stats['seconds']}s "
+          f"({stats['read']} read, {stats['reused']} reused from {stats['path']})\n")
+    print_summary(summarize(manifest))
+
+    unreadable = manifest[manifest['error'] != ""]
+    for row in unreadable.head(20).itertuples():
+        print(f"  Could not read {row.path}: {row.error}")
+    if len(unreadable) > 20:
+        print(f"  ... and {len(unreadable) - 20} more")
+
+
+if __name__ == "__main__":
+    check_images(*sys.argv[1:2])
@@ -0,0 +1,61 @@
+import asyncio
+
+from backend.batch_prediction import ByteBudget, iter_uploads
+
+BOUNDARY = "testboundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def multipart_body(files):
+    body = b""
+    for name, data in files:
+        body += (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"files\"; filename=\"{name}\"\r\n"
+                 f"Content-Type: image/jpeg\r\n\r\n").encode() + data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+async def chunked(body, size):
+    for start in range(0, len(body), size):
+        # Interleave the concurrent readers like separate connections would
+        await asyncio.sleep(0)
+        yield body[start:start + size]
+
+
+async def receive(body, budget, chunk_size=64000, hold_seconds=0.0):
+    async def process(upload):
+        # Stands in for decoding and inference, which keep the file charged
+        await asyncio.sleep(hold_seconds)
+        budget.release(upload.charged)
+
+    received, processing = [], []
+    async for upload in iter_uploads(chunked(body, chunk_size), CONTENT_TYPE, budget, 10_000_000):
+        received.append(len(upload.data))
+        processing.append(asyncio.create_task(process(upload)))
+    await asyncio.gather(*processing)
+    return received
+
+
+def test_concurrent_partial_files_do_not_exhaust_the_budget():
+    # Three files that together exceed the budget, each received in many chunks
+    budget = ByteBudget(1_000_000)
+    body = multipart_body([("a.jpg", b"x" * 840_000)])
+
+    async def run():
+        return await asyncio.wait_for(asyncio.gather(*(receive(body, budget) for _ in range(3))), timeout=10)
+
+    assert asyncio.run(run()) == [[840_000]] * 3
+    assert budget.used == 0
+
+
+def test_files_after_the_first_still_wait_for_the_budget():
+    budget = ByteBudget(200_000)
+    body = multipart_body([(f"{i}.jpg", b"x" * 50_000) for i in range(20)])
+
+    async def run():
+        return await asyncio.wait_for(asyncio.gather(*(receive(body, budget, 16_000, hold_seconds=0.01) for _ in range(4))), timeout=10)
+
+    assert asyncio.run(run()) == [[50_000] * 20] * 4
+    assert budget.waits > 0
+    # Past the budget by at most the rest of one file per reader
+    assert budget.peak <= 200_000 + 4 * (50_000 + 16_000)
+    assert budget.used == 0
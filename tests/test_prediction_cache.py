@@ -0,0 +1,21 @@
+from backend.prediction_cache import PredictionCache
+
+
+def test_perceptual_hit_stores_exact_key():
+    cache = PredictionCache()
+    cache.put('a', {'predicted_class': 'Fighting'}, phash=0b1111)
+
+    assert cache.get_similar(0b1110, 'b') == {'predicted_class': 'Fighting'}
+    assert cache.get('b') == {'predicted_class': 'Fighting'}
+
+    # Attaching an explanation to the alias leaves the matched entry alone
+    cache.update('b', {'predicted_class': 'Fighting', 'explanation': 'stored'})
+    assert cache.get('b')['explanation'] == 'stored'
+    assert 'explanation' not in cache.get('a')
+
+
+def test_perceptual_hits_return_copies():
+    cache = PredictionCache()
+    cache.put('a', {'predicted_class': 'Fighting'}, phash=0b1111)
+    cache.get_similar(0b1110, 'b')['predicted_class'] = 'Arson'
+    assert cache.get('a')['predicted_class'] == 'Fighting'